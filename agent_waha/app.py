@@ -1,56 +1,64 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from services.waha import Waha
-from services.agent_graph_imovel import AgentMobi
-from services.steve_bot import AgentMike_Graph
-from services.bot2 import AgentCmdr
-from services.agent_restaurante import AgentRestaurante, atualizar_status_pedido
+from services.fila_envio import PRIORIDADE_PAGAMENTO
+from services.fila_mensagens import FilaMensagens, TurnoJaIniciado
+from services.despachante import DespachanteConversas
+from services.metricas import registro
+from services.registro_agentes import RegistroAgentes
+from services.streaming import DivisorMensagens
+from services.temporizacao import iniciar_turno
+from services.deduplicacao import CacheDeduplicacao
+from services.mongo import get_db
+from services.eventos import (
+    PayloadInvalido, formatar_mensagem_whatsapp, extrair_mensagem_waha,
+    extrair_resposta, extrair_pagamento_asaas,
+)
 import time
 import random
-from langchain_core.prompts.chat import AIMessage,HumanMessage
-from langchain_core.messages import ToolMessage
-from services.memory import get_memory, create_db_schema
-from langgraph.checkpoint.sqlite import SqliteSaver
 import logging
 import datetime
 import ssl
 import os
-import urllib.parse
 from dotenv import load_dotenv,find_dotenv
-from pymongo import MongoClient
+from langchain_core.messages import AIMessageChunk
 
 load_dotenv(find_dotenv())
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-MONGO_USER = urllib.parse.quote_plus(os.getenv('MONGO_USER'))
-MONGO_PASS = urllib.parse.quote_plus(os.getenv('MONGO_PASS'))
-client = MongoClient("mongodb+srv://%s:%s@cluster0.gjkin5a.mongodb.net/?retryWrites=true&w=majority&appName=Cluster0" % (MONGO_USER, MONGO_PASS))
-db = client.restaurante_db
-coll3 = db.pedidos
-
-def formatar_mensagem_whatsapp(texto: str) -> str:
-    """
-    Ajusta a formatação para o padrão do WhatsApp.
-    - Transforma **negrito** (markdown) em *negrito* (WhatsApp)
-    - Remove excesso de espaços ou caracteres inválidos, se quiser expandir
-    """
-    return texto.replace("**", "*")
 
 app = Flask(__name__)
 
-#agent_4 = AgentRastreamento(DB_PATH4)
-agent_5 = AgentMobi()
-agent_6 = AgentMike_Graph()
-agent_1 = AgentCmdr()
-agent_4 = AgentRestaurante()
-
-
-
-#model_4 = agent_4.memory_agent()
-model_5 = agent_5.memory_agent()
-model_6 = agent_6.memory_agent()
-model_1 = agent_1.memory_agent()
-model_4 = agent_4.memory_agent()
-
+# Os agentes só são importados e compilados no primeiro uso da rota (ou no aquecimento),
+# assim a subida do app não faz nenhuma chamada de rede
+agentes = RegistroAgentes()
+agentes.registrar("AGENT5", "services.agent_graph_imovel", "AgentMobi")
+agentes.registrar("AGENT6", "services.steve_bot", "AgentMike_Graph")
+agentes.registrar("AGENT1", "services.bot2", "AgentCmdr")
+agentes.registrar("AGENT4", "services.agent_restaurante", "AgentRestaurante")
+
+# Agentes construídos em segundo plano logo após a subida (ex.: "AGENT4,AGENT1")
+AGENTES_AQUECER = [nome.strip() for nome in os.getenv("AGENTES_AQUECER", "").split(",") if nome.strip()]
+
+FILA_DB_PATH = os.getenv("FILA_DB_PATH", "fila_mensagens.db")
+FILA_WORKERS = int(os.getenv("FILA_WORKERS", "4"))
+# Janela (s) para juntar mensagens seguidas do mesmo chat em um único turno; 0 desativa
+JANELA_AGRUPAMENTO = float(os.getenv("JANELA_AGRUPAMENTO", "1.5"))
+fila = FilaMensagens(FILA_DB_PATH)
+# Turnos da mesma conversa (thread_id) rodam em ordem; conversas diferentes em paralelo
+despachante = DespachanteConversas(max_workers=FILA_WORKERS)
+
+# Ids de mensagens do WAHA já recebidos; DEDUP_MONGO=1 também persiste no Mongo (índice TTL)
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", "3600"))
+deduplicacao = CacheDeduplicacao(
+    ttl=DEDUP_TTL,
+    obter_colecao=(lambda: get_db().webhook_dedup) if os.getenv("DEDUP_MONGO") == "1" else None,
+)
+
+# Atraso "humano" (s) antes de enviar a resposta, sorteado entre mínimo e máximo (ex.: "3,10")
+ATRASO_RESPOSTA = tuple(int(v) for v in os.getenv("ATRASO_RESPOSTA", "3,10").split(","))
+
+# STREAMING_RESPOSTAS=1 envia a resposta em partes (parágrafos) conforme o LLM gera
+STREAMING_RESPOSTAS = os.getenv("STREAMING_RESPOSTAS") == "1"
 
 def agent_memory(agent_model, input: str, thread_id: str, date: str = None):
     try:
@@ -68,93 +76,122 @@ def agent_memory(agent_model, input: str, thread_id: str, date: str = None):
         result = agent_model.invoke(inputs, config)
         print(f"Resultado bruto do grafo: {result}")
 
-        # 3) Extrai a lista interna
-        raw = result.get("messages") if isinstance(result, dict) else result
+        # 3) Retorna o conteúdo da última mensagem útil
+        return extrair_resposta(result)
+
+    except Exception as e:
+        logging.error(f"Erro ao invocar o agente: {str(e)}")
+        raise
+
+def agent_memory_streaming(agent_model, input: str, thread_id: str, enviar):
+    """
+    Executa o grafo em modo streaming e chama `enviar(trecho)` a cada parágrafo
+    completo da resposta do nó chatbot. Mensagens do LLM que pedem tools ficam
+    retidas (o cliente só vê o texto final). Retorna quantos trechos foram enviados.
+    """
+    if not thread_id:
+        raise ValueError("thread_id é obrigatório no config.")
+
+    inputs = {"messages": [{"role": "user", "content": input}]}
+    config = {"configurable": {"thread_id": thread_id}}
+
+    enviados = 0
+    mensagem_atual = None
+    divisor = DivisorMensagens()
+    chamando_tool = False
+
+    def _fechar_mensagem():
+        nonlocal enviados
+        resto = None if chamando_tool else divisor.finalizar()
+        divisor.descartar()
+        if resto:
+            enviar(resto)
+            enviados += 1
+
+    try:
+        for chunk, metadata in agent_model.stream(inputs, config, stream_mode="messages"):
+            if metadata.get("langgraph_node") != "chatbot" or not isinstance(chunk, AIMessageChunk):
+                continue
+
+            if chunk.id != mensagem_atual:
+                _fechar_mensagem()
+                mensagem_atual = chunk.id
+                chamando_tool = False
+
+            if chunk.tool_call_chunks:
+                # Turno de tool: nada desse texto vai para o cliente
+                chamando_tool = True
+                divisor.descartar()
+                continue
 
-        # 4) Converte cada mensagem em dict simples
-        msgs = []
-        for m in raw:
-            if isinstance(m, (HumanMessage, AIMessage, ToolMessage)):
-                msgs.append({"role": m.type, "content": m.content})
-            elif isinstance(m, dict):
-                msgs.append(m)
-            else:
-                msgs.append({"role": getattr(m, "role", "assistant"), "content": str(m)})
+            if chamando_tool or not isinstance(chunk.content, str):
+                continue
 
-        # 5) Retorna o conteúdo da última mensagem útil
-        ultima = msgs[-1] if msgs else {"content": "⚠️ Nenhuma resposta gerada."}
-        return ultima["content"]
+            for trecho in divisor.adicionar(chunk.content):
+                enviar(trecho)
+                enviados += 1
+
+        _fechar_mensagem()
+
+        # Resposta que não veio do nó chatbot (ou veio sem streaming): envia o estado final
+        if enviados == 0:
+            estado = agent_model.get_state(config)
+            enviar(extrair_resposta(estado.values))
+            enviados = 1
+
+        return enviados
 
     except Exception as e:
-        logging.error(f"Erro ao invocar o agente: {str(e)}")
+        logging.error(f"Erro ao invocar o agente em streaming: {str(e)}")
         raise
 
 @app.route('/chatbot/webhook/imobiliaria/', methods=['POST'])
 def webhook_5():
-    return process_message(model_5, "AGENT5", 'imobiliaria')
+    return process_message("AGENT5", 'imobiliaria')
 
 @app.route('/chatbot/webhook/policial/', methods=['POST'])
 def webhook_6():
-    return process_message(model_6, "AGENT6", 'policial')
+    return process_message("AGENT6", 'policial')
 
 @app.route('/chatbot/webhook/comodoro/', methods=['POST'])
 def webhook_1():
-    return process_message(model_1, "AGENT1", 'cmdr')
+    return process_message("AGENT1", 'cmdr')
 
 @app.route('/chatbot/webhook/restaurante/', methods=['POST'])
 def webhook_4():
-    return process_message(model_4, "AGENT4", 'restaurante')
+    return process_message("AGENT4", 'restaurante')
 
 @app.route('/webhook', methods=['POST'])
 def asaas_webhook():
     data = request.json
     print("Webhook do Asaas recebido:", data)
 
-    # Só processa pagamento confirmado
-    if data.get("event") != "PAYMENT_RECEIVED":
-        return jsonify({"status": "ignored"}), 200
-
-    description = data["payment"].get("description", "")
-
-    # Exemplo: "Pedido #d815e354 - Vinícius - (11)91234-5678 - Pirão Burger"
-    import re
-    padrao = r"Pedido\s+#(\w+)\s*-\s*(.*?)\s*-\s*(.*?)\s*-"
-    match = re.search(padrao, description)
-
-    if not match:
-        print("⚠️ Formato inesperado de description:", description)
+    try:
+        pagamento = extrair_pagamento_asaas(data)
+    except PayloadInvalido as e:
+        print("⚠️", e)
         return jsonify({"status": "error", "message": "Formato inválido de description"}), 400
 
-    id_pedido = match.group(1).strip()
-    nome_cliente = match.group(2).strip()
-    telefone = match.group(3).strip()
-
-    # Aqui você pode normalizar o telefone para padrão internacional (ex: 55DDDNUMERO)
-    telefone_formatado = telefone.replace("(", "").replace(")", "").replace("-", "").replace(" ", "")
-    if not telefone_formatado.startswith("55"):
-        telefone_formatado = "55" + telefone_formatado  # adiciona DDI Brasil
+    # Só processa pagamento confirmado
+    if pagamento is None:
+        return jsonify({"status": "ignored"}), 200
 
-    # Mensagem personalizada
-    mensagem = (
-        f"*Pagamento confirmado!* 🎉\n\n"
-        f"✅ Pedido *#{id_pedido}*\n"
-        f"👤 Cliente: *{nome_cliente}*\n"
-        f"📞 Telefone: {telefone}\n\n"
-        f"Obrigado por comprar no Pirão Burger, Seu pedido já foi encaminhado para cozinha 🍔🔥"
-    )
+    id_pedido = pagamento["id_pedido"]
+    chat_id = pagamento["chat_id"]
+    mensagem = pagamento["mensagem"]
 
     try:
+        # Import tardio: carregar o módulo do restaurante abre conexões com Mongo/Asaas
+        from services.agent_restaurante import atualizar_status_pedido
         atualizar_status_pedido(id_pedido, "Enviado para cozinha")
         waha = Waha()
         session = "restaurante"  # ajuste conforme sua sessão do Waha
-        chat_id = telefone_formatado + "@c.us"
 
-        waha.start_typing(chat_id=chat_id, session=session)
-        time.sleep(random.randint(2, 5))
-        waha.send_message(chat_id, mensagem, session)
-        waha.stop_typing(chat_id=chat_id, session=session)
+        # Digitação simulada sem prender a thread do webhook
+        waha.send_message_with_typing(chat_id, mensagem, session, delay=random.randint(2, 5),
+                                      prioridade=PRIORIDADE_PAGAMENTO)
 
-        print(f"Mensagem enviada para {chat_id}: {mensagem}")
+        print(f"Mensagem agendada para {chat_id}: {mensagem}")
 
     except Exception as e:
         print("❌ Erro ao enviar mensagem no WhatsApp:", e)
@@ -162,43 +199,142 @@ def asaas_webhook():
 
     return jsonify({"status": "success"}), 200
  
-def process_message(agent, agent_name, session):#, memory):
+def process_message(agent_name, session):
+    """
+    Valida o evento do WAHA e coloca na fila. O turno do agente roda nos workers,
+    então o webhook responde imediatamente.
+    """
     data = request.json
     print(f'EVENTO RECEBIDO ({agent_name}): {data}')
 
-    hoje = datetime.date.today().isoformat()  # Obtenha a data aqui
-
     try:
-        chat_id = data['payload']['from']
-        received_message = data['payload']['body']
-        
-    except KeyError as e:
-        print(f"Erro ao acessar dados do payload: {e}")
-        return jsonify({'status': 'error', 'message': f"Erro ao acessar dados do payload: {e}"}), 400
-
-    # Evitar spam de eventos irrelevantes
-    is_group = '@g.us' in chat_id
-    is_status = 'status@broadcast' in chat_id
-    msg_type = data['payload'].get('_data', {}).get('type')
-    msg_subtype = data['payload'].get('_data', {}).get('subtype')
-
-    if is_group or is_status or msg_type != 'chat' or msg_subtype == 'encrypt' or not received_message:
+        evento = extrair_mensagem_waha(data)
+    except PayloadInvalido as e:
+        print(e)
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    if evento is None:
         return jsonify({'status': 'ignored'}), 200
 
+    chat_id = evento["chat_id"]
+    received_message = evento["mensagem"]
+
+    # Retentativas do WAHA chegam com o mesmo id: descarta antes de qualquer trabalho do grafo
+    message_id = evento["message_id"]
+    chave_dedup = f"{session}:{message_id}" if message_id else None
+    if chave_dedup and not deduplicacao.registrar(chave_dedup):
+        print(f"[DEDUP] Evento duplicado ignorado: {message_id}")
+        return jsonify({'status': 'duplicate'}), 200
+
     try:
-        resposta = agent_memory(agent_model=agent, input=received_message, thread_id=chat_id, date=hoje)
-        print(f"Resposta gerada: {resposta}")
+        fila.enfileirar({
+            "agent_name": agent_name,
+            "session": session,
+            "chat_id": chat_id,
+            "mensagem": received_message,
+            "data": datetime.date.today().isoformat(),
+        })
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        # O evento não ficou na fila: a retentativa do WAHA precisa passar pela deduplicação
+        if chave_dedup:
+            deduplicacao.esquecer(chave_dedup)
+        logging.error(f"Erro ao enfileirar evento de {chat_id}: {e}")
+        return jsonify({'status': 'error', 'message': 'fila indisponível'}), 503
+
+    return jsonify({'status': 'queued'}), 200
+
+def processar_evento(eventos: list):
+    """
+    Executa um único turno do agente para os eventos de um chat (já agrupados pela
+    janela de agrupamento). Retorna a função que envia a resposta: a fila só a chama
+    depois de confirmar os eventos, então uma falha no Waha não repete o turno.
+    Falhas antes do grafo (carregar o agente) voltam para a fila; depois que o
+    grafo começa, viram TurnoJaIniciado e o evento não é repetido.
+    """
+    ultimo = eventos[-1]
+    agent = agentes.obter(ultimo["agent_name"])
+    chat_id = ultimo["chat_id"]
+    session = ultimo["session"]
+
+    # Várias mensagens seguidas viram uma só HumanMessage
+    mensagem = "\n".join(evento["mensagem"] for evento in eventos)
+    if len(eventos) > 1:
+        print(f"[AGRUPADOR] {len(eventos)} mensagens de {chat_id} juntadas em um turno")
 
     waha = Waha()
-    waha.start_typing(chat_id=chat_id, session=session)
-    resposta_format = formatar_mensagem_whatsapp(resposta)
-    time.sleep(random.randint(3, 10))
-    waha.send_message(chat_id, resposta_format, session)
-    waha.stop_typing(chat_id=chat_id, session=session)
 
-    return jsonify({'status': 'success'}), 200
+    if STREAMING_RESPOSTAS:
+        def digitando(ligar):
+            # "digitando..." é só visual: uma falha aqui não pode derrubar (e repetir) o turno
+            try:
+                if ligar:
+                    waha.start_typing(chat_id=chat_id, session=session)
+                else:
+                    waha.stop_typing(chat_id=chat_id, session=session)
+            except Exception as e:
+                print(f"⚠️ Erro ao atualizar digitação de {chat_id}: {e}")
+
+        # Cada parágrafo sai assim que fica pronto; o "digitando..." cobre o resto da geração
+        digitando(True)
+
+        def enviar(trecho):
+            # A fila de saída tem as próprias retentativas; aqui só se enfileira
+            waha.enqueue_message(chat_id, formatar_mensagem_whatsapp(trecho), session)
+            digitando(True)
+
+        try:
+            with iniciar_turno(agente=ultimo["agent_name"], chat_id=chat_id, mensagens=len(eventos)):
+                enviados = agent_memory_streaming(agent, mensagem, chat_id, enviar)
+            print(f"Resposta enviada em {enviados} parte(s) para {chat_id}")
+        except Exception as e:
+            # Trechos já enfileirados e tools já executadas: o evento não pode rodar de novo
+            raise TurnoJaIniciado(str(e)) from e
+        finally:
+            digitando(False)
+        return None
+
+    # Daqui em diante o grafo roda: uma falha não pode repetir o turno (pedido e checkpoint já gravados)
+    try:
+        # Tempos por nó, tool, LLM, HTTP e Mongo vão para /metrics e para a linha [TURNO] do log
+        with iniciar_turno(agente=ultimo["agent_name"], chat_id=chat_id, mensagens=len(eventos)):
+            resposta = agent_memory(agent_model=agent, input=mensagem, thread_id=chat_id, date=ultimo["data"])
+        print(f"Resposta gerada: {resposta}")
+
+        resposta_format = formatar_mensagem_whatsapp(resposta)
+    except Exception as e:
+        raise TurnoJaIniciado(str(e)) from e
+
+    def enviar_resposta():
+        # O atraso "humano" fica no agendador; o worker já fica livre para o próximo turno
+        waha.send_message_with_typing(chat_id, resposta_format, session, delay=random.randint(*ATRASO_RESPOSTA))
+
+    return enviar_resposta
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(registro.renderizar(), mimetype='text/plain; version=0.0.4')
+
+def processo_consumidor() -> bool:
+    """
+    Se este processo deve consumir a fila. O reloader do Flask (flask run --debug,
+    app.run(debug=True)) importa o app também no processo vigia, que não atende
+    requisições: só o filho (WERKZEUG_RUN_MAIN=true) consome. FILA_CONSUMIDOR=0/1 força.
+    """
+    forcado = os.getenv("FILA_CONSUMIDOR")
+    if forcado is not None:
+        return forcado == "1"
+    if os.getenv("WERKZEUG_RUN_MAIN") == "true":
+        return True
+    com_reloader = __name__ == "__main__" or os.getenv("FLASK_DEBUG", "").lower() in ("1", "true")
+    return not com_reloader
+
+
+if processo_consumidor():
+    fila.iniciar_consumidor(despachante, processar_evento,
+                           chave=lambda evento: f"{evento['agent_name']}:{evento['chat_id']}",
+                           janela=JANELA_AGRUPAMENTO)
+    if AGENTES_AQUECER:
+        agentes.aquecer(AGENTES_AQUECER)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
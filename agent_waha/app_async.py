@@ -0,0 +1,228 @@
+"""
+Variante ASGI do agent_waha para o agente do restaurante.
+
+Tudo que espera rede é assíncrono: o grafo roda com `ainvoke`, o checkpoint usa
+AsyncMongoDBSaver (motor) e o "digitando..." é um asyncio.sleep. Assim um processo
+segura centenas de conversas aguardando a OpenAI em vez de uma por thread. O Waha
+passa pelo mesmo transporte, fila de saída e cache de contatos do app Flask.
+
+Executar com:
+    uvicorn app_async:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import os
+import random
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv, find_dotenv
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from services.waha_async import WahaAsync
+from services.metricas import registro
+from services.deduplicacao import CacheDeduplicacao
+from services.mongo import get_db, montar_uri, MonitorComandos
+from services.temporizacao import iniciar_turno
+from services.eventos import (
+    PayloadInvalido, formatar_mensagem_whatsapp, extrair_mensagem_waha,
+    extrair_resposta, extrair_pagamento_asaas,
+)
+
+load_dotenv(find_dotenv())
+
+WAHA_API_URL = os.getenv("WAHA_API_URL", "http://waha:3000")
+SESSION = "restaurante"
+# Limite de turnos rodando ao mesmo tempo no processo
+MAX_TURNOS_SIMULTANEOS = int(os.getenv("MAX_TURNOS_SIMULTANEOS", "200"))
+
+metrica_turno = registro.histograma("turno_async_segundos", "Duração do ainvoke do grafo")
+metrica_em_andamento = registro.medidor("turnos_async_em_andamento", "Turnos aguardando ou rodando")
+
+deduplicacao = CacheDeduplicacao(
+    ttl=int(os.getenv("DEDUP_TTL", "3600")),
+    obter_colecao=(lambda: get_db().webhook_dedup) if os.getenv("DEDUP_MONGO") == "1" else None,
+)
+
+
+class LocksPorChave:
+    """asyncio.Lock por chave, removido quando ninguém mais está usando."""
+
+    def __init__(self):
+        self._locks = {}  # chave -> [lock, usuarios]
+
+    @asynccontextmanager
+    async def travar(self, chave: str):
+        entrada = self._locks.setdefault(chave, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                yield
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                self._locks.pop(chave, None)
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class Estado:
+    waha: WahaAsync = None
+    modelo = None
+    lock_modelo = asyncio.Lock()
+    turnos = asyncio.Semaphore(MAX_TURNOS_SIMULTANEOS)
+    conversas = LocksPorChave()  # um turno por vez por chat
+    envios = LocksPorChave()  # respostas do mesmo chat saem na ordem dos turnos
+    tarefas = set()
+
+
+async def obter_modelo():
+    """Constrói o AgentRestaurante com checkpointer assíncrono no primeiro uso."""
+    if Estado.modelo is not None:
+        return Estado.modelo
+    async with Estado.lock_modelo:
+        if Estado.modelo is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            from langgraph.checkpoint.mongodb.aio import AsyncMongoDBSaver
+
+            db = AsyncIOMotorClient(montar_uri(), event_listeners=[MonitorComandos()])[os.getenv("MONGO_DB", "restaurante_db")]
+            # Mesma coleção base do MongoDBSaver síncrono, para as conversas continuarem de onde pararam
+            checkpointer = AsyncMongoDBSaver(db.memoria_chat)
+
+            def _construir():
+                from services.agent_restaurante import AgentRestaurante
+                return AgentRestaurante(checkpointer=checkpointer).memory_agent()
+
+            # O import e a construção do agente ainda fazem I/O síncrono: roda fora do event loop
+            Estado.modelo = await asyncio.to_thread(_construir)
+    return Estado.modelo
+
+
+def _em_segundo_plano(coro):
+    tarefa = asyncio.create_task(coro)
+    Estado.tarefas.add(tarefa)
+    tarefa.add_done_callback(Estado.tarefas.discard)
+    metrica_em_andamento.set(len(Estado.tarefas))
+    return tarefa
+
+
+async def _enviar_em_ordem(chat_id: str, mensagem: str, delay: float):
+    async with Estado.envios.travar(chat_id):
+        try:
+            enviado = await Estado.waha.send_message_with_typing(chat_id, mensagem, SESSION, delay)
+        except Exception as e:
+            print(f"[ASYNC] Erro ao enviar para {chat_id}: {e}")
+            return
+        if not enviado:
+            print(f"[ASYNC] Mensagem para {chat_id} não confirmada pelo Waha (resultado: {enviado})")
+
+
+async def executar_turno(chat_id: str, mensagem: str, chave_dedup: str = None):
+    """
+    Um turno do grafo. Falhas antes do grafo começar liberam o evento na
+    deduplicação, para a retentativa do WAHA ser aceita; depois que o grafo
+    começa (tools e checkpoint já podem ter gravado) o evento não é repetido.
+    """
+    grafo_iniciado = False
+    try:
+        async with Estado.turnos, Estado.conversas.travar(chat_id):
+            modelo = await obter_modelo()
+            inputs = {"messages": [{"role": "user", "content": mensagem}]}
+            config = {"configurable": {"thread_id": chat_id}}
+            inicio = asyncio.get_running_loop().time()
+            grafo_iniciado = True
+            with iniciar_turno(agente="AGENT4", chat_id=chat_id):
+                result = await modelo.ainvoke(inputs, config)
+            metrica_turno.observe(asyncio.get_running_loop().time() - inicio)
+            resposta = formatar_mensagem_whatsapp(extrair_resposta(result))
+            print(f"Resposta gerada: {resposta}")
+            # Agenda ainda dentro do lock da conversa para preservar a ordem das respostas
+            _em_segundo_plano(_enviar_em_ordem(chat_id, resposta, random.randint(3, 10)))
+    except Exception as e:
+        if grafo_iniciado:
+            print(f"[ASYNC] Erro no turno de {chat_id} depois do grafo começar, evento não será repetido: {e}")
+        else:
+            print(f"[ASYNC] Erro no turno de {chat_id} antes do grafo, evento liberado para reenvio: {e}")
+            if chave_dedup:
+                await asyncio.to_thread(deduplicacao.esquecer, chave_dedup)
+    finally:
+        metrica_em_andamento.set(len(Estado.tarefas))
+
+
+async def webhook_restaurante(request):
+    data = await request.json()
+    print(f'EVENTO RECEBIDO (AGENT4): {data}')
+
+    try:
+        evento = extrair_mensagem_waha(data)
+    except PayloadInvalido as e:
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=400)
+
+    if evento is None:
+        return JSONResponse({'status': 'ignored'})
+
+    message_id = evento["message_id"]
+    chave_dedup = f"{SESSION}:{message_id}" if message_id else None
+    if chave_dedup and not await asyncio.to_thread(deduplicacao.registrar, chave_dedup):
+        return JSONResponse({'status': 'duplicate'})
+
+    try:
+        # Sem agente não há turno: responde 503 para o WAHA reenviar o evento
+        await obter_modelo()
+    except Exception as e:
+        if chave_dedup:
+            await asyncio.to_thread(deduplicacao.esquecer, chave_dedup)
+        print(f"[ASYNC] Agente indisponível para {evento['chat_id']}: {e}")
+        return JSONResponse({'status': 'error', 'message': 'agente indisponível'}, status_code=503)
+
+    _em_segundo_plano(executar_turno(evento["chat_id"], evento["mensagem"], chave_dedup))
+    return JSONResponse({'status': 'queued'})
+
+
+async def asaas_webhook(request):
+    data = await request.json()
+    print("Webhook do Asaas recebido:", data)
+
+    try:
+        pagamento = extrair_pagamento_asaas(data)
+    except PayloadInvalido as e:
+        print("⚠️", e)
+        return JSONResponse({"status": "error", "message": "Formato inválido de description"}, status_code=400)
+
+    if pagamento is None:
+        return JSONResponse({"status": "ignored"})
+
+    try:
+        def _atualizar_status():
+            # Import tardio (abre conexões) também fica fora do event loop
+            from services.agent_restaurante import atualizar_status_pedido
+            atualizar_status_pedido(pagamento["id_pedido"], "Enviado para cozinha")
+
+        await asyncio.to_thread(_atualizar_status)
+        _em_segundo_plano(_enviar_em_ordem(pagamento["chat_id"], pagamento["mensagem"], random.randint(2, 5)))
+    except Exception as e:
+        print("❌ Erro ao enviar mensagem no WhatsApp:", e)
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+    return JSONResponse({"status": "success"})
+
+
+async def metrics(request):
+    return PlainTextResponse(registro.renderizar(), media_type='text/plain; version=0.0.4')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    Estado.waha = WahaAsync(WAHA_API_URL)
+    if os.getenv("AGENTES_AQUECER"):
+        _em_segundo_plano(obter_modelo())
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/chatbot/webhook/restaurante/', webhook_restaurante, methods=['POST']),
+        Route('/webhook', asaas_webhook, methods=['POST']),
+        Route('/metrics', metrics, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,464 @@
+"""
+Benchmark offline do bot do restaurante.
+
+Reproduz webhooks do WAHA contra a rota /chatbot/webhook/restaurante/ do app.py
+(process_message -> fila -> despachante -> AgentRestaurante -> Waha) sem OpenAI
+nem WhatsApp: o LLM é o ModeloRoteirizado, o Waha é o fake_waha.py e o Mongo é
+um servidor local (ou mongomock, em memória).
+
+Cada conversa espera a resposta de um turno antes de mandar a próxima mensagem;
+as conversas começam na taxa pedida. A latência do turno vai do POST do webhook
+até o /api/sendText chegar ao Waha falso.
+
+Com --grafo os turnos vão direto para o grafo do AgentRestaurante (sem Flask,
+fila, despachante nem Waha), para medir só o custo do próprio grafo
+(checkpoint, cópias do state, despacho das tools, Mongo); o resultado traz o
+tempo médio por turno de cada etapa (nós, tools, LLM, HTTP falso e Mongo).
+Maps, Asaas e a busca vetorial são sempre os de services/servicos_fake.py.
+
+Exemplos:
+    python benchmark.py --conversas 50 --taxa 5
+    python benchmark.py --arquivo webhooks.jsonl --taxa 2 --saida resultado.json
+    python benchmark.py --memoria --conversas 20
+    python benchmark.py --grafo --roteiro misto --conversas 50 --taxa 20
+"""
+import argparse
+import json
+import math
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from pymongo import monitoring
+from fake_waha import ServidorWahaFake
+
+SESSION = "restaurante"
+ROTA = "/chatbot/webhook/restaurante/"
+
+# Cardápio mínimo para processar_pedido_full encontrar os produtos
+CARDAPIO = [
+    {"nome": "Smash Burger", "categoria": "Hambúrgueres", "preco": 25.0, "disponivel": True,
+     "adicionais": [{"nome": "Bacon", "preco": 4.0}, {"nome": "Cheddar", "preco": 3.0}]},
+    {"nome": "Pirão Burger", "categoria": "Hambúrgueres", "preco": 32.0, "disponivel": True,
+     "adicionais": [{"nome": "Bacon", "preco": 4.0}, {"nome": "Ovo", "preco": 2.5}]},
+    {"nome": "Batata Frita", "categoria": "Porções", "preco": 15.0, "disponivel": True, "adicionais": []},
+    {"nome": "Refrigerante Lata", "categoria": "Bebidas", "preco": 6.0, "disponivel": True, "adicionais": []},
+]
+
+# Diálogo de pedido completo usado nas conversas sintetizadas
+ROTEIRO_PEDIDO = [
+    "Oi, boa noite!",
+    "Meu nome é Cliente {n}",
+    "Quero dois smash burger com bacon",
+    "Só isso",
+    "Retirada",
+    "Dinheiro, vou pagar com 100",
+]
+
+# Pedido com entrega e PIX: passa por material de apoio, Maps e Asaas (falsos)
+ROTEIRO_ENTREGA = [
+    "Oi, boa noite!",
+    "Meu nome é Cliente {n}",
+    "Vocês entregam no centro?",
+    "Quero um pirão burger e uma batata frita",
+    "Só isso",
+    "Entrega",
+    "Rua Sete de Setembro, {n}, Centro",
+    "Pix",
+]
+
+
+class ContadorComandosMongo(monitoring.CommandListener):
+    """
+    Conta os comandos enviados ao Mongo (find, insert, update...) por nome e os
+    documentos escritos por coleção (para medir, por exemplo, as gravações de checkpoint).
+    """
+
+    IGNORAR = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue", "buildInfo"}
+    # Comando de escrita -> campo com a lista de documentos/operações
+    ESCRITAS = {"insert": "documents", "update": "updates", "delete": "deletes", "findAndModify": None}
+
+    def __init__(self):
+        self.comandos = Counter()
+        self.escritas = Counter()
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in self.IGNORAR:
+            return
+        escritas = 0
+        if event.command_name in self.ESCRITAS:
+            campo = self.ESCRITAS[event.command_name]
+            escritas = len(event.command.get(campo) or []) if campo else 1
+        with self._lock:
+            self.comandos[event.command_name] += 1
+            if escritas:
+                self.escritas[event.command.get(event.command_name)] += escritas
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def zerar(self):
+        with self._lock:
+            self.comandos.clear()
+            self.escritas.clear()
+
+    def total(self) -> int:
+        return sum(self.comandos.values())
+
+
+def checkpointer_contado():
+    """
+    MemorySaver que conta as gravações que iriam para o Mongo (checkpoints e
+    escritas pendentes), para o --memoria também medir o custo do checkpoint.
+    """
+    from langgraph.checkpoint.memory import MemorySaver
+
+    class MemorySaverContado(MemorySaver):
+        def __init__(self):
+            super().__init__()
+            self.gravacoes = Counter()
+            self._lock_contagem = threading.Lock()
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            with self._lock_contagem:
+                self.gravacoes["checkpoints"] += 1
+            return super().put(config, checkpoint, metadata, new_versions)
+
+        def put_writes(self, config, writes, task_id, task_path=""):
+            with self._lock_contagem:
+                self.gravacoes["checkpoint_writes"] += len(writes)
+            return super().put_writes(config, writes, task_id, task_path)
+
+        def zerar(self):
+            with self._lock_contagem:
+                self.gravacoes.clear()
+
+    return MemorySaverContado()
+
+
+class CaixaRespostas:
+    """Respostas recebidas pelo Waha falso, separadas por chat."""
+
+    def __init__(self):
+        self._filas = {}
+        self._lock = threading.Lock()
+
+    def _fila(self, chat_id):
+        with self._lock:
+            return self._filas.setdefault(chat_id, queue.Queue())
+
+    def entregar(self, chat_id, texto):
+        self._fila(chat_id).put((time.time(), texto))
+
+    def aguardar(self, chat_id, timeout):
+        return self._fila(chat_id).get(timeout=timeout)
+
+
+class Resultados:
+    def __init__(self):
+        self.latencias = []
+        self.falhas = 0
+        self.ignorados = 0
+        self.etapas = {}  # "tipo:nome" -> [quantidade, segundos] somados de todos os turnos (--grafo)
+        self._lock = threading.Lock()
+
+    def turno(self, latencia, etapas=None):
+        with self._lock:
+            self.latencias.append(latencia)
+            for chave, etapa in (etapas or {}).items():
+                soma = self.etapas.setdefault(chave, [0, 0.0])
+                soma[0] += etapa["n"]
+                soma[1] += etapa["s"]
+
+    def falha(self):
+        with self._lock:
+            self.falhas += 1
+
+    def ignorado(self):
+        with self._lock:
+            self.ignorados += 1
+
+
+def percentil(valores, p):
+    """Percentil pelo método nearest-rank."""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def montar_evento(chat_id, texto, message_id):
+    return {
+        "event": "message",
+        "session": SESSION,
+        "payload": {"id": message_id, "from": chat_id, "body": texto, "_data": {"type": "chat"}},
+    }
+
+
+def sintetizar_conversas(quantidade, roteiro="retirada"):
+    conversas = []
+    for n in range(quantidade):
+        chat_id = f"55169{n:08d}@c.us"
+        entrega = roteiro == "entrega" or (roteiro == "misto" and n % 2)
+        eventos = [
+            montar_evento(chat_id, texto.format(n=n), f"bench_{n}_{i}")
+            for i, texto in enumerate(ROTEIRO_ENTREGA if entrega else ROTEIRO_PEDIDO)
+        ]
+        conversas.append(eventos)
+    return conversas
+
+
+def carregar_conversas(caminho):
+    """Lê webhooks gravados (um JSON por linha) e agrupa por chat, mantendo a ordem."""
+    por_chat = OrderedDict()
+    with open(caminho, encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            linha = linha.strip()
+            if not linha:
+                continue
+            evento = json.loads(linha)
+            chat_id = evento.get("payload", {}).get("from")
+            por_chat.setdefault(chat_id, []).append(evento)
+    return list(por_chat.values())
+
+
+def configurar_ambiente(args, waha_url):
+    """Variáveis lidas pelo app.py no import; precisam existir antes dele."""
+    os.environ["WAHA_API_URL"] = waha_url
+    os.environ["MONGO_URI"] = "mongomock://" if args.memoria else args.mongo_uri
+    os.environ["MONGO_DB"] = args.mongo_db
+    os.environ["FILA_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_fila_"), "fila.db")
+    os.environ["FILA_WORKERS"] = str(args.workers)
+    os.environ["JANELA_AGRUPAMENTO"] = str(args.janela)
+    os.environ["ATRASO_RESPOSTA"] = "0,0"
+    os.environ["STREAMING_RESPOSTAS"] = "0"
+    # Maps, Asaas, busca vetorial e embeddings sem rede (services/servicos_fake.py)
+    os.environ["SERVICOS_EXTERNOS"] = "fake"
+    # Fora da medição: com respostas guardadas, as conversas repetidas deixariam de chamar o LLM
+    os.environ["CACHE_FAQ"] = "0"
+    os.environ["ENVIO_TAXA"] = str(args.envio_taxa)
+    os.environ["ENVIO_RAJADA"] = str(max(1, int(args.envio_taxa)))
+    os.environ["MEMORIA_TURNOS"] = str(args.memoria_turnos)
+    os.environ["CHECKPOINT_ADIADO"] = "1" if args.checkpoint == "adiado" else "0"
+    os.environ.pop("AGENTES_AQUECER", None)
+    os.environ.pop("DEDUP_MONGO", None)
+    # O módulo do agente cria o cliente de embeddings no import; a chave nunca é usada
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+
+def preparar_banco(args):
+    from services.mongo import get_client, get_db
+
+    if args.mongo_db == "restaurante_db":
+        sys.exit("Recusando rodar o benchmark no banco de produção (restaurante_db); use --mongo-db")
+    get_client().drop_database(args.mongo_db)
+    get_db().produtos.insert_many([dict(produto) for produto in CARDAPIO])
+
+
+def rodar_conversa(cliente, conversa, caixa, resultados, args):
+    for evento in conversa:
+        chat_id = evento["payload"]["from"]
+        inicio = time.time()
+        resposta = cliente.post(ROTA, json=evento)
+        status = (resposta.get_json() or {}).get("status")
+        if status != "queued":
+            resultados.ignorado()
+            continue
+        try:
+            recebido_em, _ = caixa.aguardar(chat_id, args.timeout)
+        except queue.Empty:
+            resultados.falha()
+            continue
+        resultados.turno(recebido_em - inicio)
+        if args.pausa:
+            time.sleep(args.pausa)
+
+
+def rodar_conversa_grafo(modelo, conversa, resultados, args):
+    """Mesma conversa, mas cada turno é um invoke direto no grafo compilado."""
+    from services.temporizacao import iniciar_turno
+
+    for evento in conversa:
+        payload = evento.get("payload", {})
+        chat_id = payload.get("from")
+        if not chat_id or not payload.get("body"):
+            resultados.ignorado()
+            continue
+        entradas = {"messages": [{"role": "user", "content": payload["body"]}]}
+        config = {"configurable": {"thread_id": chat_id}}
+        try:
+            inicio = time.time()
+            with iniciar_turno(agente="AGENT4", chat_id=chat_id) as turno:
+                modelo.invoke(entradas, config)
+            resultados.turno(time.time() - inicio, turno.resumo()["etapas"])
+        except Exception:
+            resultados.falha()
+            continue
+        if args.pausa:
+            time.sleep(args.pausa)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline do AgentRestaurante")
+    parser.add_argument("--arquivo", help="JSONL com webhooks do WAHA gravados (um por linha)")
+    parser.add_argument("--conversas", type=int, default=20, help="conversas sintetizadas (sem --arquivo)")
+    parser.add_argument("--taxa", type=float, default=2.0, help="conversas iniciadas por segundo")
+    parser.add_argument("--pausa", type=float, default=0.0, help="tempo (s) do cliente entre receber e responder")
+    parser.add_argument("--latencia-llm", type=float, default=0.0, help="latência simulada (s) de cada chamada ao LLM")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--envio-taxa", type=float, default=1000.0,
+                        help="ENVIO_TAXA (mensagens/s por sessão); o padrão alto tira o limitador da medição")
+    parser.add_argument("--waha-latencia", type=float, default=0.0, help="latência (s) de cada chamada ao Waha fake")
+    parser.add_argument("--waha-taxa-erro", type=float, default=0.0, help="fração das chamadas ao Waha que dão 500")
+    parser.add_argument("--waha-limite", type=float, help="sendText por segundo no Waha fake antes do 429")
+    parser.add_argument("--latencia-externos", type=float, default=0.0,
+                        help="latência (s) de cada chamada falsa ao Maps, Asaas e busca vetorial")
+    parser.add_argument("--roteiro", choices=("retirada", "entrega", "misto"), default="retirada",
+                        help="diálogo das conversas sintetizadas (misto alterna os dois)")
+    parser.add_argument("--grafo", action="store_true",
+                        help="invoca o grafo direto, sem Flask, fila nem Waha (custo do próprio grafo)")
+    parser.add_argument("--janela", type=float, default=0.0, help="JANELA_AGRUPAMENTO do app")
+    parser.add_argument("--memoria-turnos", type=int, default=6,
+                        help="MEMORIA_TURNOS do agente (turnos mantidos literais; 0 = histórico inteiro)")
+    parser.add_argument("--checkpoint", choices=("adiado", "imediato"), default="adiado",
+                        help="CHECKPOINT_ADIADO do agente: um checkpoint gravado por turno ou um por super-step")
+    parser.add_argument("--timeout", type=float, default=60.0, help="espera máxima (s) por uma resposta")
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--mongo-db", default="restaurante_bench")
+    parser.add_argument("--memoria", action="store_true",
+                        help="mongomock + MemorySaver no lugar do Mongo (sem contagem de operações)")
+    parser.add_argument("--saida", help="grava o resultado em JSON neste caminho")
+    parser.add_argument("--verboso", action="store_true", help="mostra os prints do bot")
+    args = parser.parse_args()
+
+    caixa = CaixaRespostas()
+    waha = ServidorWahaFake(ao_enviar=caixa.entregar, sessao=SESSION, latencia=args.waha_latencia,
+                            taxa_erro=args.waha_taxa_erro, limite_envios=args.waha_limite)
+    configurar_ambiente(args, waha.iniciar())
+
+    contador = ContadorComandosMongo()
+    monitoring.register(contador)
+
+    stdout = sys.stdout
+    if not args.verboso:
+        sys.stdout = open(os.devnull, "w")
+
+    try:
+        from services.modelo_fake import ModeloRoteirizado
+        from services.servicos_fake import ServicosExternosFake
+        from services import agent_restaurante
+
+        preparar_banco(args)
+        externos = ServicosExternosFake(latencia=args.latencia_externos)
+        agent_restaurante.usar_servicos_externos(externos)
+
+        kwargs = {"llm": ModeloRoteirizado(latencia=args.latencia_llm), "registrar_webhook": False}
+        checkpointer = None
+        if args.memoria:
+            checkpointer = kwargs["checkpointer"] = checkpointer_contado()
+
+        inicio_construcao = time.time()
+        if args.grafo:
+            modelo = agent_restaurante.AgentRestaurante(**kwargs).memory_agent()
+        else:
+            import app as aplicacao
+            aplicacao.agentes.registrar("AGENT4", "services.agent_restaurante", "AgentRestaurante", **kwargs)
+            aplicacao.agentes.obter("AGENT4")
+        construcao = time.time() - inicio_construcao
+
+        conversas = (carregar_conversas(args.arquivo) if args.arquivo
+                     else sintetizar_conversas(args.conversas, args.roteiro))
+        resultados = Resultados()
+        contador.zerar()
+        if checkpointer is not None:
+            checkpointer.zerar()
+
+        threads = []
+        inicio = time.time()
+        for i, conversa in enumerate(conversas):
+            atraso = inicio + i / args.taxa - time.time()
+            if atraso > 0:
+                time.sleep(atraso)
+            if args.grafo:
+                alvo, argumentos = rodar_conversa_grafo, (modelo, conversa, resultados, args)
+            else:
+                alvo, argumentos = rodar_conversa, (aplicacao.app.test_client(), conversa, caixa, resultados, args)
+            thread = threading.Thread(
+                target=alvo,
+                args=argumentos,
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        duracao = time.time() - inicio
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        waha.parar()
+
+    turnos = len(resultados.latencias)
+    resultado = {
+        "conversas": len(conversas),
+        "turnos": turnos,
+        "falhas": resultados.falhas,
+        "ignorados": resultados.ignorados,
+        "duracao_s": round(duracao, 3),
+        "turnos_por_s": round(turnos / duracao, 3) if duracao else None,
+        "construcao_agente_s": round(construcao, 3),
+        "latencia_s": {
+            nome: round(valor, 4) if valor is not None else None
+            for nome, valor in (("p50", percentil(resultados.latencias, 50)),
+                                ("p95", percentil(resultados.latencias, 95)),
+                                ("p99", percentil(resultados.latencias, 99)))
+        },
+        "mongo_ops_por_turno": None if args.memoria or not turnos else round(contador.total() / turnos, 2),
+        "mongo_ops": None if args.memoria else dict(contador.comandos.most_common()),
+        # Documentos escritos por turno em cada coleção (checkpoints: compare --checkpoint adiado/imediato);
+        # com --memoria, as gravações que o checkpointer faria no Mongo
+        "escritas_por_turno": None if not turnos else {
+            colecao: round(quantidade / turnos, 2)
+            for colecao, quantidade in (checkpointer.gravacoes if args.memoria else contador.escritas).most_common()
+        },
+        "waha": waha.resumo(),
+        "externos": dict(externos.chamadas),
+    }
+    if args.grafo and turnos:
+        # Tempo médio por turno de cada etapa, da mais cara para a mais barata
+        resultado["etapas_por_turno_s"] = {
+            chave: round(segundos / turnos, 5)
+            for chave, (_, segundos) in sorted(resultados.etapas.items(), key=lambda item: -item[1][1])
+        }
+
+    print(f"Conversas: {resultado['conversas']} | turnos: {turnos} | falhas: {resultados.falhas} | ignorados: {resultados.ignorados}")
+    print(f"Duração: {resultado['duracao_s']}s | {resultado['turnos_por_s']} turnos/s | agente construído em {resultado['construcao_agente_s']}s")
+    print(f"Latência do turno (s): p50={resultado['latencia_s']['p50']} p95={resultado['latencia_s']['p95']} p99={resultado['latencia_s']['p99']}")
+    if args.memoria:
+        print("Operações no Mongo: n/d (mongomock)")
+        print(f"Gravações de checkpoint por turno ({args.checkpoint}): {resultado['escritas_por_turno']}")
+    else:
+        print(f"Operações no Mongo por turno: {resultado['mongo_ops_por_turno']} {resultado['mongo_ops']}")
+        print(f"Documentos escritos por turno ({args.checkpoint}): {resultado['escritas_por_turno']}")
+    print(f"Waha: {resultado['waha']}")
+    print(f"Serviços externos (falsos): {resultado['externos']}")
+    if "etapas_por_turno_s" in resultado:
+        print("Etapas por turno (s):")
+        for chave, segundos in resultado["etapas_por_turno_s"].items():
+            print(f"  {chave}: {segundos}")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Servidor local que imita a API HTTP do Waha, para rodar o bot sem uma sessão
+real do WhatsApp (benchmark.py, desenvolvimento).
+
+Executar com:
+    python fake_waha.py --porta 3000 --sessao restaurante
+e apontar o app com WAHA_API_URL=http://localhost:3000 (ou, no Django,
+WAHA_API_URL no settings). Para simular um Waha lento ou instável:
+    python fake_waha.py --latencia 0.2 --variacao 0.3 --taxa-erro 0.05 --limite-envios 5
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class ServidorWahaFake:
+    """
+    Guarda tudo o que foi enviado em `enviados` e chama `ao_enviar(chat_id, texto)`
+    a cada /api/sendText recebido.
+
+    Simulação de problemas (atributos públicos, podem ser mudados com o servidor rodando):
+    - `latencia` + até `variacao` segundos de espera em cada resposta;
+    - `taxa_erro`: fração das chamadas que respondem 500;
+    - `limite_envios`: máximo de /api/sendText por segundo e sessão, acima disso 429;
+    - `sem_whatsapp`: telefones que o /api/contacts/check-exists diz não existirem.
+
+    `sessao` é a sessão configurada (o bot usa "restaurante"): aparece no
+    /api/sessions junto com as sessões já usadas nas chamadas, e é a sessão
+    assumida quando a chamada não informa uma.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", porta: int = 0, ao_enviar=None, sessao: str = "restaurante",
+                 latencia: float = 0.0,
+                 variacao: float = 0.0, taxa_erro: float = 0.0, limite_envios: float = None,
+                 sem_whatsapp=None, semente: int = None):
+        self.enviados = []  # {"chat_id", "session", "texto", "recebido_em"}
+        self.chamadas = {}  # rota -> quantidade
+        self.respostas = {}  # status HTTP -> quantidade
+        self.ao_enviar = ao_enviar
+        self.sessao = sessao
+        self.latencia = latencia
+        self.variacao = variacao
+        self.taxa_erro = taxa_erro
+        self.limite_envios = limite_envios
+        self.sem_whatsapp = set(sem_whatsapp or ())
+        self._aleatorio = random.Random(semente)
+        self._janelas_envio = {}  # sessão -> deque com os instantes dos envios do último segundo
+        self._sessoes = {sessao}  # configurada + as informadas nas chamadas
+        self._lock = threading.Lock()
+        self._http = ThreadingHTTPServer((host, porta), self._criar_handler())
+        self._http.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, porta = self._http.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def _registrar_chamada(self, rota: str):
+        with self._lock:
+            self.chamadas[rota] = self.chamadas.get(rota, 0) + 1
+
+    def _registrar_resposta(self, status: int):
+        with self._lock:
+            self.respostas[status] = self.respostas.get(status, 0) + 1
+
+    def _sortear_atraso(self) -> float:
+        with self._lock:
+            return self.latencia + (self._aleatorio.uniform(0, self.variacao) if self.variacao else 0.0)
+
+    def _sortear_erro(self) -> bool:
+        with self._lock:
+            return bool(self.taxa_erro) and self._aleatorio.random() < self.taxa_erro
+
+    def _registrar_sessao(self, sessao: str = None) -> str:
+        """Sessão da chamada (ou a configurada, se não veio nenhuma), lembrada para o /api/sessions."""
+        sessao = sessao or self.sessao
+        with self._lock:
+            self._sessoes.add(sessao)
+        return sessao
+
+    def sessoes(self) -> list:
+        with self._lock:
+            return [{"name": nome, "status": "WORKING"} for nome in sorted(self._sessoes)]
+
+    def _limite_excedido(self, sessao: str) -> bool:
+        """Janela deslizante de 1s por sessão, como o limite de envio do WhatsApp."""
+        if not self.limite_envios:
+            return False
+        agora = time.monotonic()
+        with self._lock:
+            janela = self._janelas_envio.setdefault(sessao, deque())
+            while janela and agora - janela[0] >= 1.0:
+                janela.popleft()
+            if len(janela) >= self.limite_envios:
+                return True
+            janela.append(agora)
+            return False
+
+    def _registrar_envio(self, corpo: dict):
+        envio = {
+            "chat_id": corpo.get("chatId"),
+            "session": corpo.get("session"),
+            "texto": corpo.get("text"),
+            "recebido_em": time.time(),
+        }
+        with self._lock:
+            self.enviados.append(envio)
+        if self.ao_enviar:
+            self.ao_enviar(envio["chat_id"], envio["texto"])
+        return envio
+
+    def resumo(self) -> dict:
+        """Contagens por rota e por status de resposta (para benchmarks e logs)."""
+        with self._lock:
+            return {
+                "enviados": len(self.enviados),
+                "chamadas": dict(self.chamadas),
+                "respostas": dict(self.respostas),
+            }
+
+    def _criar_handler(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _responder(self, status: int, corpo):
+                servidor._registrar_resposta(status)
+                dados = json.dumps(corpo).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def _ler_json(self) -> dict:
+                tamanho = int(self.headers.get("Content-Length") or 0)
+                if not tamanho:
+                    return {}
+                try:
+                    return json.loads(self.rfile.read(tamanho))
+                except ValueError:
+                    return {}
+
+            def _simular_problemas(self) -> bool:
+                """Aplica a latência e o erro sorteados; retorna True se já respondeu com erro."""
+                atraso = servidor._sortear_atraso()
+                if atraso > 0:
+                    time.sleep(atraso)
+                if servidor._sortear_erro():
+                    self._responder(500, {"error": "erro simulado"})
+                    return True
+                return False
+
+            def do_POST(self):
+                rota = self.path.split("?")[0]
+                servidor._registrar_chamada(rota)
+                corpo = self._ler_json()
+                sessao = servidor._registrar_sessao(corpo.get("session"))
+                if self._simular_problemas():
+                    return
+
+                if rota == "/api/sendText":
+                    if servidor._limite_excedido(sessao):
+                        self._responder(429, {"error": "rate limit"})
+                        return
+                    envio = servidor._registrar_envio(corpo)
+                    self._responder(201, {"id": f"fake_{len(servidor.enviados)}", "chatId": envio["chat_id"]})
+                elif rota in ("/api/startTyping", "/api/stopTyping"):
+                    self._responder(201, {"result": True})
+                else:
+                    self._responder(404, {"error": f"rota não suportada: {rota}"})
+
+            def do_GET(self):
+                partes = urlsplit(self.path)
+                rota = partes.path
+                servidor._registrar_chamada(rota)
+                consulta = parse_qs(partes.query)
+                if self._simular_problemas():
+                    return
+
+                if rota == "/api/sessions":
+                    self._responder(200, servidor.sessoes())
+                elif rota.startswith("/api/sessions/"):
+                    sessao = servidor._registrar_sessao(rota[len("/api/sessions/"):].strip("/"))
+                    self._responder(200, {"name": sessao, "status": "WORKING"})
+                elif rota == "/api/contacts/check-exists":
+                    servidor._registrar_sessao(consulta.get("session", [None])[0])
+                    telefone = consulta.get("phone", [""])[0]
+                    if not telefone:
+                        self._responder(400, {"error": "phone é obrigatório"})
+                    elif telefone in servidor.sem_whatsapp:
+                        self._responder(200, {"numberExists": False, "chatId": None})
+                    else:
+                        self._responder(200, {"numberExists": True, "chatId": f"{telefone}@c.us"})
+                else:
+                    self._responder(404, {"error": f"rota não suportada: {rota}"})
+
+            def log_message(self, format, *args):
+                # Sem log por requisição: em carga isso vira o gargalo
+                pass
+
+        return Handler
+
+    def iniciar(self):
+        """Sobe o servidor em uma thread de fundo e retorna a URL base."""
+        self._thread = threading.Thread(target=self._http.serve_forever, name="waha-fake", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def parar(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Waha falso para desenvolvimento e benchmarks")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--porta", type=int, default=3000)
+    parser.add_argument("--sessao", default="restaurante", help="sessão configurada (a mesma do bot)")
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos de espera em cada resposta")
+    parser.add_argument("--variacao", type=float, default=0.0, help="até quantos segundos a mais, sorteados")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fração das chamadas que respondem 500")
+    parser.add_argument("--limite-envios", type=float, help="sendText por segundo e sessão antes do 429")
+    parser.add_argument("--sem-whatsapp", nargs="*", default=[], help="telefones que não estão no WhatsApp")
+    parser.add_argument("--semente", type=int, help="semente do sorteio de latência e erros")
+    parser.add_argument("--gravar", help="acrescenta cada mensagem enviada (JSON) neste arquivo")
+    parser.add_argument("--silencioso", action="store_true", help="não imprime as mensagens enviadas")
+    args = parser.parse_args()
+
+    lock_arquivo = threading.Lock()
+
+    def ao_enviar(chat_id, texto):
+        if not args.silencioso:
+            print(f"[WAHA FAKE] {chat_id}: {texto}")
+        if args.gravar:
+            linha = json.dumps({"chat_id": chat_id, "texto": texto, "recebido_em": time.time()}, ensure_ascii=False)
+            with lock_arquivo, open(args.gravar, "a", encoding="utf-8") as arquivo:
+                arquivo.write(linha + "\n")
+
+    servidor = ServidorWahaFake(args.host, args.porta, ao_enviar=ao_enviar, sessao=args.sessao,
+                                latencia=args.latencia,
+                                variacao=args.variacao, taxa_erro=args.taxa_erro,
+                                limite_envios=args.limite_envios, sem_whatsapp=args.sem_whatsapp,
+                                semente=args.semente)
+    print(f"[WAHA FAKE] Ouvindo em {servidor.url} (sessão {args.sessao})")
+    try:
+        servidor._http.serve_forever()
+    except KeyboardInterrupt:
+        servidor.parar()
+        print(f"[WAHA FAKE] {json.dumps(servidor.resumo(), ensure_ascii=False)}")
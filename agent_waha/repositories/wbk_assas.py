@@ -1,16 +1,9 @@
 import requests
 import os
-import urllib
-import urllib.parse
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
+from services.mongo import get_client
+from services.temporizacao import medir
 
-mongo_user = os.getenv('MONGO_USER')
-mongo_pass = os.getenv("MONGO_PASS")
-
-username = urllib.parse.quote_plus(mongo_user)
-password = urllib.parse.quote_plus(mongo_pass)
-client = MongoClient("mongodb+srv://%s:%s@cluster0.gjkin5a.mongodb.net/?retryWrites=true&w=majority&appName=Cluster0" % (username, password), ssl = True)
+client = get_client()
 db = client.teste
 coll = db.usuarios
 
@@ -61,7 +54,8 @@ class Webhook():
             "access_token": access_token
         }
 
-        response = requests.post(url, json=payload, headers=headers)
+        with medir("http", "asaas.webhook"):
+            response = requests.post(url, json=payload, headers=headers)
 
         print(response.text)
 
@@ -0,0 +1,74 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AgendadorTarefas:
+    """
+    Agendador de chamadas atrasadas sem prender uma thread por tarefa.
+    Uma única thread dorme até o próximo prazo (heap ordenado por horário) e
+    repassa a tarefa vencida para um pool pequeno, que faz a chamada de rede.
+
+    Usa apenas a biblioteca padrão para poder ser importado tanto pelo
+    agent_waha quanto pelo Django (menu/services.py).
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self._heap = []
+        self._contador = itertools.count()
+        self._cancelados = set()
+        self._lock = threading.Lock()
+        self._mudou = threading.Condition(self._lock)
+        self._max_workers = max_workers
+        self._executor = None
+        self._thread = None
+
+    def _iniciar(self):
+        # Chamado com o lock adquirido; a thread só sobe no primeiro agendamento
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="agendador")
+            self._thread = threading.Thread(target=self._loop, name="agendador", daemon=True)
+            self._thread.start()
+
+    def agendar(self, atraso: float, funcao, *args, **kwargs) -> int:
+        """Executa `funcao(*args, **kwargs)` daqui a `atraso` segundos. Retorna o id da tarefa."""
+        prazo = time.monotonic() + max(atraso, 0)
+        with self._lock:
+            self._iniciar()
+            tarefa_id = next(self._contador)
+            heapq.heappush(self._heap, (prazo, tarefa_id, funcao, args, kwargs))
+            self._mudou.notify()
+            return tarefa_id
+
+    def cancelar(self, tarefa_id: int):
+        with self._lock:
+            self._cancelados.add(tarefa_id)
+
+    def pendentes(self) -> int:
+        with self._lock:
+            return len(self._heap)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    espera = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._mudou.wait(espera)
+                _, tarefa_id, funcao, args, kwargs = heapq.heappop(self._heap)
+                if tarefa_id in self._cancelados:
+                    self._cancelados.discard(tarefa_id)
+                    continue
+            self._executor.submit(self._executar, funcao, args, kwargs)
+
+    @staticmethod
+    def _executar(funcao, args, kwargs):
+        try:
+            funcao(*args, **kwargs)
+        except Exception as e:
+            print(f"[AGENDADOR] Erro em tarefa agendada {getattr(funcao, '__name__', funcao)}: {e}")
+
+
+# Instância global do processo
+agendador = AgendadorTarefas()
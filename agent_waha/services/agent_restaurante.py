@@ -1,10 +1,10 @@
 import pandas as pd
 import os
+import copy
 import uuid
 import re
 import requests
 from datetime import datetime, timedelta
-from pymongo import MongoClient
 from dateutil.parser import parse
 import urllib.parse
 from langchain_openai import ChatOpenAI
@@ -24,24 +24,43 @@ from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 from typing_extensions import Annotated,Dict, Any
 from langchain.chat_models import init_chat_model
-from langchain_core.messages import AIMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from langchain_core.runnables import RunnableLambda
 from repositories.wbk_assas import Webhook
+from services.mongo import get_client, get_db
+from services.temporizacao import medir, no_cronometrado, registrar_tokens
+from services.memoria_conversa import PoliticaMemoria
+from services.roteador_intencoes import ROTEADOR_RAPIDO, RoteadorIntencoes
+from services.cache_usuarios import CacheUsuarios
+from services.cache_semantico import CACHE_FAQ, CacheSemantico, MARCADOR_NOME
+from services.modelo_fake import ModeloRoteirizado
+from services.servicos_fake import EmbeddingsFake, ServicosExternosFake
+from services.checkpoint_adiado import CheckpointerAdiado, GrafoCheckpointAdiado
 from rapidfuzz import process,fuzz
 import unicodedata, re, logging
 from typing import List, Dict
 from bson import ObjectId
 import json
+import atexit
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-MONGO_USER = urllib.parse.quote_plus(os.getenv('MONGO_USER'))
-MONGO_PASS = urllib.parse.quote_plus(os.getenv('MONGO_PASS'))
 MAPS_API_KEY = os.getenv('MAPS_API_KEY')
-embedding_model = OpenAIEmbeddings(api_key=OPENAI_API_KEY, model="text-embedding-3-large")
-client = MongoClient("mongodb+srv://%s:%s@cluster0.gjkin5a.mongodb.net/?retryWrites=true&w=majority&appName=Cluster0" % (MONGO_USER, MONGO_PASS))
-db = client.restaurante_db
+# SERVICOS_EXTERNOS=fake: Maps, Asaas, busca vetorial e embeddings sem rede (servicos_fake.py)
+SERVICOS_FAKE = os.getenv("SERVICOS_EXTERNOS", "real") == "fake"
+# MODELO_CHAT escolhe a fábrica do chat model (ver FABRICAS_MODELO); "roteirizado" dispensa a OpenAI
+MODELO_CHAT = os.getenv("MODELO_CHAT", "openai")
+# CHECKPOINT_ADIADO=1: checkpoints intermediários do turno ficam em memória; só o final vai para o Mongo
+CHECKPOINT_ADIADO = os.getenv("CHECKPOINT_ADIADO", "1") == "1"
+embedding_model = (EmbeddingsFake() if SERVICOS_FAKE
+                   else OpenAIEmbeddings(api_key=OPENAI_API_KEY, model="text-embedding-3-large"))
+# Mesmo cliente do resto do app; MONGO_URI aponta para um Mongo local (ou mongomock://) fora da produção
+client = get_client()
+db = get_db()
 coll_memoria = db.memoria_chat
 coll_users = db.user
 coll3 = db.pedidos
@@ -49,19 +68,89 @@ coll4 = db.promocoes
 coll5 = db.produtos
 coll_vector = db.vetores
 coll_entregas = db.entregas
+# Perfis por telefone em memória; ultima_interacao vai para o Mongo em lotes
+cache_usuarios = CacheUsuarios(
+    coll_users,
+    ttl=float(os.getenv("CACHE_USUARIOS_TTL", "300")),
+    intervalo_gravacao=float(os.getenv("USUARIOS_GRAVACAO_INTERVALO", "30")),
+)
+atexit.register(cache_usuarios.descarregar)
+
+
+def versao_material() -> str:
+    """Versão do cardápio + material de apoio: muda quando algum produto ou o material muda"""
+    produtos = list(coll5.find({}, {"_id": 0, "nome": 1, "preco": 1, "disponivel": 1, "adicionais": 1, "descricao": 1}))
+    produtos.sort(key=lambda produto: str(produto.get("nome")))
+    conteudo = json.dumps([produtos, coll_vector.estimated_document_count()], sort_keys=True, default=str)
+    return hashlib.md5(conteudo.encode("utf-8")).hexdigest()[:12]
+
+
+# Respostas de perguntas frequentes por similaridade de embedding, por versão do material
+cache_respostas_faq = CacheSemantico(
+    embedding_model,
+    versao_material,
+    limiar=float(os.getenv("CACHE_FAQ_LIMIAR", "0.92")),
+    obter_colecao=lambda: db.cache_faq,
+)
+# Tools que não tornam a resposta pessoal: só turnos que usaram no máximo estas entram no cache
+FERRAMENTAS_FAQ = {"consultar_material_de_apoio"}
 webhook_assas = Webhook()
 access_token = os.getenv('ASSAS_ACCESS_TOKEN')
-webhook_assas.create_webhook('restaurante', access_token)
 waha = Waha()
 
+
+class ServicosExternos:
+    """
+    Chamadas das tools a serviços de fora: Google Maps, Asaas e a busca vetorial
+    do material de apoio. ServicosExternosFake (servicos_fake.py) tem a mesma interface.
+    """
+
+    def distancia(self, origem: str, destino: str) -> dict:
+        """Resposta da Distance Matrix API ({"status": "ERROR"} se não vier JSON)"""
+        url = (
+            f"https://maps.googleapis.com/maps/api/distancematrix/json?"
+            f"origins={urllib.parse.quote(origem)}&destinations={urllib.parse.quote(destino)}"
+            f"&key={MAPS_API_KEY}&units=metric&language=pt-BR"
+        )
+        with medir("http", "maps.distancematrix"):
+            response = requests.get(url)
+        try:
+            return response.json()
+        except Exception:
+            return {"status": "ERROR", "rows": []}
+
+    def criar_cobranca(self, payload: dict):
+        """Cria a cobrança no Asaas; retorna (status HTTP, cobrança em JSON ou texto do erro)"""
+        url = "https://api-sandbox.asaas.com/v3/payments"
+        headers = {
+            "Content-Type": "application/json",
+            "access_token": access_token
+        }
+        with medir("http", "asaas.payments"):
+            response = requests.post(url, json=payload, headers=headers)
+        if response.status_code not in [200, 201]:
+            return response.status_code, response.text
+        return response.status_code, response.json()
+
+    def buscar_material(self, pergunta: str) -> list:
+        vectorStore = MongoDBAtlasVectorSearch(coll_vector, embedding=embedding_model, index_name='default')
+        return [doc.page_content for doc in vectorStore.similarity_search(pergunta)]
+
+
+externos = ServicosExternosFake() if SERVICOS_FAKE else ServicosExternos()
+
+
+def usar_servicos_externos(servicos):
+    """Troca os serviços externos das tools (ex.: ServicosExternosFake com latência); vale para o processo todo"""
+    global externos
+    externos = servicos
+
 def carrega_txt(caminho):
     loader = Docx2txtLoader(caminho)
     lista_documentos = loader.load()
     documento = '\n\n'.join([doc.page_content for doc in lista_documentos])
     return documento
 
-memory = MongoDBSaver(coll_memoria)
-
 class State(TypedDict):
     messages: Annotated[list, add_messages]
     user_info: Dict[str, Any]
@@ -71,6 +160,8 @@ class State(TypedDict):
     forma_pagamento: str  # "cartao", "pix", "dinheiro"
     valor_troco: float  # valor necessário para troco
     status_pedido: str  # controle do status do pedido
+    resumo_conversa: str  # turnos antigos resumidos pela PoliticaMemoria
+    resultados_tools: Dict[str, Any]  # último resultado completo de cada tool (a ToolMessage leva só a projeção)
 
 def check_user(state: dict, config: dict) -> dict:
     """
@@ -82,7 +173,7 @@ def check_user(state: dict, config: dict) -> dict:
         sem_sufixo = thread_id.replace("@c.us", "")
         telefone = sem_sufixo[2:]  # remove o 55
 
-        usuario = coll_users.find_one({"telefone": telefone})
+        usuario = cache_usuarios.obter(telefone)
 
         if not usuario:
             # Usuário não existe, mas NÃO criamos automaticamente
@@ -113,33 +204,23 @@ def check_user(state: dict, config: dict) -> dict:
                 "status": "ativo"
             }
             
-            # Atualiza última interação no MongoDB
-            try:
-                coll_users.update_one(
-                    {"telefone": telefone},
-                    {"$set": {"ultima_interacao": datetime.now().isoformat()}}
-                )
-                print(f"[CHECK_USER] Usuário existente atualizado: {telefone}")
-            except Exception as e:
-                print(f"[CHECK_USER] Erro ao atualizar usuário: {e}")
+            # Última interação vai para o MongoDB no próximo lote (write-behind)
+            cache_usuarios.registrar_interacao(telefone, user_info["ultima_interacao"])
 
-        # Adiciona user_info ao state
-        state["user_info"] = user_info
-        
         print(f"[CHECK_USER] User info adicionado ao state: {user_info}")
-        return state
+        # Só o que mudou: o resto do state (e o histórico) continua nos canais do grafo
+        return {"user_info": user_info}
 
     except Exception as e:
         print(f"[CHECK_USER] Erro: {e}")
         # Fallback em caso de erro
-        state["user_info"] = {
+        return {"user_info": {
             "nome": "Erro", 
             "telefone": "erro",
             "data_criacao": datetime.now().isoformat(),
             "ultima_interacao": datetime.now().isoformat(),
             "status": "erro"
-        }
-        return state
+        }}
 
 SYSTEM_PROMPT = """
 🍔 ATENDENTE VIRTUAL DO PIRÃO BURGER 🍔
@@ -233,6 +314,11 @@ Seja simpático, eficiente e divertido 😄
 (...continua o fluxo com pagamento e finalização...)
 """
 
+# Prefixo do prompt igual byte a byte em toda chamada (junto com as tools, que o
+# bind_tools manda antes das mensagens): é o que o cache de prefixo do provedor reaproveita.
+# Nada por cliente entra aqui; o que muda a cada turno vai no bloco de contexto, depois do histórico
+PROMPT_ESTATICO = SystemMessage(content=SYSTEM_PROMPT)
+
 def buscar_produtos_cardapio():
     """
     Busca todos os produtos disponíveis no MongoDB e retorna um JSON com:
@@ -375,12 +461,11 @@ def consultar_material_de_apoio(pergunta: str) -> str:
     """
     Consulta o material de apoio técnico enviado pelos personal trainers para responder perguntas específicas.
     """
-    vectorStore = MongoDBAtlasVectorSearch(coll_vector, embedding=embedding_model, index_name='default')
-    docs = vectorStore.similarity_search(pergunta)
-    if not docs:
+    trechos = externos.buscar_material(pergunta)
+    if not trechos:
         return "Nenhum conteúdo relevante encontrado no material de apoio."
     
-    return "\n\n".join([doc.page_content[:400] for doc in docs])
+    return "\n\n".join([trecho[:400] for trecho in trechos])
 
 def normalizar(texto: str) -> str:
     texto = texto.lower()
@@ -470,6 +555,7 @@ def criar_usuario(nome_cliente: str, state: dict) -> str:
                     }
                 )
                 
+                cache_usuarios.invalidar(telefone)
                 if result.modified_count > 0:
                     print(f"[CRIAR_USUARIO] Nome atualizado para usuário existente: {nome_cliente}")
                     
@@ -497,6 +583,7 @@ def criar_usuario(nome_cliente: str, state: dict) -> str:
             }
             
             result = coll_users.insert_one(novo_usuario)
+            cache_usuarios.invalidar(telefone)
             
             if result.inserted_id:
                 print(f"[CRIAR_USUARIO] Novo usuário criado: {nome_cliente} - {telefone}")
@@ -1241,17 +1328,7 @@ def calcular_entrega(endereco_cliente: str = None,
             }
 
         # Chamada à API Distance Matrix
-        url = (
-            f"https://maps.googleapis.com/maps/api/distancematrix/json?"
-            f"origins={urllib.parse.quote(origem)}&destinations={urllib.parse.quote(destino)}"
-            f"&key={MAPS_API_KEY}&units=metric&language=pt-BR"
-        )
-        
-        response = requests.get(url)
-        try:
-            res = response.json()
-        except Exception:
-            res = {"status": "ERROR", "rows": []}
+        res = externos.distancia(origem, destino)
 
         if not isinstance(res, dict) or res.get("status") != "OK":
             return {
@@ -1375,12 +1452,32 @@ def calcular_entrega(endereco_cliente: str = None,
             "message": f"❌ Erro ao calcular entrega: {str(e)}"
         }
 
+def _state_com_pedido(state: dict, id_pedido: str = None) -> dict:
+    """
+    State com o pedido gravado `id_pedido` no lugar de state["pedido"] (o
+    roteador rápido passa o pedido aberto do telefone do chat). Sem id, ou se o
+    pedido não existir, o state volta como veio e a tool segue a busca dela.
+    """
+    if not id_pedido:
+        return state
+    pedido_db = coll3.find_one({"id_pedido": id_pedido}, {"_id": 0})
+    if not pedido_db:
+        return state
+    state = dict(state or {})
+    state["pedido"] = pedido_db
+    if not state.get("endereco_entrega"):
+        state["endereco_entrega"] = {"valor_entrega": pedido_db.get("valor_entrega", 0)}
+    return state
+
+
 @tool("processar_retirada")
-def processar_retirada(state: dict = None) -> dict:
+def processar_retirada(id_pedido: str = None, state: dict = None) -> dict:
     """
     Processa a opção de retirada no balcão.
     Atualiza o pedido e solicita forma de pagamento.
+    id_pedido é opcional: sem ele, usa o pedido do cliente.
     """
+    state = _state_com_pedido(state, id_pedido)
     try:
         # Busca o pedido no estado ou no banco de dados
         pedido = None
@@ -1488,11 +1585,14 @@ def processar_retirada(state: dict = None) -> dict:
 def criar_cobranca_asaas(
     tipo: str,  # "CREDIT_CARD" ou "PIX"
     customer_id: str = 'cus_000006650523',
+    id_pedido: str = None,
     state: dict | None = None) -> str:
     """
     Cria uma cobrança via Asaas para cartão ou PIX.
     Tipos aceitos: CREDIT_CARD, PIX
+    id_pedido é opcional: sem ele, usa o pedido do cliente.
     """
+    state = _state_com_pedido(state, id_pedido)
     try:
         pedido_db = None
         id_pedido = None
@@ -1605,12 +1705,6 @@ def criar_cobranca_asaas(
         descricao = f"Pedido #{id_pedido} - {nome} - {telefone} - Pirão Burger"
 
         # Cria a cobrança na API
-        url = "https://api-sandbox.asaas.com/v3/payments"
-        headers = {
-            "Content-Type": "application/json",
-            "access_token": access_token
-        }
-
         payload = {
             "customer": customer_id,
             "billingType": tipo,
@@ -1620,11 +1714,9 @@ def criar_cobranca_asaas(
             "externalReference": id_pedido
         }
 
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code not in [200, 201]:
-            return f"❌ Erro ao gerar cobrança: {response.status_code} - {response.text}"
-
-        cobranca = response.json()
+        status_code, cobranca = externos.criar_cobranca(payload)
+        if status_code not in [200, 201]:
+            return f"❌ Erro ao gerar cobrança: {status_code} - {cobranca}"
 
         if tipo == "PIX":
             link_pagamento = cobranca.get("invoiceUrl")
@@ -1676,10 +1768,12 @@ def criar_cobranca_asaas(
         return f"❌ Erro ao gerar cobrança: {str(e)}"
 
 @tool("processar_pagamento_dinheiro")
-def processar_pagamento_dinheiro(valor_cliente: float, state: dict = None) -> str:
+def processar_pagamento_dinheiro(valor_cliente: float, id_pedido: str = None, state: dict = None) -> str:
     """
     Processa pagamento em dinheiro e calcula o troco necessário.
+    id_pedido é opcional: sem ele, usa o pedido do cliente.
     """
+    state = _state_com_pedido(state, id_pedido)
     try:
         # Busca o pedido no estado ou no banco de dados
         pedido = None
@@ -1879,6 +1973,7 @@ def atualizar_nome_usuario(nome_cliente: str, state: dict = None) -> str:
                     "status": "ativo"
                 }
                 result = coll_users.insert_one(novo_usuario)
+                cache_usuarios.invalidar(novo_usuario["telefone"])
                 if result.inserted_id:
                     print(f"[ATUALIZAR_NOME] Novo usuário criado: {nome_cliente}")
                     return f"✅ Usuário criado com sucesso: {nome_cliente}!"
@@ -1908,6 +2003,7 @@ def atualizar_nome_usuario(nome_cliente: str, state: dict = None) -> str:
                 }
             )
             
+            cache_usuarios.invalidar(telefone)
             if result.modified_count > 0:
                 print(f"[ATUALIZAR_NOME] Nome atualizado para '{nome_cliente}' no telefone {telefone}")
                 
@@ -1931,6 +2027,7 @@ def atualizar_nome_usuario(nome_cliente: str, state: dict = None) -> str:
             }
             
             result = coll_users.insert_one(novo_usuario)
+            cache_usuarios.invalidar(telefone)
             if result.inserted_id:
                 print(f"[ATUALIZAR_NOME] Novo usuário criado: {nome_cliente} - {telefone}")
                 
@@ -1948,11 +2045,13 @@ def atualizar_nome_usuario(nome_cliente: str, state: dict = None) -> str:
         return f"❌ Erro ao atualizar nome: {str(e)}"
 
 @tool("confirmar_pedido")
-def confirmar_pedido(state: dict = None) -> str:
+def confirmar_pedido(id_pedido: str = None, state: dict = None) -> str:
     """
     Confirma o pedido atual que está no state.
     SEMPRE use esta ferramenta quando o usuário confirmar um pedido.
+    id_pedido é opcional: sem ele, usa o pedido do cliente.
     """
+    state = _state_com_pedido(state, id_pedido)
     try:
         print(f"[CONFIRMAR_PEDIDO] Confirmando pedido do state")
         
@@ -2005,10 +2104,145 @@ tools = [
     confirmar_pedido,
     criar_usuario
 ]
+
+# Recurso que cada tool altera: no safe_tool_node, tools do mesmo recurso rodam em série
+# (na ordem pedida pelo LLM) e o resto em paralelo. None = sem efeito colateral.
+# Tool fora da lista conta como "pedido", por segurança
+RECURSO_TOOLS = {
+    "consultar_material_de_apoio": None,
+    "processar_pedido_full": "pedido",
+    "calcular_entrega": "pedido",
+    "processar_retirada": "pedido",
+    "criar_cobranca_asaas": "pedido",
+    "processar_pagamento_dinheiro": "pedido",
+    "confirmar_pedido": "pedido",
+    "atualizar_nome_usuario": "usuario",
+    "criar_usuario": "usuario",
+}
+
+# Pedido nesses status (ou criado há mais tempo que isso) não conta como em andamento (cache de FAQ, roteador rápido)
+STATUS_PEDIDO_ENCERRADO = ["Concluído", "Cancelado"]
+PEDIDO_ABERTO_HORAS = float(os.getenv("PEDIDO_ABERTO_HORAS", "24"))
+
+
+def pedido_em_andamento(state: dict) -> bool:
+    """
+    Se o cliente tem um pedido em andamento, pelo que está gravado (e não por
+    state["pedido"], que as tools só alteram na cópia delas): uma tool de pedido
+    na janela de mensagens, ou um pedido aberto no Mongo com o telefone do
+    cliente ou com o id_pedido de algum resultado em resultados_tools.
+    """
+    if any(isinstance(mensagem, ToolMessage) and RECURSO_TOOLS.get(mensagem.name, "pedido") == "pedido"
+           for mensagem in state.get("messages", [])):
+        return True
+    telefone = (state.get("user_info") or {}).get("telefone")
+    if not telefone:
+        return True
+    filtros = [{"cliente.telefone": telefone}]
+    for nome, resultado in (state.get("resultados_tools") or {}).items():
+        if RECURSO_TOOLS.get(nome, "pedido") != "pedido" or not isinstance(resultado, dict):
+            continue
+        for dados in (resultado, resultado.get("order"), resultado.get("pedido")):
+            if isinstance(dados, dict) and dados.get("id_pedido"):
+                filtros.append({"id_pedido": dados["id_pedido"]})
+    limite = (datetime.utcnow() - timedelta(hours=PEDIDO_ABERTO_HORAS)).isoformat()
+    aberto = coll3.find_one(
+        {"$or": filtros, "status": {"$nin": STATUS_PEDIDO_ENCERRADO}, "data_criacao": {"$gte": limite}},
+        {"_id": 1},
+    )
+    return aberto is not None
+
+
+def pedido_aberto(telefone: str):
+    """Pedido em andamento mais recente gravado para o telefone ({"id_pedido", "status"}), ou None."""
+    if not telefone:
+        return None
+    limite = (datetime.utcnow() - timedelta(hours=PEDIDO_ABERTO_HORAS)).isoformat()
+    return coll3.find_one(
+        {"cliente.telefone": telefone, "status": {"$nin": STATUS_PEDIDO_ENCERRADO}, "data_criacao": {"$gte": limite}},
+        {"_id": 0, "id_pedido": 1, "status": 1},
+        sort=[("data_criacao", -1)],
+    )
+
+# Campos do resultado (dict) de cada tool que vão para o LLM na ToolMessage; "a.b" é o campo b dentro de a.
+# Só estas três tools retornam dict (as outras já retornam o texto para o cliente, que vai inteiro);
+# toda tool anotada com "-> dict" precisa estar aqui (tests/test_projecao_tools.py). O fallback de
+# campos simples é só proteção para um dict inesperado
+PROJECAO_TOOLS = {
+    "processar_pedido_full": ["success", "need_confirmation", "message", "order.id_pedido", "order.valor_total",
+                              "order.total_itens", "produto_sugerido.nome_sugerido",
+                              "produto_sugerido.alternativas"],
+    "calcular_entrega": ["success", "message", "valor_entrega", "tempo_estimado", "distancia_km", "endereco"],
+    "processar_retirada": ["success", "message"],
+}
+
+
+def projetar_resultado(nome_tool: str, resultado) -> str:
+    """Conteúdo da ToolMessage: o texto da tool ou, para dicts, os campos de PROJECAO_TOOLS em JSON compacto"""
+    if not resultado:
+        return "Executado com sucesso"
+    if not isinstance(resultado, dict):
+        return str(resultado)
+    campos = PROJECAO_TOOLS.get(nome_tool)
+    if campos is None:
+        compacto = {chave: valor for chave, valor in resultado.items() if not isinstance(valor, (dict, list))}
+    else:
+        compacto = {}
+        for campo in campos:
+            valor = resultado
+            for parte in campo.split("."):
+                valor = valor.get(parte) if isinstance(valor, dict) else None
+            if valor is not None:
+                compacto[campo.split(".")[-1]] = valor
+    return json.dumps(compacto, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+# Pool limitado para as tools de uma mesma resposta do LLM (a maioria espera rede: Maps, Asaas, Mongo)
+executor_tools = ThreadPoolExecutor(max_workers=int(os.getenv("TOOLS_PARALELAS", "4")), thread_name_prefix="tool")
+
+
+def criar_modelo_openai():
+    # stream_usage: com streaming=True a OpenAI só informa os tokens (inclusive os do cache) se pedido
+    return ChatOpenAI(model="gpt-4o-mini", openai_api_key=OPENAI_API_KEY, streaming=True, stream_usage=True)
+
+
+# Fábricas de chat model por nome (MODELO_CHAT)
+FABRICAS_MODELO = {
+    "openai": criar_modelo_openai,
+    "roteirizado": ModeloRoteirizado,
+}
   
 class AgentRestaurante:
-    def __init__(self):
-        self.memory = self._init_memory()
+    def __init__(self, checkpointer=None, llm=None, registrar_webhook=True, memoria=None, roteador=None,
+                 cache_faq=None, fabrica_modelo=None, adiar_checkpoint=None):
+        # Registra o webhook do Asaas na construção do agente (e não no import do módulo)
+        if registrar_webhook and not SERVICOS_FAKE:
+            webhook_assas.create_webhook('restaurante', access_token)
+        # checkpointer permite trocar o MongoDBSaver (ex.: AsyncMongoDBSaver no app assíncrono)
+        self.memory = checkpointer if checkpointer is not None else self._init_memory()
+        # Um checkpoint gravado por turno em vez de um por super-step
+        if adiar_checkpoint is None:
+            adiar_checkpoint = CHECKPOINT_ADIADO
+        if adiar_checkpoint:
+            self.memory = CheckpointerAdiado(self.memory)
+        # llm permite trocar o ChatOpenAI (ex.: modelo roteirizado do benchmark.py);
+        # sem ele, o modelo vem de fabrica_modelo ou da fábrica de MODELO_CHAT
+        self.llm = llm
+        if fabrica_modelo is None:
+            if MODELO_CHAT not in FABRICAS_MODELO:
+                raise ValueError(f"MODELO_CHAT desconhecido: {MODELO_CHAT} (opções: {', '.join(FABRICAS_MODELO)})")
+            fabrica_modelo = FABRICAS_MODELO[MODELO_CHAT]
+        self.fabrica_modelo = fabrica_modelo
+        # Janela de turnos + resumo do histórico guardado no checkpoint
+        self.memoria = memoria if memoria is not None else PoliticaMemoria()
+        # Caminho rápido sem LLM para respostas óbvias (roteador=False desliga)
+        if roteador is None:
+            roteador = RoteadorIntencoes(buscar_pedido=pedido_aberto) if ROTEADOR_RAPIDO else False
+        self.roteador = roteador or None
+        # Cache semântico de FAQ (cache_faq=False desliga)
+        if cache_faq is None:
+            cache_faq = cache_respostas_faq if CACHE_FAQ else False
+        self.cache_faq = cache_faq or None
         self.model = self._build_agent()
     
     def _convert_datetime_to_string(self, obj):
@@ -2029,7 +2263,7 @@ class AgentRestaurante:
             
             # Copia apenas os campos essenciais do state
             for key, value in state.items():
-                if key == "messages":
+                if key in ["messages", "resultados_tools"]:
                     # Pula as mensagens para evitar problemas de serialização
                     continue
                 elif key in ["user_info", "pedido", "tipo_entrega", "endereco_entrega", 
@@ -2057,65 +2291,188 @@ class AgentRestaurante:
     
     def _build_agent(self):
         graph_builder = StateGraph(State)
-        llm = ChatOpenAI(model="gpt-4o-mini", openai_api_key=OPENAI_API_KEY, streaming=True)
+        llm = self.llm if self.llm is not None else self.fabrica_modelo()
         llm_with_tools = llm.bind_tools(tools=tools)
+        nome_modelo = getattr(llm, "model_name", type(llm).__name__)
         tool_vector_search = ToolNode(tools=[consultar_material_de_apoio])
         tools_node = ToolNode(tools=tools)
 
-        def chatbot(state: State, config: RunnableConfig) -> State:
-            try:
-                user_info = state.get("user_info", {})
-                nome = user_info.get("nome", "usuário")
-                telefone = user_info.get("telefone", "indefinido")
+        def montar_contexto(state: State) -> SystemMessage:
+            """Bloco dinâmico (cliente, pedido, instrução do turno), enviado depois do histórico"""
+            user_info = state.get("user_info", {})
+            nome = user_info.get("nome", "usuário")
+            telefone = user_info.get("telefone", "indefinido")
+            
+            status_pedido = state.get("status_pedido", "inicial")
+            pedido_info = ""
+            
+            if "pedido" in state:
+                pedido = state["pedido"]
+                pedido_info = f"\n\nPEDIDO ATUAL:\n- ID: {pedido.get('id_pedido')}\n- Status: {status_pedido}\n- Valor: R$ {pedido.get('valor_total', 0):.2f}"
                 
-                status_pedido = state.get("status_pedido", "inicial")
-                pedido_info = ""
+                if state.get("tipo_entrega"):
+                    pedido_info += f"\n- Tipo: {state['tipo_entrega']}"
                 
-                if "pedido" in state:
-                    pedido = state["pedido"]
-                    pedido_info = f"\n\nPEDIDO ATUAL:\n- ID: {pedido.get('id_pedido')}\n- Status: {status_pedido}\n- Valor: R$ {pedido.get('valor_total', 0):.2f}"
-                    
-                    if state.get("tipo_entrega"):
-                        pedido_info += f"\n- Tipo: {state['tipo_entrega']}"
-                    
-                    if state.get("endereco_entrega"):
-                        entrega = state["endereco_entrega"]
-                        pedido_info += f"\n- Taxa entrega: R$ {entrega.get('valor_entrega', 0):.2f}"
+                if state.get("endereco_entrega"):
+                    entrega = state["endereco_entrega"]
+                    pedido_info += f"\n- Taxa entrega: R$ {entrega.get('valor_entrega', 0):.2f}"
 
-                # Instrução específica baseada no estado do usuário
-                if nome and nome != "usuário" and nome != "None":
-                    instrucao_especifica = f"\n\n🚨 INSTRUÇÃO CRÍTICA: O cliente {nome} JÁ ESTÁ IDENTIFICADO! NÃO peça o nome! Cumprimente pelo nome e vá direto para o pedido!"
-                else:
-                    instrucao_especifica = f"\n\n🚨 INSTRUÇÃO CRÍTICA: O cliente NÃO está identificado! Peça o nome primeiro usando criar_usuario!"
-                
-                system_prompt = SystemMessage(
-                    content=SYSTEM_PROMPT + 
-                    f"\n\nCLIENTE ATUAL:\n- Nome: {nome}\n- Telefone: {telefone}" + 
-                    pedido_info +
-                    instrucao_especifica
-                )
-                
+
+            # Instrução específica baseada no estado do usuário
+            if nome and nome != "usuário" and nome != "None":
+                instrucao_especifica = f"\n\n🚨 INSTRUÇÃO CRÍTICA: O cliente {nome} JÁ ESTÁ IDENTIFICADO! NÃO peça o nome! Cumprimente pelo nome e vá direto para o pedido!"
+            else:
+                instrucao_especifica = f"\n\n🚨 INSTRUÇÃO CRÍTICA: O cliente NÃO está identificado! Peça o nome primeiro usando criar_usuario!"
+            
+            return SystemMessage(
+                content=f"CLIENTE ATUAL:\n- Nome: {nome}\n- Telefone: {telefone}" + 
+                pedido_info +
+                instrucao_especifica
+            )
+
+        def montar_prompt(state: State, historico: list) -> list:
+            """
+            Prefixo fixo + resumo + histórico + contexto do turno. O histórico só cresce
+            no fim entre as chamadas, então o prefixo em cache aumenta junto com a conversa
+            """
+            mensagens = [PROMPT_ESTATICO]
+            resumo = state.get("resumo_conversa")
+            if resumo:
+                # Só muda quando a PoliticaMemoria resume turnos antigos
+                mensagens.append(SystemMessage(content=f"RESUMO DA CONVERSA ANTERIOR:\n{resumo}"))
+            return mensagens + list(historico) + [montar_contexto(state)]
+
+        def chatbot(state: State, config: RunnableConfig) -> State:
+            try:
                 # Converte datetime no state para evitar erro de serialização
                 try:
                     # Tenta converter datetime no user_info se existir
                     if 'user_info' in state and isinstance(state['user_info'], dict):
                         state['user_info'] = self._convert_datetime_to_string(state['user_info'])
                     
-                    response = llm_with_tools.invoke([system_prompt] + state["messages"])
+                    with medir("llm", nome_modelo):
+                        response = llm_with_tools.invoke(montar_prompt(state, state["messages"]))
                 except Exception as serialization_error:
                     print(f"[DEBUG] Erro de serialização: {serialization_error}")
                     # Se der erro, tenta converter todo o state
                     state_clean = self._convert_datetime_to_string(state)
-                    response = llm_with_tools.invoke([system_prompt] + state_clean["messages"])
+                    with medir("llm", nome_modelo):
+                        response = llm_with_tools.invoke(montar_prompt(state_clean, state_clean["messages"]))
+                registrar_tokens(response, nome_modelo)
 
             except Exception as e:
                 print(f"[ERRO chatbot]: {e}")
                 raise
 
-            return {
-                **state,  # Preserva todo o estado anterior
-                "messages": state["messages"] + [response]
-            }
+            # Só a resposta nova: o add_messages junta ao histórico
+            return {"messages": [response]}
+
+        async def achatbot(state: State, config: RunnableConfig) -> State:
+            """Versão assíncrona do chatbot, usada quando o grafo roda com ainvoke"""
+            try:
+                if 'user_info' in state and isinstance(state['user_info'], dict):
+                    state['user_info'] = self._convert_datetime_to_string(state['user_info'])
+                
+                with medir("llm", nome_modelo):
+                    response = await llm_with_tools.ainvoke(montar_prompt(state, state["messages"]))
+                registrar_tokens(response, nome_modelo)
+
+            except Exception as e:
+                print(f"[ERRO chatbot]: {e}")
+                raise
+
+            return {"messages": [response]}
+
+        def memoria(state: State, config: RunnableConfig) -> State:
+            return self.memoria.aplicar(state, config, llm=llm, nome_modelo=nome_modelo)
+
+        async def amemoria(state: State, config: RunnableConfig) -> State:
+            return await self.memoria.aaplicar(state, config, llm=llm, nome_modelo=nome_modelo)
+
+        def roteador(state: State) -> State:
+            decisao = self.roteador.decidir(state) if self.roteador else None
+            if decisao is None:
+                return {}
+            return {"messages": [self.roteador.mensagem(decisao)]}
+
+        def rota_roteador(state: State) -> str:
+            ultima = state["messages"][-1]
+            if isinstance(ultima, HumanMessage):
+                return "chatbot"
+            return "tools" if getattr(ultima, "tool_calls", None) else "__end__"
+
+        def resposta_rapida(state: State) -> State:
+            return {"messages": [AIMessage(content=self.roteador.resposta_pronta(state["messages"]))]}
+
+        def rota_tools(state: State) -> str:
+            # Tools pedidas pelo roteador: resposta pronta, a não ser que alguma tenha falhado
+            if self.roteador and self.roteador.resposta_pronta(state["messages"]) is not None:
+                return "resposta_rapida"
+            return "chatbot"
+
+        def pergunta_faq(state: State):
+            """Pergunta do turno, se o cache de FAQ valer para ela (cliente identificado, sem pedido em andamento)"""
+            if not self.cache_faq:
+                return None
+            nome = (state.get("user_info") or {}).get("nome")
+            if not nome or nome == "None":
+                return None
+            pergunta = None
+            for mensagem in reversed(state.get("messages", [])):
+                if isinstance(mensagem, HumanMessage):
+                    pergunta = mensagem.content
+                    break
+            if not self.cache_faq.elegivel(pergunta):
+                return None
+            try:
+                if pedido_em_andamento(state):
+                    return None
+            except Exception as e:
+                print(f"[CACHE FAQ] Erro ao conferir pedido em andamento: {e}")
+                return None
+            return pergunta
+
+        def consultar_faq(state: State) -> State:
+            if not isinstance(state["messages"][-1], HumanMessage):
+                return {}
+            pergunta = pergunta_faq(state)
+            if pergunta is None:
+                return {}
+            try:
+                resposta = self.cache_faq.buscar(pergunta)
+            except Exception as e:
+                print(f"[CACHE FAQ] Erro na busca: {e}")
+                return {}
+            if resposta is None:
+                return {}
+            return {"messages": [AIMessage(content=resposta.replace(MARCADOR_NOME, state["user_info"]["nome"]))]}
+
+        def rota_faq(state: State) -> str:
+            return "__end__" if isinstance(state["messages"][-1], AIMessage) else "chatbot"
+
+        def guardar_faq(state: State) -> State:
+            pergunta = pergunta_faq(state)
+            if pergunta is None:
+                return {}
+            mensagens = state["messages"]
+            inicio = max(i for i, mensagem in enumerate(mensagens) if isinstance(mensagem, HumanMessage))
+            turno = mensagens[inicio + 1:]
+            resposta = turno[-1] if turno else None
+            if not isinstance(resposta, AIMessage) or resposta.tool_calls or not isinstance(resposta.content, str):
+                return {}
+            usadas = {chamada["name"] for mensagem in turno if isinstance(mensagem, AIMessage)
+                      for chamada in (mensagem.tool_calls or [])}
+            if usadas - FERRAMENTAS_FAQ or not resposta.content.strip():
+                return {}
+            user_info = state["user_info"]
+            if user_info.get("telefone") and user_info["telefone"] in resposta.content:
+                return {}
+            try:
+                # Sem o nome do cliente: no acerto entra o nome de quem perguntou
+                self.cache_faq.guardar(pergunta, resposta.content.replace(user_info["nome"], MARCADOR_NOME))
+            except Exception as e:
+                print(f"[CACHE FAQ] Erro ao guardar resposta: {e}")
+            return {}
 
         # Wrapper customizado que passa o state para as tools de forma segura
         def safe_tool_node(state: State) -> State:
@@ -2123,15 +2480,16 @@ class AgentRestaurante:
             try:
                 messages = state.get("messages", [])
                 if not messages:
-                    return state
+                    return {}
                 
                 last_message = messages[-1]
                 if not hasattr(last_message, 'tool_calls') or not last_message.tool_calls:
-                    return state
+                    return {}
                 
-                tool_messages = []
+                # State convertido uma vez por passo; cada tool desta resposta recebe uma cópia
+                safe_state = self._prepare_safe_state(state)
                 
-                for tool_call in last_message.tool_calls:
+                def executar(tool_call):
                     tool_name = tool_call["name"]
                     tool_args = tool_call["args"]
                     
@@ -2142,67 +2500,125 @@ class AgentRestaurante:
                             tool_func = tool
                             break
                     
-                    if tool_func:
-                        try:
-                            # Prepara o state para serialização segura
-                            safe_state = self._prepare_safe_state(state)
-                            
-                            # Adiciona o state aos argumentos da tool se ela aceita
-                            if "state" in tool_func.func.__code__.co_varnames:
-                                tool_args["state"] = safe_state
-                            
-                            # Executa a tool
+                    if not tool_func:
+                        return None, None
+                    
+                    from langchain_core.messages import ToolMessage
+                    try:
+                        # Adiciona o state aos argumentos da tool se ela aceita. Cópia profunda
+                        # por tool: rodam em paralelo e alteram user_info/pedido aninhados
+                        if "state" in tool_func.func.__code__.co_varnames:
+                            tool_args["state"] = copy.deepcopy(safe_state)
+                        
+                        # Executa a tool
+                        with medir("tool", tool_name):
                             result = tool_func.invoke(tool_args)
-                            
-                            # Cria ToolMessage de forma segura
-                            from langchain_core.messages import ToolMessage
-                            tool_message = ToolMessage(
-                                content=str(result) if result else "Executado com sucesso",
-                                tool_call_id=tool_call["id"],
-                                name=tool_name
-                            )
-                            tool_messages.append(tool_message)
-                            
-                        except Exception as e:
-                            print(f"[SAFE_TOOL_NODE] Erro ao executar {tool_name}: {e}")
-                            from langchain_core.messages import ToolMessage
-                            error_message = ToolMessage(
-                                content=f"Erro: {str(e)}",
-                                tool_call_id=tool_call["id"],
-                                name=tool_name
-                            )
-                            tool_messages.append(error_message)
+                        
+                        # Cria ToolMessage de forma segura; o dict completo fica fora do histórico do LLM
+                        return ToolMessage(
+                            content=projetar_resultado(tool_name, result),
+                            tool_call_id=tool_call["id"],
+                            name=tool_name
+                        ), (result if isinstance(result, dict) else None)
+                        
+                    except Exception as e:
+                        print(f"[SAFE_TOOL_NODE] Erro ao executar {tool_name}: {e}")
+                        return ToolMessage(
+                            content=f"Erro: {str(e)}",
+                            tool_call_id=tool_call["id"],
+                            name=tool_name
+                        ), None
                 
-                return {
-                    **state,
-                    "messages": state["messages"] + tool_messages
-                }
+                def executar_grupo(indices):
+                    return [(indice, executar(last_message.tool_calls[indice])) for indice in indices]
+                
+                # Agrupa por recurso: cada grupo roda em série, grupos diferentes em paralelo
+                grupos = {}
+                for indice, tool_call in enumerate(last_message.tool_calls):
+                    recurso = RECURSO_TOOLS.get(tool_call["name"], "pedido")
+                    chave = recurso if recurso is not None else f"livre_{indice}"
+                    grupos.setdefault(chave, []).append(indice)
+                
+                resultados = {}
+                if len(grupos) == 1:
+                    for indices in grupos.values():
+                        resultados.update(executar_grupo(indices))
+                else:
+                    # copy_context: cada thread herda o turno atual (medições) e o config do LangGraph
+                    futuros = [
+                        executor_tools.submit(contextvars.copy_context().run, executar_grupo, indices)
+                        for indices in grupos.values()
+                    ]
+                    for futuro in futuros:
+                        resultados.update(futuro.result())
+                
+                # Mesma ordem das tool_calls da mensagem do LLM
+                tool_messages = []
+                completos = {}
+                for indice in sorted(resultados):
+                    mensagem, completo = resultados[indice]
+                    if mensagem is None:
+                        continue
+                    tool_messages.append(mensagem)
+                    if completo is not None:
+                        completos[mensagem.name] = completo
+                
+                atualizacao = {"messages": tool_messages}
+                if completos:
+                    atualizacao["resultados_tools"] = {**(state.get("resultados_tools") or {}), **completos}
+                return atualizacao
                 
             except Exception as e:
                 print(f"[SAFE_TOOL_NODE] Erro geral: {e}")
-                return state
+                return {}
         
         tools_node = safe_tool_node
 
-        graph_builder.add_node("entrada_usuario", RunnableLambda(lambda state: state))
-        graph_builder.add_node("check_user_role", RunnableLambda(check_user))
-        graph_builder.add_node("chatbot", chatbot)
-        graph_builder.add_node("tools", tools_node)
+        # Cada nó é cronometrado (histograma etapa_segundos{tipo="no"} e linha [TURNO])
+        graph_builder.add_node("entrada_usuario", RunnableLambda(no_cronometrado("entrada_usuario", lambda state: {})))
+        graph_builder.add_node("check_user_role", RunnableLambda(no_cronometrado("check_user_role", check_user)))
+        graph_builder.add_node("memoria", RunnableLambda(no_cronometrado("memoria", memoria),
+                                                         afunc=no_cronometrado("memoria", amemoria)))
+        graph_builder.add_node("roteador", RunnableLambda(no_cronometrado("roteador", roteador)))
+        graph_builder.add_node("resposta_rapida", RunnableLambda(no_cronometrado("resposta_rapida", resposta_rapida)))
+        graph_builder.add_node("cache_faq", RunnableLambda(no_cronometrado("cache_faq", consultar_faq)))
+        graph_builder.add_node("guardar_faq", RunnableLambda(no_cronometrado("guardar_faq", guardar_faq)))
+        graph_builder.add_node("chatbot", RunnableLambda(no_cronometrado("chatbot", chatbot),
+                                                         afunc=no_cronometrado("chatbot", achatbot)))
+        graph_builder.add_node("tools", no_cronometrado("tools", tools_node))
 
         # Ordem de fluxo
         graph_builder.set_entry_point("entrada_usuario")
         graph_builder.add_edge("entrada_usuario", "check_user_role")
-        graph_builder.add_edge("check_user_role", "chatbot")
+        graph_builder.add_edge("check_user_role", "memoria")
+        graph_builder.add_edge("memoria", "roteador")
+        graph_builder.add_conditional_edges(
+            "roteador",
+            rota_roteador,
+            {"chatbot": "cache_faq", "tools": "tools", "__end__": END}
+        )
+        graph_builder.add_conditional_edges(
+            "cache_faq",
+            rota_faq,
+            {"chatbot": "chatbot", "__end__": END}
+        )
         
         graph_builder.add_conditional_edges(
             "chatbot",
             tools_condition,
-            {"tools": "tools", "__end__": END}
+            {"tools": "tools", "__end__": "guardar_faq"}
         )
-        graph_builder.add_edge("tools", "chatbot")
+        graph_builder.add_edge("guardar_faq", END)
+        graph_builder.add_conditional_edges(
+            "tools",
+            rota_tools,
+            {"resposta_rapida": "resposta_rapida", "chatbot": "chatbot"}
+        )
+        graph_builder.add_edge("resposta_rapida", END)
 
-        memory = MongoDBSaver(coll_memoria)
-        graph = graph_builder.compile(checkpointer=memory)
+        graph = graph_builder.compile(checkpointer=self.memory)
+        if isinstance(self.memory, CheckpointerAdiado):
+            return GrafoCheckpointAdiado(graph, self.memory)
         return graph
 
     def memory_agent(self):
@@ -0,0 +1,56 @@
+import threading
+import time
+from services.metricas import registro
+
+metrica_agrupadas = registro.histograma(
+    "agrupador_mensagens_por_turno", "Quantidade de mensagens juntadas em um único turno",
+    buckets=(1, 2, 3, 4, 5, 8, 13)
+)
+
+
+class AgrupadorMensagens:
+    """
+    Junta mensagens seguidas da mesma conversa em um único turno.
+    Cada nova mensagem reinicia a janela de `janela` segundos; quando a janela
+    fecha (ou a espera total passa de `espera_maxima`), as mensagens acumuladas
+    são entregues de uma vez para `entregar(chave, itens)`.
+    """
+
+    def __init__(self, janela: float, entregar, espera_maxima: float = None):
+        self.janela = janela
+        self.espera_maxima = espera_maxima if espera_maxima is not None else janela * 4
+        self._entregar = entregar
+        self._pendentes = {}  # chave -> {"itens": [...], "prazo": float, "limite": float}
+        self._lock = threading.Lock()
+        self._mudou = threading.Condition(self._lock)
+        threading.Thread(target=self._loop, name="agrupador", daemon=True).start()
+
+    def adicionar(self, chave: str, item):
+        agora = time.monotonic()
+        with self._lock:
+            grupo = self._pendentes.get(chave)
+            if grupo is None:
+                grupo = {"itens": [], "limite": agora + self.espera_maxima}
+                self._pendentes[chave] = grupo
+            grupo["itens"].append(item)
+            grupo["prazo"] = min(agora + self.janela, grupo["limite"])
+            self._mudou.notify()
+
+    def _loop(self):
+        while True:
+            prontos = []
+            with self._lock:
+                agora = time.monotonic()
+                for chave, grupo in list(self._pendentes.items()):
+                    if grupo["prazo"] <= agora:
+                        prontos.append((chave, self._pendentes.pop(chave)["itens"]))
+                if not prontos:
+                    proximo = min((g["prazo"] for g in self._pendentes.values()), default=None)
+                    self._mudou.wait(None if proximo is None else max(proximo - agora, 0))
+                    continue
+            for chave, itens in prontos:
+                metrica_agrupadas.observe(len(itens))
+                try:
+                    self._entregar(chave, itens)
+                except Exception as e:
+                    print(f"[AGRUPADOR] Erro ao entregar mensagens de {chave}: {e}")
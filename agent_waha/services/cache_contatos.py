@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Só usa a biblioteca padrão (a coleção do Mongo vem de fora): também é importado
+# pelo Django (menu/services.py) como agent_waha.services.cache_contatos
+
+
+class CacheContatos:
+    """
+    Cache telefone -> chatId das consultas ao /api/contacts/check-exists do Waha.
+
+    Primeiro nível: LRU em memória. Segundo nível opcional: coleção do Mongo com
+    índice TTL em `expira_em`, compartilhada entre processos (bot e Django).
+    Números que não estão no WhatsApp também ficam guardados (cache negativo),
+    por menos tempo. Erros na consulta nunca são guardados.
+    """
+
+    def __init__(self, ttl: int = 7 * 24 * 3600, ttl_negativo: int = 3600, max_itens: int = 10000,
+                 obter_colecao=None):
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self.max_itens = max_itens
+        self._itens = OrderedDict()  # telefone -> (chat_id ou None, expira_em monotonic)
+        self._lock = threading.Lock()
+        self._obter_colecao = obter_colecao
+        self._colecao = None
+
+    def _colecao_mongo(self):
+        if self._obter_colecao is None:
+            return None
+        if self._colecao is None:
+            colecao = self._obter_colecao()
+            colecao.create_index("expira_em", expireAfterSeconds=0)
+            self._colecao = colecao
+        return self._colecao
+
+    def _guardar_memoria(self, telefone: str, chat_id, ttl: float):
+        with self._lock:
+            self._itens[telefone] = (chat_id, time.monotonic() + ttl)
+            self._itens.move_to_end(telefone)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def obter(self, telefone: str):
+        """
+        Retorna (encontrado, chat_id). chat_id None com encontrado=True significa
+        que o número já foi consultado e não está no WhatsApp.
+        """
+        with self._lock:
+            item = self._itens.get(telefone)
+            if item is not None:
+                if item[1] > time.monotonic():
+                    self._itens.move_to_end(telefone)
+                    return True, item[0]
+                del self._itens[telefone]
+
+        try:
+            colecao = self._colecao_mongo()
+            if colecao is not None:
+                doc = colecao.find_one({"_id": telefone})
+                # O TTL do Mongo remove em até ~1 min; confere a validade aqui também
+                if doc and doc["expira_em"] > datetime.utcnow():
+                    restante = (doc["expira_em"] - datetime.utcnow()).total_seconds()
+                    self._guardar_memoria(telefone, doc.get("chat_id"), restante)
+                    return True, doc.get("chat_id")
+        except Exception as e:
+            print(f"[CACHE CONTATOS] Erro ao ler {telefone} no Mongo: {e}")
+        return False, None
+
+    def guardar(self, telefone: str, chat_id):
+        """Guarda o resultado de uma consulta bem-sucedida (chat_id None = número sem WhatsApp)."""
+        ttl = self.ttl if chat_id else self.ttl_negativo
+        self._guardar_memoria(telefone, chat_id, ttl)
+        try:
+            colecao = self._colecao_mongo()
+            if colecao is not None:
+                colecao.update_one(
+                    {"_id": telefone},
+                    {"$set": {"chat_id": chat_id, "expira_em": datetime.utcnow() + timedelta(seconds=ttl)}},
+                    upsert=True,
+                )
+        except Exception as e:
+            print(f"[CACHE CONTATOS] Erro ao gravar {telefone} no Mongo: {e}")
+
+    def invalidar(self, telefone: str):
+        with self._lock:
+            self._itens.pop(telefone, None)
+        try:
+            colecao = self._colecao_mongo()
+            if colecao is not None:
+                colecao.delete_one({"_id": telefone})
+        except Exception as e:
+            print(f"[CACHE CONTATOS] Erro ao remover {telefone} do Mongo: {e}")
+
+    def resolver(self, telefone: str, consultar):
+        """
+        Retorna o chat_id do telefone (ou None se não estiver no WhatsApp), usando o
+        cache. `consultar(telefone)` faz a chamada ao Waha e retorna o chat_id ou
+        None; deve levantar exceção em caso de erro, para o erro não ser guardado.
+        """
+        encontrado, chat_id = self.obter(telefone)
+        if encontrado:
+            return chat_id
+        chat_id = consultar(telefone)
+        self.guardar(telefone, chat_id)
+        return chat_id
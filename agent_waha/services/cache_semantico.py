@@ -0,0 +1,209 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from services.metricas import registro
+from services.temporizacao import medir
+
+CACHE_FAQ = os.getenv("CACHE_FAQ", "1") == "1"
+
+metrica_faq = registro.contador("cache_faq_total", "Perguntas do cache semântico de FAQ por resultado")
+
+# O nome do cliente sai da resposta guardada e volta (o do cliente atual) no acerto
+MARCADOR_NOME = "{{nome}}"
+
+# Pergunta no estilo FAQ ("qual o horário?", "vocês entregam no centro?"): começa como pergunta
+# ou tem "?" e fala de um assunto do material de apoio
+PADRAO_PERGUNTA = re.compile(
+    r"^(qual|quais|que horas|quando|onde|como|quanto|voces|vcs|voce|tem|aceita|aceitam|"
+    r"entrega|entregam|funciona|funcionam|abre|abrem|fecha|fecham)\b"
+)
+PADRAO_ASSUNTO = re.compile(
+    r"\b(horario|aberto|abertos|funcionamento|entrega|entregam|taxa|pagamento|pix|cartao|dinheiro|"
+    r"cardapio|endereco|gluten|vegetarian[oa]|preparo|retirada)\b"
+)
+# Pergunta que depende da conversa ou do próprio cliente ("e o de frango?", "meu pedido já saiu?"):
+# a resposta não serve para outra pessoa
+PADRAO_CONTEXTO = re.compile(
+    r"^(e|mas|entao)\b|\b(meu|minha|meus|minhas|pedido|pedidos|isso|isto|esse|essa|esses|essas|"
+    r"ele|ela|eles|elas|dele|dela|nele|nela|aquele|aquela|mesmo|mesma|tambem|anterior)\b"
+)
+
+
+def _normalizar(texto: str) -> str:
+    texto = "".join(
+        c for c in unicodedata.normalize("NFD", str(texto).lower().strip())
+        if unicodedata.category(c) != "Mn"
+    )
+    return re.sub(r"\s+", " ", texto)
+
+
+class CacheSemantico:
+    """
+    Cache de respostas de perguntas frequentes pela similaridade dos embeddings.
+
+    Cada resposta vale para uma versão do cardápio/material de apoio
+    (`versao()`, consultada no máximo a cada `intervalo_versao` segundos):
+    quando a versão muda, as respostas antigas deixam de valer. Um acerto
+    exige similaridade de cosseno >= `limiar`.
+
+    Com `obter_colecao`, as respostas também ficam numa coleção do Mongo (TTL
+    em `expira_em`), lida de novo a cada `intervalo_recarga` segundos, para os
+    outros processos aproveitarem.
+    """
+
+    def __init__(self, embeddings, versao, limiar: float = 0.92, ttl: float = 24 * 3600, max_itens: int = 2000,
+                 max_caracteres: int = 160, intervalo_versao: float = 60, intervalo_recarga: float = 300,
+                 obter_colecao=None):
+        self.embeddings = embeddings
+        self.versao = versao
+        self.limiar = limiar
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self.max_caracteres = max_caracteres
+        self.intervalo_versao = intervalo_versao
+        self.intervalo_recarga = intervalo_recarga
+        self._obter_colecao = obter_colecao
+        self._colecao = None
+        self._lock = threading.Lock()
+        self._itens = []  # {"pergunta", "resposta", "vetor", "expira_em"}
+        self._matriz = None
+        self._versao_atual = None
+        self._versao_conferida = 0.0
+        self._recarregado = 0.0
+        self._vetores = OrderedDict()  # pergunta normalizada -> embedding (reaproveitado ao guardar)
+
+    def elegivel(self, pergunta) -> bool:
+        if not isinstance(pergunta, str) or not pergunta.strip() or len(pergunta) > self.max_caracteres:
+            return False
+        texto = _normalizar(pergunta)
+        if PADRAO_CONTEXTO.search(texto):
+            return False
+        return bool(PADRAO_PERGUNTA.search(texto) or ("?" in texto and PADRAO_ASSUNTO.search(texto)))
+
+    def _colecao_mongo(self):
+        if self._obter_colecao is None:
+            return None
+        if self._colecao is None:
+            colecao = self._obter_colecao()
+            colecao.create_index("expira_em", expireAfterSeconds=0)
+            colecao.create_index("versao")
+            self._colecao = colecao
+        return self._colecao
+
+    def _vetor(self, pergunta: str) -> np.ndarray:
+        chave = _normalizar(pergunta)
+        with self._lock:
+            vetor = self._vetores.get(chave)
+            if vetor is not None:
+                self._vetores.move_to_end(chave)
+                return vetor
+        with medir("http", "embeddings"):
+            vetor = np.asarray(self.embeddings.embed_query(chave), dtype=np.float32)
+        vetor /= (np.linalg.norm(vetor) or 1.0)
+        with self._lock:
+            self._vetores[chave] = vetor
+            while len(self._vetores) > 256:
+                self._vetores.popitem(last=False)
+        return vetor
+
+    def _carregar_mongo(self, versao: str) -> list:
+        colecao = self._colecao_mongo()
+        if colecao is None:
+            return []
+        itens = []
+        agora = datetime.utcnow()
+        for doc in colecao.find({"versao": versao, "expira_em": {"$gt": agora}}).limit(self.max_itens):
+            itens.append({
+                "pergunta": doc["pergunta"],
+                "resposta": doc["resposta"],
+                "vetor": np.asarray(doc["vetor"], dtype=np.float32),
+                "expira_em": time.monotonic() + (doc["expira_em"] - agora).total_seconds(),
+            })
+        return itens
+
+    def _atualizar(self):
+        """Confere a versão do material e recarrega as respostas do Mongo quando for a hora."""
+        agora = time.monotonic()
+        conferir_versao = agora - self._versao_conferida >= self.intervalo_versao
+        recarregar = agora - self._recarregado >= self.intervalo_recarga
+        if not conferir_versao and not recarregar:
+            return
+
+        versao = self._versao_atual
+        if conferir_versao:
+            versao = self.versao()
+            self._versao_conferida = agora
+        mudou = versao != self._versao_atual
+        if not mudou and not recarregar:
+            return
+
+        try:
+            itens = self._carregar_mongo(versao)
+        except Exception as e:
+            print(f"[CACHE FAQ] Erro ao carregar respostas do Mongo: {e}")
+            itens = None
+        with self._lock:
+            if mudou:
+                if self._versao_atual is not None:
+                    print(f"[CACHE FAQ] Material mudou ({self._versao_atual} -> {versao}); respostas antigas descartadas")
+                self._versao_atual = versao
+                self._itens = []
+            if itens is not None:
+                perguntas = {item["pergunta"] for item in self._itens}
+                self._itens.extend(item for item in itens if item["pergunta"] not in perguntas)
+                self._itens = self._itens[-self.max_itens:]
+            self._matriz = None
+        self._recarregado = agora
+
+    def buscar(self, pergunta: str):
+        """Resposta guardada para uma pergunta parecida (com MARCADOR_NOME), ou None."""
+        self._atualizar()
+        vetor = self._vetor(pergunta)
+        with self._lock:
+            agora = time.monotonic()
+            if self._matriz is None:
+                # Matriz refeita só quando os itens mudam; aproveita para tirar os vencidos
+                self._itens = [item for item in self._itens if item["expira_em"] > agora]
+                if not self._itens:
+                    metrica_faq.inc(resultado="miss")
+                    return None
+                self._matriz = np.vstack([item["vetor"] for item in self._itens])
+            similaridades = self._matriz @ vetor
+            indice = int(np.argmax(similaridades))
+            item = self._itens[indice]
+            if similaridades[indice] < self.limiar or item["expira_em"] <= agora:
+                metrica_faq.inc(resultado="miss")
+                return None
+            metrica_faq.inc(resultado="hit")
+            print(f"[CACHE FAQ] '{pergunta}' ~ '{item['pergunta']}' ({similaridades[indice]:.3f})")
+            return item["resposta"]
+
+    def guardar(self, pergunta: str, resposta: str):
+        vetor = self._vetor(pergunta)
+        versao = self._versao_atual
+        with self._lock:
+            self._itens.append({
+                "pergunta": _normalizar(pergunta),
+                "resposta": resposta,
+                "vetor": vetor,
+                "expira_em": time.monotonic() + self.ttl,
+            })
+            self._itens = self._itens[-self.max_itens:]
+            self._matriz = None
+        try:
+            colecao = self._colecao_mongo()
+            if colecao is not None and versao is not None:
+                colecao.insert_one({
+                    "versao": versao,
+                    "pergunta": _normalizar(pergunta),
+                    "resposta": resposta,
+                    "vetor": vetor.tolist(),
+                    "expira_em": datetime.utcnow() + timedelta(seconds=self.ttl),
+                })
+        except Exception as e:
+            print(f"[CACHE FAQ] Erro ao gravar resposta no Mongo: {e}")
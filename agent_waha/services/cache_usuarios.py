@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from pymongo import UpdateOne
+from services.agendador import agendador
+from services.metricas import registro
+
+metrica_cache = registro.contador("cache_usuarios_total", "Consultas ao cache de usuários por resultado (hit/miss)")
+
+_AUSENTE = object()
+
+
+class CacheUsuarios:
+    """
+    Cache em memória dos perfis da coleção de usuários, por telefone, com TTL.
+    Telefones sem cadastro também ficam guardados (por `ttl_ausente`), até o
+    cliente dizer o nome; criar/alterar o usuário deve chamar `invalidar`.
+
+    `ultima_interacao` é gravada depois (write-behind): as interações ficam num
+    buffer e vão para o Mongo num único bulk_write a cada `intervalo_gravacao`
+    segundos. Usa $max, então uma gravação atrasada nunca volta a data para trás.
+    """
+
+    def __init__(self, colecao, ttl: float = 300, ttl_ausente: float = 60, max_itens: int = 10000,
+                 intervalo_gravacao: float = 30):
+        self.colecao = colecao
+        self.ttl = ttl
+        self.ttl_ausente = ttl_ausente
+        self.max_itens = max_itens
+        self.intervalo_gravacao = intervalo_gravacao
+        self._itens = OrderedDict()  # telefone -> (documento ou _AUSENTE, expira_em monotonic)
+        self._pendentes = {}  # telefone -> ultima_interacao (ISO)
+        self._gravacao_agendada = False
+        self._lock = threading.Lock()
+
+    def _guardar(self, telefone: str, documento):
+        ttl = self.ttl if documento is not _AUSENTE else self.ttl_ausente
+        with self._lock:
+            self._itens[telefone] = (documento, time.monotonic() + ttl)
+            self._itens.move_to_end(telefone)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def obter(self, telefone: str):
+        """Perfil do usuário (cópia) ou None se o telefone não tiver cadastro."""
+        with self._lock:
+            item = self._itens.get(telefone)
+            if item is not None and item[1] > time.monotonic():
+                self._itens.move_to_end(telefone)
+                metrica_cache.inc(resultado="hit")
+                return None if item[0] is _AUSENTE else dict(item[0])
+
+        metrica_cache.inc(resultado="miss")
+        documento = self.colecao.find_one({"telefone": telefone})
+        self._guardar(telefone, documento if documento is not None else _AUSENTE)
+        return dict(documento) if documento is not None else None
+
+    def invalidar(self, telefone: str):
+        with self._lock:
+            self._itens.pop(telefone, None)
+
+    def registrar_interacao(self, telefone: str, quando: str):
+        """Guarda `ultima_interacao` para a próxima gravação em lote."""
+        with self._lock:
+            anterior = self._pendentes.get(telefone)
+            self._pendentes[telefone] = max(anterior, quando) if anterior else quando
+            item = self._itens.get(telefone)
+            if item is not None and item[0] is not _AUSENTE:
+                item[0]["ultima_interacao"] = quando
+            if self._gravacao_agendada:
+                return
+            self._gravacao_agendada = True
+        agendador.agendar(self.intervalo_gravacao, self.descarregar)
+
+    def descarregar(self) -> int:
+        """Grava as interações pendentes num único bulk_write. Retorna quantas foram gravadas."""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+            self._gravacao_agendada = False
+        if not pendentes:
+            return 0
+
+        operacoes = [
+            UpdateOne({"telefone": telefone}, {"$max": {"ultima_interacao": quando}})
+            for telefone, quando in pendentes.items()
+        ]
+        try:
+            self.colecao.bulk_write(operacoes, ordered=False)
+            print(f"[CACHE USUARIOS] {len(operacoes)} interações gravadas")
+            return len(operacoes)
+        except Exception as e:
+            print(f"[CACHE USUARIOS] Erro ao gravar interações, tentando de novo depois: {e}")
+            with self._lock:
+                for telefone, quando in pendentes.items():
+                    atual = self._pendentes.get(telefone)
+                    self._pendentes[telefone] = max(atual, quando) if atual else quando
+                agendar = not self._gravacao_agendada
+                self._gravacao_agendada = True
+            if agendar:
+                agendador.agendar(self.intervalo_gravacao, self.descarregar)
+            return 0
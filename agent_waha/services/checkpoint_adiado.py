@@ -0,0 +1,224 @@
+import threading
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple, copy_checkpoint
+from services.metricas import registro
+
+metrica_checkpoints = registro.contador(
+    "checkpoints_total", "Checkpoints do grafo por destino (coalescido em memória ou gravado no checkpointer)"
+)
+
+
+def _chave(config: dict):
+    configurable = config.get("configurable", {})
+    return configurable.get("thread_id"), configurable.get("checkpoint_ns", "")
+
+
+class _Pendente:
+    """Último checkpoint de um turno ainda não gravado, com as escritas pendentes dele."""
+
+    def __init__(self, config_pai: dict):
+        self.config_pai = config_pai  # config do último checkpoint já gravado (ou sem checkpoint_id)
+        self.config = None
+        self.checkpoint = None
+        self.metadata = None
+        self.versoes = {}
+        self.escritas = []  # (task_id, canal, valor)
+        self.coalescidos = 0
+
+
+class CheckpointerAdiado(BaseCheckpointSaver):
+    """
+    Envolve um checkpointer (MongoDBSaver, AsyncMongoDBSaver...) e segura em
+    memória os checkpoints intermediários do turno: cada super-step substitui
+    o anterior e só o último vai para o checkpointer em `descarregar`, chamado
+    no fim do turno (com sucesso ou erro) pelo GrafoCheckpointAdiado.
+
+    O checkpoint gravado aponta para o último checkpoint já persistido da
+    thread, então o histórico no banco continua encadeado (só sem os passos
+    intermediários). Se o processo morrer no meio do turno, o turno se perde
+    e a conversa volta ao checkpoint anterior.
+
+    Medido com `benchmark.py --memoria --roteiro misto` (70 turnos): sem adiar,
+    10,6 checkpoints + 19,1 checkpoint_writes gravados por turno; adiando,
+    1 checkpoint e nenhum checkpoint_write.
+    """
+
+    def __init__(self, salvo: BaseCheckpointSaver):
+        super().__init__(serde=salvo.serde)
+        self.salvo = salvo
+        self._pendentes = {}  # (thread_id, checkpoint_ns) -> _Pendente
+        self._lock = threading.Lock()
+
+    def get_next_version(self, current, channel):
+        return self.salvo.get_next_version(current, channel)
+
+    def _tupla_pendente(self, config: dict):
+        with self._lock:
+            pendente = self._pendentes.get(_chave(config))
+            if pendente is None or pendente.checkpoint is None:
+                return None
+            checkpoint_id = config.get("configurable", {}).get("checkpoint_id")
+            if checkpoint_id and checkpoint_id != pendente.checkpoint["id"]:
+                return None
+            return CheckpointTuple(
+                config=pendente.config,
+                checkpoint=pendente.checkpoint,
+                metadata=pendente.metadata,
+                parent_config=pendente.config_pai if pendente.config_pai["configurable"].get("checkpoint_id") else None,
+                pending_writes=list(pendente.escritas),
+            )
+
+    def _guardar(self, config: dict, checkpoint, metadata, new_versions) -> dict:
+        chave = _chave(config)
+        novo_config = {
+            "configurable": {
+                "thread_id": chave[0],
+                "checkpoint_ns": chave[1],
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+        with self._lock:
+            pendente = self._pendentes.get(chave)
+            if pendente is None:
+                # O config do primeiro checkpoint do turno aponta para o último gravado
+                pendente = self._pendentes[chave] = _Pendente(config)
+            pendente.config = novo_config
+            pendente.checkpoint = copy_checkpoint(checkpoint)
+            pendente.metadata = metadata
+            pendente.versoes.update(new_versions)
+            pendente.escritas = []
+            pendente.coalescidos += 1
+        metrica_checkpoints.inc(destino="memoria")
+        return novo_config
+
+    def _guardar_escritas(self, config: dict, writes, task_id: str):
+        with self._lock:
+            pendente = self._pendentes.get(_chave(config))
+            if pendente is None or pendente.checkpoint is None:
+                return False
+            pendente.escritas.extend((task_id, canal, valor) for canal, valor in writes)
+            return True
+
+    @staticmethod
+    def _por_task(escritas: list) -> dict:
+        por_task = {}
+        for task_id, canal, valor in escritas:
+            por_task.setdefault(task_id, []).append((canal, valor))
+        return por_task
+
+    def _retirar(self, thread_id: str):
+        with self._lock:
+            chaves = [chave for chave in self._pendentes if chave[0] == thread_id]
+            return [self._pendentes.pop(chave) for chave in chaves]
+
+    # --- interface síncrona ---
+
+    def get_tuple(self, config):
+        return self._tupla_pendente(config) or self.salvo.get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        if config is not None and filter is None and before is None:
+            tupla = self._tupla_pendente(config)
+            if tupla is not None:
+                yield tupla
+                limit = limit - 1 if limit else limit
+                if limit == 0:
+                    return
+        yield from self.salvo.list(config, filter=filter, before=before, limit=limit)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self._guardar(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, *args, **kwargs):
+        if not self._guardar_escritas(config, writes, task_id):
+            self.salvo.put_writes(config, writes, task_id, *args, **kwargs)
+
+    def descarregar(self, thread_id: str) -> int:
+        """Grava o último checkpoint (e as escritas pendentes dele) de cada namespace da thread."""
+        gravados = 0
+        for pendente in self._retirar(thread_id):
+            config = self.salvo.put(pendente.config_pai, pendente.checkpoint, pendente.metadata, pendente.versoes)
+            for task_id, escritas in self._por_task(pendente.escritas).items():
+                self.salvo.put_writes(config, escritas, task_id)
+            gravados += 1
+            metrica_checkpoints.inc(destino="gravado")
+            print(f"[CHECKPOINT] {thread_id}: 1 gravação no lugar de {pendente.coalescidos}")
+        return gravados
+
+    # --- interface assíncrona (AsyncMongoDBSaver) ---
+
+    async def aget_tuple(self, config):
+        return self._tupla_pendente(config) or await self.salvo.aget_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        if config is not None and filter is None and before is None:
+            tupla = self._tupla_pendente(config)
+            if tupla is not None:
+                yield tupla
+                limit = limit - 1 if limit else limit
+                if limit == 0:
+                    return
+        async for tupla in self.salvo.alist(config, filter=filter, before=before, limit=limit):
+            yield tupla
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return self._guardar(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, *args, **kwargs):
+        if not self._guardar_escritas(config, writes, task_id):
+            await self.salvo.aput_writes(config, writes, task_id, *args, **kwargs)
+
+    async def adescarregar(self, thread_id: str) -> int:
+        gravados = 0
+        for pendente in self._retirar(thread_id):
+            config = await self.salvo.aput(pendente.config_pai, pendente.checkpoint, pendente.metadata,
+                                           pendente.versoes)
+            for task_id, escritas in self._por_task(pendente.escritas).items():
+                await self.salvo.aput_writes(config, escritas, task_id)
+            gravados += 1
+            metrica_checkpoints.inc(destino="gravado")
+            print(f"[CHECKPOINT] {thread_id}: 1 gravação no lugar de {pendente.coalescidos}")
+        return gravados
+
+
+class GrafoCheckpointAdiado:
+    """
+    Grafo compilado com CheckpointerAdiado: depois de cada invoke/stream
+    (também quando dão erro) grava o checkpoint final da thread. O resto
+    (get_state, update_state...) vai direto para o grafo.
+    """
+
+    def __init__(self, grafo, checkpointer: CheckpointerAdiado):
+        self.grafo = grafo
+        self.checkpointer = checkpointer
+
+    def __getattr__(self, nome):
+        return getattr(self.grafo, nome)
+
+    @staticmethod
+    def _thread(config):
+        return (config or {}).get("configurable", {}).get("thread_id")
+
+    def invoke(self, entrada, config=None, **kwargs):
+        try:
+            return self.grafo.invoke(entrada, config, **kwargs)
+        finally:
+            self.checkpointer.descarregar(self._thread(config))
+
+    def stream(self, entrada, config=None, **kwargs):
+        try:
+            yield from self.grafo.stream(entrada, config, **kwargs)
+        finally:
+            self.checkpointer.descarregar(self._thread(config))
+
+    async def ainvoke(self, entrada, config=None, **kwargs):
+        try:
+            return await self.grafo.ainvoke(entrada, config, **kwargs)
+        finally:
+            await self.checkpointer.adescarregar(self._thread(config))
+
+    async def astream(self, entrada, config=None, **kwargs):
+        try:
+            async for parte in self.grafo.astream(entrada, config, **kwargs):
+                yield parte
+        finally:
+            await self.checkpointer.adescarregar(self._thread(config))
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from services.metricas import registro
+
+metrica_duplicados = registro.contador(
+    "webhook_duplicados_total", "Eventos do WAHA descartados por já terem sido recebidos"
+)
+
+
+class CacheDeduplicacao:
+    """
+    Guarda os ids de mensagens do WAHA já recebidas por `ttl` segundos.
+    Primeiro nível: LRU em memória (O(1)). Segundo nível opcional: coleção do
+    Mongo com índice TTL, para reconhecer retentativas entre processos/reinícios.
+    """
+
+    def __init__(self, ttl: int = 3600, max_itens: int = 50000, obter_colecao=None):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._itens = OrderedDict()  # message_id -> expira_em
+        self._lock = threading.Lock()
+        self._obter_colecao = obter_colecao
+        self._colecao = None
+
+    def _colecao_mongo(self):
+        if self._obter_colecao is None:
+            return None
+        if self._colecao is None:
+            colecao = self._obter_colecao()
+            colecao.create_index("criado_em", expireAfterSeconds=self.ttl)
+            self._colecao = colecao
+        return self._colecao
+
+    def registrar(self, message_id: str) -> bool:
+        """
+        Marca o id como recebido. Retorna False se ele já tinha sido visto
+        (evento duplicado), True se é a primeira vez.
+        """
+        agora = time.monotonic()
+        with self._lock:
+            expira_em = self._itens.get(message_id)
+            if expira_em is not None and expira_em > agora:
+                self._itens.move_to_end(message_id)
+                metrica_duplicados.inc(origem="memoria")
+                return False
+            self._itens[message_id] = agora + self.ttl
+            self._itens.move_to_end(message_id)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+        try:
+            colecao = self._colecao_mongo()
+            if colecao is not None:
+                colecao.insert_one({"_id": message_id, "criado_em": datetime.utcnow()})
+        except DuplicateKeyError:
+            metrica_duplicados.inc(origem="mongo")
+            return False
+        except Exception as e:
+            # Falha no Mongo não pode derrubar o webhook; fica só a proteção em memória
+            print(f"[DEDUP] Erro ao registrar {message_id} no Mongo: {e}")
+        return True
+
+    def esquecer(self, message_id: str):
+        """Desfaz `registrar` (ex.: o evento não chegou à fila), para a retentativa do WAHA ser aceita."""
+        with self._lock:
+            self._itens.pop(message_id, None)
+        try:
+            colecao = self._colecao_mongo()
+            if colecao is not None:
+                colecao.delete_one({"_id": message_id})
+        except Exception as e:
+            print(f"[DEDUP] Erro ao remover {message_id} do Mongo: {e}")
@@ -0,0 +1,62 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from services.metricas import registro
+
+metrica_conversas_ativas = registro.medidor(
+    "despachante_conversas_ativas", "Conversas com turno em execução"
+)
+
+
+class DespachanteConversas:
+    """
+    Executa turnos em um pool limitado de threads garantindo que, para a mesma
+    chave (thread_id do LangGraph), os turnos rodem estritamente em ordem e
+    nunca ao mesmo tempo. Chaves diferentes rodam em paralelo.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pendentes: int = 100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="turno")
+        self._filas = {}  # chave -> deque de tarefas aguardando a vez
+        self._lock = threading.Lock()
+        # Limita quantas tarefas podem estar aceitas (rodando ou aguardando) ao mesmo tempo.
+        # Quem submete fica bloqueado, e o excedente continua na fila durável.
+        self._vagas = threading.BoundedSemaphore(max_pendentes)
+
+    def submeter(self, chave: str, funcao, *args, **kwargs):
+        """Agenda `funcao(*args, **kwargs)` para rodar após os turnos anteriores da mesma chave."""
+        self._vagas.acquire()
+        tarefa = (funcao, args, kwargs)
+        with self._lock:
+            fila = self._filas.get(chave)
+            if fila is not None:
+                # Já existe turno em andamento para essa conversa: aguarda a vez
+                fila.append(tarefa)
+                return
+            self._filas[chave] = deque()
+            metrica_conversas_ativas.set(len(self._filas))
+        self._executor.submit(self._executar, chave, tarefa)
+
+    def _executar(self, chave: str, tarefa):
+        funcao, args, kwargs = tarefa
+        try:
+            funcao(*args, **kwargs)
+        except Exception as e:
+            print(f"[DESPACHANTE] Erro no turno de {chave}: {e}")
+        finally:
+            self._vagas.release()
+            self._proxima(chave)
+
+    def _proxima(self, chave: str):
+        with self._lock:
+            fila = self._filas.get(chave)
+            if not fila:
+                self._filas.pop(chave, None)
+                metrica_conversas_ativas.set(len(self._filas))
+                return
+            proxima = fila.popleft()
+        self._executor.submit(self._executar, chave, proxima)
+
+    def conversas_ativas(self) -> int:
+        with self._lock:
+            return len(self._filas)
@@ -0,0 +1,108 @@
+import re
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+# Funções de interpretação dos eventos recebidos, compartilhadas pelo app Flask (app.py)
+# e pelo app assíncrono (app_async.py)
+
+
+class PayloadInvalido(Exception):
+    pass
+
+
+def formatar_mensagem_whatsapp(texto: str) -> str:
+    """
+    Ajusta a formatação para o padrão do WhatsApp.
+    - Transforma **negrito** (markdown) em *negrito* (WhatsApp)
+    - Remove excesso de espaços ou caracteres inválidos, se quiser expandir
+    """
+    return texto.replace("**", "*")
+
+
+def extrair_mensagem_waha(data: dict):
+    """
+    Extrai chat_id, texto e id da mensagem de um evento do WAHA.
+    Retorna None quando o evento deve ser ignorado (grupo, status, mídia...).
+    Levanta PayloadInvalido se o payload não tiver os campos esperados.
+    """
+    try:
+        chat_id = data['payload']['from']
+        received_message = data['payload']['body']
+    except (KeyError, TypeError) as e:
+        raise PayloadInvalido(f"Erro ao acessar dados do payload: {e}")
+
+    # Evitar spam de eventos irrelevantes
+    is_group = '@g.us' in chat_id
+    is_status = 'status@broadcast' in chat_id
+    msg_type = data['payload'].get('_data', {}).get('type')
+    msg_subtype = data['payload'].get('_data', {}).get('subtype')
+
+    if is_group or is_status or msg_type != 'chat' or msg_subtype == 'encrypt' or not received_message:
+        return None
+
+    return {
+        "chat_id": chat_id,
+        "mensagem": received_message,
+        "message_id": data['payload'].get('id'),
+    }
+
+
+def extrair_resposta(result) -> str:
+    """Retorna o conteúdo da última mensagem do resultado do grafo."""
+    raw = result.get("messages") if isinstance(result, dict) else result
+
+    # Converte cada mensagem em dict simples
+    msgs = []
+    for m in raw:
+        if isinstance(m, (HumanMessage, AIMessage, ToolMessage)):
+            msgs.append({"role": m.type, "content": m.content})
+        elif isinstance(m, dict):
+            msgs.append(m)
+        else:
+            msgs.append({"role": getattr(m, "role", "assistant"), "content": str(m)})
+
+    ultima = msgs[-1] if msgs else {"content": "⚠️ Nenhuma resposta gerada."}
+    return ultima["content"]
+
+
+def extrair_pagamento_asaas(data: dict):
+    """
+    Interpreta o webhook de pagamento recebido do Asaas.
+    Retorna None para eventos que não são PAYMENT_RECEIVED; levanta PayloadInvalido
+    se a descrição da cobrança não estiver no formato gerado por criar_cobranca_asaas.
+    """
+    if data.get("event") != "PAYMENT_RECEIVED":
+        return None
+
+    description = data["payment"].get("description", "")
+
+    # Exemplo: "Pedido #d815e354 - Vinícius - (11)91234-5678 - Pirão Burger"
+    padrao = r"Pedido\s+#(\w+)\s*-\s*(.*?)\s*-\s*(.*?)\s*-"
+    match = re.search(padrao, description)
+
+    if not match:
+        raise PayloadInvalido(f"Formato inesperado de description: {description}")
+
+    id_pedido = match.group(1).strip()
+    nome_cliente = match.group(2).strip()
+    telefone = match.group(3).strip()
+
+    # Normaliza o telefone para padrão internacional (ex: 55DDDNUMERO)
+    telefone_formatado = telefone.replace("(", "").replace(")", "").replace("-", "").replace(" ", "")
+    if not telefone_formatado.startswith("55"):
+        telefone_formatado = "55" + telefone_formatado  # adiciona DDI Brasil
+
+    mensagem = (
+        f"*Pagamento confirmado!* 🎉\n\n"
+        f"✅ Pedido *#{id_pedido}*\n"
+        f"👤 Cliente: *{nome_cliente}*\n"
+        f"📞 Telefone: {telefone}\n\n"
+        f"Obrigado por comprar no Pirão Burger, Seu pedido já foi encaminhado para cozinha 🍔🔥"
+    )
+
+    return {
+        "id_pedido": id_pedido,
+        "nome_cliente": nome_cliente,
+        "telefone": telefone,
+        "chat_id": telefone_formatado + "@c.us",
+        "mensagem": mensagem,
+    }
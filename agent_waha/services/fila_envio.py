@@ -0,0 +1,241 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Só usa a biblioteca padrão: também é importado pelo Django (menu/services.py)
+# como agent_waha.services.fila_envio
+
+# Classes de prioridade (menor sai primeiro)
+PRIORIDADE_RESPOSTA = 0  # resposta do bot para quem está conversando
+PRIORIDADE_PAGAMENTO = 1  # confirmação de pagamento
+PRIORIDADE_STATUS = 2  # notificação de status do pedido
+
+
+class BaldeTokens:
+    """
+    Token bucket: `taxa` envios por segundo com rajadas de até `capacidade`.
+    Quando o Waha responde 429 a taxa cai pela metade e volta aos poucos a cada envio bem-sucedido.
+    Usado só pela thread de envio da sessão, por isso não tem lock.
+    """
+
+    def __init__(self, taxa: float, capacidade: int):
+        self.taxa_maxima = taxa
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = float(capacidade)
+        self._atualizado = time.monotonic()
+
+    def consumir(self) -> float:
+        """Consome um token se houver; senão retorna quantos segundos esperar."""
+        agora = time.monotonic()
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._atualizado) * self.taxa)
+        self._atualizado = agora
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.taxa
+
+    def reduzir(self):
+        self.taxa = max(self.taxa_maxima / 8, self.taxa / 2)
+        self._tokens = 0.0
+
+    def recuperar(self):
+        self.taxa = min(self.taxa_maxima, self.taxa + self.taxa_maxima * 0.05)
+
+
+class FilaEnvio:
+    """
+    Fila de saída de mensagens de uma sessão do Waha.
+
+    Uma thread por sessão drena a fila em lotes, na ordem de prioridade (e de
+    chegada dentro da mesma prioridade), respeitando o token bucket. Com fila
+    acumulada, mensagens seguidas do mesmo chat e prioridade no lote viram um
+    único envio. Só voltam para a fila, com backoff, as falhas em que a
+    mensagem com certeza não foi entregue: 429, 5xx e as exceções aceitas por
+    `retentavel(erro)` (ex.: conexão recusada). As outras exceções (timeout de
+    leitura, conexão caída no meio do POST) deixam o resultado desconhecido e
+    a mensagem não é reenviada, para não chegar duas vezes ao cliente.
+
+    `enviar(chat_id, texto)` faz a chamada ao Waha e retorna o status HTTP.
+    """
+
+    def __init__(self, nome: str, enviar, taxa: float = 2.0, rajada: int = 5, tamanho_lote: int = 10,
+                 max_pendentes: int = 1000, max_tentativas: int = 5, retentavel=None):
+        self.nome = nome
+        self.enviar = enviar
+        self.retentavel = retentavel or (lambda erro: False)
+        self.tamanho_lote = tamanho_lote
+        self.max_pendentes = max_pendentes
+        self.max_tentativas = max_tentativas
+        self.balde = BaldeTokens(taxa, rajada)
+        self._heap = []  # (prioridade, seq, item)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def enfileirar(self, chat_id: str, texto: str, prioridade: int = PRIORIDADE_RESPOSTA, ao_concluir=None) -> bool:
+        """
+        Coloca a mensagem na fila. `ao_concluir(enviado)` é chamado depois do
+        envio (True), da desistência (False) ou de uma falha com resultado
+        desconhecido (None: o Waha pode ter recebido). Retorna False se a fila
+        estiver cheia só de mensagens tão ou mais prioritárias que esta.
+        """
+        item = {
+            "chat_id": chat_id,
+            "texto": texto,
+            "prioridade": prioridade,
+            "ao_concluir": [ao_concluir] if ao_concluir else [],
+            "tentativas": 0,
+        }
+        descartado = None
+        with self._cond:
+            if len(self._heap) >= self.max_pendentes:
+                # Cheia: sai a mensagem menos prioritária (e mais nova), se for menos importante que esta
+                pior = max(self._heap)
+                if pior[0] <= prioridade:
+                    print(f"[ENVIO {self.nome}] Fila cheia, mensagem para {chat_id} descartada")
+                    return False
+                self._heap.remove(pior)
+                heapq.heapify(self._heap)
+                descartado = pior[2]
+            heapq.heappush(self._heap, (prioridade, next(self._seq), item))
+            self._iniciar()
+            self._cond.notify()
+
+        if descartado is not None:
+            print(f"[ENVIO {self.nome}] Fila cheia, descartada mensagem de prioridade {descartado['prioridade']} "
+                  f"para {descartado['chat_id']}")
+            self._concluir(descartado, False)
+        return True
+
+    def pendentes(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def _iniciar(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._drenar, name=f"envio-{self.nome}", daemon=True)
+            self._thread.start()
+
+    def cancelar(self, ao_concluir) -> bool:
+        """
+        Tira da fila a mensagem enfileirada com esse `ao_concluir`, se ela ainda
+        estiver esperando. Retorna False se ela já saiu da fila (está sendo
+        enviada ou já foi concluída); nesse caso o `ao_concluir` ainda será chamado.
+        """
+        with self._cond:
+            for entrada in self._heap:
+                if ao_concluir in entrada[2]["ao_concluir"]:
+                    self._heap.remove(entrada)
+                    heapq.heapify(self._heap)
+                    return True
+        return False
+
+    def _proximo_lote(self) -> list:
+        with self._cond:
+            while not self._heap:
+                self._cond.wait()
+            entradas = [heapq.heappop(self._heap) for _ in range(min(self.tamanho_lote, len(self._heap)))]
+
+        # Agrupa mensagens seguidas do mesmo chat e prioridade (só acontece com fila acumulada).
+        # Cada uma continua separada, para voltar sozinha à fila (e poder ser cancelada) se o envio falhar
+        lote = []
+        for entrada in entradas:
+            anterior = lote[-1][-1] if lote else None
+            if anterior and anterior[2]["chat_id"] == entrada[2]["chat_id"] and anterior[0] == entrada[0]:
+                lote[-1].append(entrada)
+            else:
+                lote.append([entrada])
+        return lote
+
+    def _devolver(self, entradas: list):
+        with self._cond:
+            for entrada in entradas:
+                heapq.heappush(self._heap, entrada)
+
+    def _concluir(self, item: dict, enviado):
+        for callback in item["ao_concluir"]:
+            try:
+                callback(enviado)
+            except Exception as e:
+                print(f"[ENVIO {self.nome}] Erro no callback de {item['chat_id']}: {e}")
+
+    def _drenar(self):
+        while True:
+            lote = self._proximo_lote()
+            for indice, grupo in enumerate(lote):
+                itens = [item for _, _, item in grupo]
+                chat_id = itens[0]["chat_id"]
+                espera = self.balde.consumir()
+                while espera > 0:
+                    time.sleep(espera)
+                    espera = self.balde.consumir()
+
+                try:
+                    status = self.enviar(chat_id, "\n\n".join(item["texto"] for item in itens))
+                    erro = None
+                except Exception as e:
+                    status, erro = None, e
+
+                if erro is None and status is not None and status < 400:
+                    self.balde.recuperar()
+                    for item in itens:
+                        self._concluir(item, True)
+                    continue
+
+                if erro is not None and not self.retentavel(erro):
+                    # O POST pode ter chegado ao Waha (ex.: timeout de leitura): reenviar poderia duplicar
+                    print(f"[ENVIO {self.nome}] Resultado desconhecido do envio para {chat_id}, sem reenvio: {erro}")
+                    for item in itens:
+                        self._concluir(item, None)
+                    continue
+
+                if erro is None and (status is None or (status < 500 and status != 429)):
+                    # Erro do pedido (chat inválido etc.): reenviar não adianta
+                    print(f"[ENVIO {self.nome}] Waha recusou a mensagem para {chat_id}: {status}")
+                    for item in itens:
+                        self._concluir(item, False)
+                    continue
+
+                if status == 429:
+                    self.balde.reduzir()
+
+                tentativas = max(item["tentativas"] for item in itens) + 1
+                for item in itens:
+                    item["tentativas"] = tentativas
+                restantes = [entrada for seguinte in lote[indice + 1:] for entrada in seguinte]
+                if tentativas >= self.max_tentativas:
+                    print(f"[ENVIO {self.nome}] Desistindo da mensagem para {chat_id} "
+                          f"após {tentativas} tentativas: {erro or status}")
+                    for item in itens:
+                        self._concluir(item, False)
+                else:
+                    restantes = grupo + restantes
+
+                # Waha instável: devolve o resto do lote (na ordem original) e espera antes de tentar de novo
+                self._devolver(restantes)
+                atraso = min(30.0, 0.5 * (2 ** tentativas))
+                print(f"[ENVIO {self.nome}] Falha ao enviar ({erro or status}); nova tentativa em {atraso:.1f}s")
+                time.sleep(atraso)
+                break
+
+
+_filas = {}
+_lock = threading.Lock()
+
+
+def obter_fila_envio(sessao: str, enviar, **opcoes) -> FilaEnvio:
+    """Fila única por sessão do Waha no processo. As opções valem só na criação."""
+    with _lock:
+        fila = _filas.get(sessao)
+        if fila is None:
+            fila = FilaEnvio(sessao, enviar, **opcoes)
+            _filas[sessao] = fila
+        return fila
+
+
+def total_pendentes() -> int:
+    with _lock:
+        filas = list(_filas.values())
+    return sum(fila.pendentes() for fila in filas)
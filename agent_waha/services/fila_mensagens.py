@@ -0,0 +1,244 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from services.metricas import registro
+from services.agendador import agendador
+from services.agrupador import AgrupadorMensagens
+
+metrica_espera = registro.histograma(
+    "fila_espera_segundos", "Tempo entre o recebimento do webhook e o início do processamento"
+)
+metrica_processamento = registro.histograma(
+    "fila_processamento_segundos", "Tempo de processamento de um evento da fila"
+)
+metrica_eventos = registro.contador(
+    "fila_eventos_total", "Eventos da fila por resultado"
+)
+metrica_envios = registro.contador(
+    "fila_envios_resposta_total", "Envios de resposta feitos depois do turno confirmado, por resultado"
+)
+
+
+class TurnoJaIniciado(Exception):
+    """
+    O turno falhou depois que o grafo começou a rodar: tools de pedido e o
+    checkpoint podem já ter gravado e trechos podem já ter ido para o cliente,
+    então repetir o evento duplicaria mensagens e pedidos.
+    """
+
+
+class FilaMensagens:
+    """
+    Fila local durável (SQLite) para os eventos recebidos nos webhooks.
+    O webhook só grava o evento e responde; os workers consomem em segundo plano.
+
+    Cada evento reservado fica com o dono (esta instância) e uma reserva que vale
+    `tempo_reserva` segundos, renovada enquanto o processo está vivo. Se o
+    processo cair, a reserva vence e o evento volta a ser elegível; outro
+    processo usando o mesmo arquivo nunca pega um evento com reserva válida.
+    """
+
+    def __init__(self, caminho_db: str, max_tentativas: int = 3, tempo_reserva: float = 60):
+        self.caminho_db = caminho_db
+        self.max_tentativas = max_tentativas
+        self.tempo_reserva = tempo_reserva
+        self.dono = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._disponivel = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(caminho_db, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS eventos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pendente',
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                enfileirado_em REAL NOT NULL,
+                disponivel_em REAL NOT NULL
+            )
+            """
+        )
+        colunas = {linha[1] for linha in self._conn.execute("PRAGMA table_info(eventos)")}
+        if "dono" not in colunas:
+            # Filas criadas antes das reservas com dono: eventos em processamento vencem na hora
+            self._conn.execute("ALTER TABLE eventos ADD COLUMN dono TEXT")
+            self._conn.execute("ALTER TABLE eventos ADD COLUMN reservado_ate REAL NOT NULL DEFAULT 0")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_eventos_status ON eventos (status, disponivel_em, id)"
+        )
+        registro.medidor("fila_profundidade", "Eventos aguardando processamento", self.tamanho)
+
+    def renovar_reservas(self) -> int:
+        """Estende a reserva dos eventos desta instância que ainda estão em processamento."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE eventos SET reservado_ate = ? WHERE status = 'processando' AND dono = ?",
+                (time.time() + self.tempo_reserva, self.dono),
+            )
+            return cur.rowcount
+
+    def _loop_renovacao(self):
+        while True:
+            time.sleep(self.tempo_reserva / 3)
+            try:
+                self.renovar_reservas()
+            except sqlite3.Error as e:
+                print(f"[FILA] Erro ao renovar reservas: {e}")
+
+    def enfileirar(self, evento: dict) -> int:
+        agora = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO eventos (payload, enfileirado_em, disponivel_em) VALUES (?, ?, ?)",
+                (json.dumps(evento, ensure_ascii=False), agora, agora),
+            )
+            self._disponivel.notify()
+            return cur.lastrowid
+
+    def reservar(self, timeout: float = 1.0):
+        """Reserva o próximo evento disponível. Retorna None se não houver nenhum no timeout."""
+        limite = time.time() + timeout
+        with self._lock:
+            while True:
+                agora = time.time()
+                # Pendentes ou com reserva vencida de outra instância (que caiu no meio do processamento)
+                elegivel = (
+                    "(status = 'pendente' AND disponivel_em <= ?) "
+                    "OR (status = 'processando' AND reservado_ate < ? AND IFNULL(dono, '') != ?)"
+                )
+                row = self._conn.execute(
+                    f"SELECT id, payload, tentativas, enfileirado_em, status FROM eventos "
+                    f"WHERE {elegivel} ORDER BY id LIMIT 1",
+                    (agora, agora, self.dono),
+                ).fetchone()
+                if row:
+                    # A condição se repete no UPDATE: outro processo pode ter reservado no meio
+                    cur = self._conn.execute(
+                        f"UPDATE eventos SET status = 'processando', dono = ?, reservado_ate = ? "
+                        f"WHERE id = ? AND ({elegivel})",
+                        (self.dono, agora + self.tempo_reserva, row[0], agora, agora, self.dono),
+                    )
+                    if not cur.rowcount:
+                        continue
+                    if row[4] == "processando":
+                        print(f"[FILA] Evento {row[0]} recuperado de uma reserva vencida")
+                    return {
+                        "id": row[0],
+                        "evento": json.loads(row[1]),
+                        "tentativas": row[2],
+                        "enfileirado_em": row[3],
+                    }
+                restante = limite - agora
+                if restante <= 0:
+                    return None
+                # Acorda periodicamente para pegar eventos reagendados com atraso
+                self._disponivel.wait(min(restante, 0.5))
+
+    def confirmar(self, item_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM eventos WHERE id = ?", (item_id,))
+
+    def devolver(self, item_id: int, tentativas: int, atraso: float = 2.0):
+        """Devolve o evento para a fila após uma falha, ou descarta após `max_tentativas`."""
+        with self._lock:
+            if tentativas + 1 >= self.max_tentativas:
+                self._conn.execute("UPDATE eventos SET status = 'falhou' WHERE id = ?", (item_id,))
+                print(f"[FILA] Evento {item_id} descartado após {tentativas + 1} tentativas")
+                return
+            self._conn.execute(
+                "UPDATE eventos SET status = 'pendente', tentativas = ?, disponivel_em = ? WHERE id = ?",
+                (tentativas + 1, time.time() + atraso * (tentativas + 1), item_id),
+            )
+            self._disponivel.notify()
+
+    def descartar(self, item_id: int, motivo):
+        """Tira o evento da fila sem nova tentativa; ele fica como 'falhou' para inspeção."""
+        with self._lock:
+            self._conn.execute("UPDATE eventos SET status = 'falhou' WHERE id = ?", (item_id,))
+        print(f"[FILA] Evento {item_id} descartado sem nova tentativa: {motivo}")
+
+    def tamanho(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM eventos WHERE status = 'pendente'"
+            ).fetchone()[0]
+
+    def iniciar_consumidor(self, despachante, processar, chave, janela: float = 0):
+        """
+        Inicia a thread que retira eventos da fila em ordem de chegada e os entrega ao
+        `despachante`, agrupados por `chave(evento)` (ex.: o chat_id da conversa).
+        Com `janela` > 0, eventos seguidos da mesma chave são juntados e `processar`
+        recebe a lista de eventos de uma vez.
+
+        `processar` pode retornar uma função de envio: ela roda depois que os eventos
+        são confirmados e, se falhar, só ela é tentada de novo (o turno não roda outra vez).
+        Falhas de `processar` voltam para a fila, menos TurnoJaIniciado: o grafo já
+        rodou e os eventos são descartados.
+        """
+        def entregar(chave_evento, itens):
+            despachante.submeter(chave_evento, self._executar, itens, processar)
+
+        agrupador = AgrupadorMensagens(janela, entregar) if janela > 0 else None
+        consumidor = threading.Thread(
+            target=self._loop_consumidor, args=(chave, entregar, agrupador),
+            name="fila-consumidor", daemon=True
+        )
+        consumidor.start()
+        threading.Thread(target=self._loop_renovacao, name="fila-reservas", daemon=True).start()
+        print(f"[FILA] Consumidor iniciado em {self.caminho_db} (janela de agrupamento: {janela}s)")
+
+    def _loop_consumidor(self, chave, entregar, agrupador):
+        while True:
+            item = self.reservar()
+            if item is None:
+                continue
+            if agrupador is not None:
+                agrupador.adicionar(chave(item["evento"]), item)
+            else:
+                entregar(chave(item["evento"]), [item])
+
+    def _executar(self, itens, processar):
+        inicio = time.time()
+        for item in itens:
+            metrica_espera.observe(inicio - item["enfileirado_em"])
+        try:
+            envio = processar([item["evento"] for item in itens])
+        except TurnoJaIniciado as e:
+            print(f"[FILA] Turno dos eventos {[item['id'] for item in itens]} falhou no meio: {e.__cause__ or e}")
+            for item in itens:
+                self.descartar(item["id"], "turno já iniciado")
+            metrica_eventos.inc(len(itens), resultado="falhou")
+            return
+        except Exception as e:
+            print(f"[FILA] Erro ao processar eventos {[item['id'] for item in itens]}: {e}")
+            for item in itens:
+                self.devolver(item["id"], item["tentativas"])
+            metrica_eventos.inc(len(itens), resultado="erro")
+            return
+        finally:
+            metrica_processamento.observe(time.time() - inicio)
+
+        # O turno já foi gravado no checkpoint: repetir o evento duplicaria mensagens e pedidos
+        for item in itens:
+            self.confirmar(item["id"])
+        metrica_eventos.inc(len(itens), resultado="sucesso")
+        if envio is not None:
+            self._enviar(envio)
+
+    def _enviar(self, envio, tentativa: int = 0, atraso: float = 2.0):
+        try:
+            envio()
+            metrica_envios.inc(resultado="sucesso")
+        except Exception as e:
+            if tentativa + 1 >= self.max_tentativas:
+                print(f"[FILA] Envio da resposta descartado após {tentativa + 1} tentativas: {e}")
+                metrica_envios.inc(resultado="falhou")
+                return
+            print(f"[FILA] Erro ao enviar a resposta (tentativa {tentativa + 1}), tentando de novo: {e}")
+            metrica_envios.inc(resultado="erro")
+            agendador.agendar(atraso * (tentativa + 1), self._enviar, envio, tentativa + 1, atraso)
@@ -0,0 +1,182 @@
+import os
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from services.metricas import registro
+from services.temporizacao import anotar_turno, medir, registrar_tokens
+
+MEMORIA_TURNOS = int(os.getenv("MEMORIA_TURNOS", "6"))
+MEMORIA_TURNOS_POR_RESUMO = int(os.getenv("MEMORIA_TURNOS_POR_RESUMO", "4"))
+MEMORIA_MAX_RESUMO = int(os.getenv("MEMORIA_MAX_RESUMO", "1500"))
+
+metrica_historico = registro.histograma(
+    "historico_tokens", "Tamanho aproximado (tokens) do histórico da conversa no início do turno",
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+)
+
+# Tools que encerram um pedido: antes delas, as chamadas de tool já não servem ao LLM
+FERRAMENTAS_FIM_PEDIDO = {"confirmar_pedido", "processar_pagamento_dinheiro", "criar_cobranca_asaas"}
+
+INSTRUCOES_RESUMO = (
+    "Você mantém o resumo da conversa de um cliente com o atendente do Pirão Burger. "
+    "Atualize o resumo com as novas mensagens, em português, em poucas frases: nome e "
+    "preferências do cliente, pedidos feitos (itens, entrega ou retirada, pagamento) e "
+    "qualquer pendência. Responda só com o resumo."
+)
+
+
+def contar_tokens(mensagens) -> int:
+    """Aproximação (~4 caracteres por token) do tamanho das mensagens para o LLM."""
+    caracteres = 0
+    for mensagem in mensagens:
+        caracteres += len(str(mensagem.content))
+        caracteres += len(str(getattr(mensagem, "tool_calls", None) or ""))
+    return caracteres // 4
+
+
+class PoliticaMemoria:
+    """
+    Controla o tamanho do histórico (State.messages) guardado no checkpoint:
+    - mantém literais os últimos `turnos_recentes` turnos (um turno começa em
+      cada mensagem do cliente); os anteriores viram o resumo em `resumo_conversa`.
+      O resumo é feito em lotes de `turnos_por_resumo` turnos, para não custar
+      uma chamada ao LLM a cada turno;
+    - remove as chamadas de tool (e seus resultados) de pedidos já encerrados.
+
+    `turnos_recentes=0` desliga a janela (histórico inteiro, como antes).
+    """
+
+    def __init__(self, turnos_recentes: int = MEMORIA_TURNOS, turnos_por_resumo: int = MEMORIA_TURNOS_POR_RESUMO,
+                 max_caracteres_resumo: int = MEMORIA_MAX_RESUMO, descartar_ferramentas_concluidas: bool = True,
+                 llm_resumo=None):
+        self.turnos_recentes = turnos_recentes
+        self.turnos_por_resumo = max(1, turnos_por_resumo)
+        self.max_caracteres_resumo = max_caracteres_resumo
+        self.descartar_ferramentas_concluidas = descartar_ferramentas_concluidas
+        self.llm_resumo = llm_resumo
+
+    def _planejar(self, mensagens: list):
+        """Retorna (mensagens a resumir e remover, alterações das tools de pedidos encerrados)."""
+        inicios = [i for i, mensagem in enumerate(mensagens) if isinstance(mensagem, HumanMessage)]
+
+        corte = 0
+        if self.turnos_recentes and len(inicios) > self.turnos_recentes + self.turnos_por_resumo - 1:
+            corte = inicios[-self.turnos_recentes]
+
+        alteracoes = []
+        if self.descartar_ferramentas_concluidas:
+            # O turno atual fica intacto: o LLM ainda pode estar no meio das tools dele
+            inicio_atual = inicios[-1] if inicios else len(mensagens)
+            alteracoes = self._descartar_ferramentas(mensagens[corte:inicio_atual])
+        return mensagens[:corte], alteracoes
+
+    def _descartar_ferramentas(self, mensagens: list) -> list:
+        fim = None
+        for indice, mensagem in enumerate(mensagens):
+            if isinstance(mensagem, ToolMessage) and mensagem.name in FERRAMENTAS_FIM_PEDIDO:
+                fim = indice
+        if fim is None:
+            return []
+        # Inclui os outros resultados da mesma chamada (vêm logo em seguida)
+        while fim + 1 < len(mensagens) and isinstance(mensagens[fim + 1], ToolMessage):
+            fim += 1
+
+        alteracoes = []
+        for mensagem in mensagens[:fim + 1]:
+            if not mensagem.id:
+                continue
+            if isinstance(mensagem, ToolMessage):
+                alteracoes.append(RemoveMessage(id=mensagem.id))
+            elif isinstance(mensagem, AIMessage) and mensagem.tool_calls:
+                if mensagem.content:
+                    # Mesmo id: o add_messages substitui pela versão sem tool_calls
+                    alteracoes.append(AIMessage(content=mensagem.content, id=mensagem.id))
+                else:
+                    alteracoes.append(RemoveMessage(id=mensagem.id))
+        return alteracoes
+
+    def _transcrever(self, mensagens: list) -> str:
+        linhas = []
+        for mensagem in mensagens:
+            texto = str(mensagem.content).strip()
+            if isinstance(mensagem, HumanMessage) and texto:
+                linhas.append(f"Cliente: {texto[:500]}")
+            elif isinstance(mensagem, AIMessage) and texto:
+                linhas.append(f"Atendente: {texto[:500]}")
+            elif isinstance(mensagem, ToolMessage) and mensagem.name in FERRAMENTAS_FIM_PEDIDO:
+                linhas.append(f"(pedido encerrado com {mensagem.name}: {texto[:200]})")
+        return "\n".join(linhas)
+
+    def _mensagens_resumo(self, resumo: str, transcricao: str) -> list:
+        return [
+            SystemMessage(content=INSTRUCOES_RESUMO),
+            HumanMessage(content=f"Atualize o resumo.\n\nRESUMO ATUAL:\n{resumo or '(vazio)'}"
+                                 f"\n\nNOVAS MENSAGENS:\n{transcricao}"),
+        ]
+
+    def _resumo_simples(self, resumo: str, transcricao: str) -> str:
+        # Sem LLM (ou se ele falhar): guarda o fim da transcrição, limitado em tamanho
+        combinado = f"{resumo}\n{transcricao}" if resumo else transcricao
+        return combinado[-self.max_caracteres_resumo:]
+
+    def _resultado_resumo(self, resposta, resumo: str, transcricao: str, nome_modelo: str) -> str:
+        registrar_tokens(resposta, nome_modelo)
+        texto = str(resposta.content).strip()
+        if texto and not getattr(resposta, "tool_calls", None):
+            return texto[:self.max_caracteres_resumo]
+        return self._resumo_simples(resumo, transcricao)
+
+    def _atualizacao(self, state: dict, config: dict, antigas: list, alteracoes: list, resumo: str) -> dict:
+        mensagens = state.get("messages", [])
+        removidas = {mensagem.id for mensagem in antigas if mensagem.id}
+        removidas.update(alteracao.id for alteracao in alteracoes if isinstance(alteracao, RemoveMessage))
+        restantes = [mensagem for mensagem in mensagens if mensagem.id not in removidas]
+        tokens = contar_tokens(restantes) + len(resumo or "") // 4
+
+        thread_id = (config or {}).get("configurable", {}).get("thread_id", "")
+        metrica_historico.observe(tokens)
+        anotar_turno(historico_tokens=tokens, historico_mensagens=len(restantes))
+        if antigas or alteracoes:
+            print(f"[MEMORIA] {thread_id}: {len(mensagens)} -> {len(restantes)} mensagens, "
+                  f"~{tokens} tokens, resumo com {len(resumo or '')} caracteres")
+
+        if not antigas and not alteracoes:
+            return {}
+        atualizacao = {"messages": [RemoveMessage(id=mensagem.id) for mensagem in antigas if mensagem.id] + alteracoes}
+        if antigas:
+            atualizacao["resumo_conversa"] = resumo
+        return atualizacao
+
+    def aplicar(self, state: dict, config: dict, llm=None, nome_modelo: str = "resumo") -> dict:
+        """Nó do grafo: retorna a atualização do state (RemoveMessage + novo resumo)."""
+        resumo = state.get("resumo_conversa") or ""
+        antigas, alteracoes = self._planejar(state.get("messages", []))
+        if antigas:
+            transcricao = self._transcrever(antigas)
+            llm = self.llm_resumo or llm
+            novo = self._resumo_simples(resumo, transcricao)
+            if transcricao and llm is not None:
+                try:
+                    with medir("llm", nome_modelo):
+                        resposta = llm.invoke(self._mensagens_resumo(resumo, transcricao))
+                    novo = self._resultado_resumo(resposta, resumo, transcricao, nome_modelo)
+                except Exception as e:
+                    print(f"[MEMORIA] Erro ao resumir, usando resumo simples: {e}")
+            resumo = novo if transcricao else resumo
+        return self._atualizacao(state, config, antigas, alteracoes, resumo)
+
+    async def aaplicar(self, state: dict, config: dict, llm=None, nome_modelo: str = "resumo") -> dict:
+        """Versão assíncrona de `aplicar`, para o grafo rodando com ainvoke."""
+        resumo = state.get("resumo_conversa") or ""
+        antigas, alteracoes = self._planejar(state.get("messages", []))
+        if antigas:
+            transcricao = self._transcrever(antigas)
+            llm = self.llm_resumo or llm
+            novo = self._resumo_simples(resumo, transcricao)
+            if transcricao and llm is not None:
+                try:
+                    with medir("llm", nome_modelo):
+                        resposta = await llm.ainvoke(self._mensagens_resumo(resumo, transcricao))
+                    novo = self._resultado_resumo(resposta, resumo, transcricao, nome_modelo)
+                except Exception as e:
+                    print(f"[MEMORIA] Erro ao resumir, usando resumo simples: {e}")
+            resumo = novo if transcricao else resumo
+        return self._atualizacao(state, config, antigas, alteracoes, resumo)
@@ -0,0 +1,141 @@
+import threading
+import bisect
+
+# Buckets padrão (em segundos) para latências de fila e de processamento
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _formatar_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    partes = [f'{k}="{str(v)}"' for k, v in sorted(labels.items())]
+    return "{" + ",".join(partes) + "}"
+
+
+class Contador:
+    """Contador monotônico, opcionalmente separado por labels."""
+
+    tipo = "counter"
+
+    def __init__(self, nome: str, descricao: str):
+        self.nome = nome
+        self.descricao = descricao
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor: float = 1, **labels):
+        chave = tuple(sorted(labels.items()))
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def amostras(self):
+        with self._lock:
+            return [(self.nome, dict(chave), valor) for chave, valor in self._valores.items()]
+
+
+class Medidor:
+    """Valor instantâneo (gauge). Pode ser calculado sob demanda via `funcao`."""
+
+    tipo = "gauge"
+
+    def __init__(self, nome: str, descricao: str, funcao=None):
+        self.nome = nome
+        self.descricao = descricao
+        self._funcao = funcao
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def set(self, valor: float, **labels):
+        chave = tuple(sorted(labels.items()))
+        with self._lock:
+            self._valores[chave] = valor
+
+    def amostras(self):
+        if self._funcao is not None:
+            try:
+                return [(self.nome, {}, float(self._funcao()))]
+            except Exception as e:
+                print(f"[METRICAS] Erro ao calcular {self.nome}: {e}")
+                return []
+        with self._lock:
+            return [(self.nome, dict(chave), valor) for chave, valor in self._valores.items()]
+
+
+class Histograma:
+    """Histograma cumulativo no formato do Prometheus."""
+
+    tipo = "histogram"
+
+    def __init__(self, nome: str, descricao: str, buckets=BUCKETS_PADRAO):
+        self.nome = nome
+        self.descricao = descricao
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, valor: float, **labels):
+        chave = tuple(sorted(labels.items()))
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = {"contagens": [0] * len(self.buckets), "soma": 0.0, "total": 0}
+                self._series[chave] = serie
+            idx = bisect.bisect_left(self.buckets, valor)
+            if idx < len(self.buckets):
+                serie["contagens"][idx] += 1
+            serie["soma"] += valor
+            serie["total"] += 1
+
+    def amostras(self):
+        resultado = []
+        with self._lock:
+            for chave, serie in self._series.items():
+                labels = dict(chave)
+                acumulado = 0
+                for limite, contagem in zip(self.buckets, serie["contagens"]):
+                    acumulado += contagem
+                    resultado.append((f"{self.nome}_bucket", {**labels, "le": limite}, acumulado))
+                resultado.append((f"{self.nome}_bucket", {**labels, "le": "+Inf"}, serie["total"]))
+                resultado.append((f"{self.nome}_sum", labels, serie["soma"]))
+                resultado.append((f"{self.nome}_count", labels, serie["total"]))
+        return resultado
+
+
+class RegistroMetricas:
+    """Guarda as métricas do processo e gera o texto exposto em /metrics."""
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            existente = self._metricas.get(metrica.nome)
+            if existente is not None:
+                return existente
+            self._metricas[metrica.nome] = metrica
+            return metrica
+
+    def contador(self, nome: str, descricao: str) -> Contador:
+        return self._registrar(Contador(nome, descricao))
+
+    def medidor(self, nome: str, descricao: str, funcao=None) -> Medidor:
+        return self._registrar(Medidor(nome, descricao, funcao))
+
+    def histograma(self, nome: str, descricao: str, buckets=BUCKETS_PADRAO) -> Histograma:
+        return self._registrar(Histograma(nome, descricao, buckets))
+
+    def renderizar(self) -> str:
+        linhas = []
+        with self._lock:
+            metricas = list(self._metricas.values())
+        for metrica in metricas:
+            linhas.append(f"# HELP {metrica.nome} {metrica.descricao}")
+            linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            for nome, labels, valor in metrica.amostras():
+                linhas.append(f"{nome}{_formatar_labels(labels)} {valor}")
+        return "\n".join(linhas) + "\n"
+
+
+# Registro global do processo
+registro = RegistroMetricas()
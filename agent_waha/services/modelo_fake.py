@@ -0,0 +1,112 @@
+import re
+import time
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+class Regra:
+    """
+    Uma regra do modelo roteirizado: se `padrao` casa com a última mensagem do
+    cliente, o modelo chama `ferramenta` com `argumentos(match)` ou responde `resposta`.
+    """
+
+    def __init__(self, padrao: str, ferramenta: str = None, argumentos=None, resposta: str = None):
+        self.padrao = re.compile(padrao, re.IGNORECASE)
+        self.ferramenta = ferramenta
+        self.argumentos = argumentos or (lambda match: {})
+        self.resposta = resposta
+
+
+# Roteiro do PirãoBot usado no benchmark. Entrega, cobrança e material de apoio
+# chamam Maps/Asaas/busca vetorial: rodar com SERVICOS_EXTERNOS=fake (servicos_fake.py)
+REGRAS_RESTAURANTE = [
+    # Pedido de resumo da PoliticaMemoria (memoria_conversa.py)
+    Regra(r"^Atualize o resumo", resposta="Cliente conversando com o Pirão Burger; pedidos anteriores já encerrados."),
+    Regra(r"(hor[áa]rio|entregam|pagamento|gl[úu]ten|preparo).*\?", "consultar_material_de_apoio",
+          lambda m: {"pergunta": m.string.strip()}),
+    Regra(r"meu nome [ée]\s+(.+)", "criar_usuario", lambda m: {"nome_cliente": m.group(1).strip()}),
+    Regra(r"\bquero\s+(.+)", "processar_pedido_full", lambda m: {"text": m.group(1).strip()}),
+    Regra(r"^(s[óo] isso|n[ãa]o|pode fechar)", "confirmar_pedido"),
+    Regra(r"\bretirada\b", "processar_retirada"),
+    Regra(r"\b(rua|avenida|av\.)\s+.+", "calcular_entrega", lambda m: {"endereco_cliente": m.group(0).strip()}),
+    Regra(r"\bpix\b", "criar_cobranca_asaas", lambda m: {"tipo": "PIX"}),
+    Regra(r"\bcart[ãa]o\b", "criar_cobranca_asaas", lambda m: {"tipo": "CREDIT_CARD"}),
+    Regra(r"dinheiro.*?(\d+)", "processar_pagamento_dinheiro", lambda m: {"valor_cliente": float(m.group(1))}),
+    Regra(r"\b(oi|ol[áa]|boa (noite|tarde)|bom dia)\b",
+          resposta="Olá! 😊 Bem-vindo ao Pirão Burger! Qual é o seu nome?"),
+]
+
+
+def _contar_tokens(texto: str) -> int:
+    # Aproximação (~4 caracteres por token), suficiente para comparar turnos entre si
+    return max(1, len(texto) // 4)
+
+
+class ModeloRoteirizado(BaseChatModel):
+    """
+    Chat model determinístico para rodar o grafo sem a OpenAI.
+    Depois de uma ToolMessage responde com o começo do resultado da tool;
+    depois de uma mensagem do cliente aplica a primeira `Regra` que casar.
+    Mensagens de sistema no fim (bloco de contexto do turno) são ignoradas.
+    `latencia` simula o tempo de resposta do LLM (s).
+    """
+
+    regras: List[Any] = REGRAS_RESTAURANTE
+    resposta_padrao: str = "Certo! Posso ajudar com mais alguma coisa? 🍔"
+    latencia: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "modelo-roteirizado"
+
+    def bind_tools(self, tools, **kwargs):
+        # As tools ficam a cargo das regras; o grafo só precisa do mesmo objeto de volta
+        return self
+
+    def _responder(self, messages: List[BaseMessage]) -> AIMessage:
+        conversa = [mensagem for mensagem in messages if not isinstance(mensagem, SystemMessage)]
+        ultima = conversa[-1] if conversa else None
+
+        if isinstance(ultima, ToolMessage):
+            resultado = str(ultima.content).strip()
+            return AIMessage(content=f"Prontinho! ✅ {resultado[:200]}")
+
+        texto = ""
+        for mensagem in reversed(messages):
+            if isinstance(mensagem, HumanMessage):
+                texto = str(mensagem.content)
+                break
+
+        for regra in self.regras:
+            match = regra.padrao.search(texto)
+            if not match:
+                continue
+            if regra.ferramenta:
+                tool_call = {
+                    "name": regra.ferramenta,
+                    "args": regra.argumentos(match),
+                    # id determinístico e único dentro do histórico da conversa
+                    "id": f"call_{len(conversa)}_{regra.ferramenta}",
+                    "type": "tool_call",
+                }
+                return AIMessage(content="", tool_calls=[tool_call])
+            return AIMessage(content=regra.resposta)
+
+        return AIMessage(content=self.resposta_padrao)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latencia:
+            time.sleep(self.latencia)
+
+        resposta = self._responder(messages)
+        entrada = sum(_contar_tokens(str(m.content)) for m in messages)
+        saida = _contar_tokens(str(resposta.content) + str(resposta.tool_calls))
+        resposta.usage_metadata = {
+            "input_tokens": entrada,
+            "output_tokens": saida,
+            "total_tokens": entrada + saida,
+        }
+        return ChatResult(generations=[ChatGeneration(message=resposta)])
@@ -0,0 +1,60 @@
+import os
+import threading
+import urllib.parse
+from pymongo import MongoClient, monitoring
+from services.temporizacao import registrar_etapa
+
+_client = None
+_lock = threading.Lock()
+
+
+class MonitorComandos(monitoring.CommandListener):
+    """Mede cada comando enviado ao Mongo (find, update, insert...) como etapa "mongo" do turno."""
+
+    IGNORAR = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue", "buildInfo"}
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name not in self.IGNORAR:
+            registrar_etapa("mongo", event.command_name, event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        if event.command_name not in self.IGNORAR:
+            registrar_etapa("mongo", event.command_name, event.duration_micros / 1_000_000)
+
+
+def montar_uri() -> str:
+    # MONGO_URI permite apontar para um Mongo local (benchmarks, desenvolvimento)
+    uri = os.getenv("MONGO_URI")
+    if uri:
+        return uri
+    mongo_user = urllib.parse.quote_plus(os.getenv('MONGO_USER'))
+    mongo_pass = urllib.parse.quote_plus(os.getenv('MONGO_PASS'))
+    return "mongodb+srv://%s:%s@cluster0.gjkin5a.mongodb.net/?retryWrites=true&w=majority&appName=Cluster0" % (mongo_user, mongo_pass)
+
+
+def get_client() -> MongoClient:
+    """Cliente Mongo compartilhado do processo, criado no primeiro uso."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                uri = montar_uri()
+                if uri.startswith("mongomock://"):
+                    # Banco em memória para rodar o bot offline (benchmark.py --memoria)
+                    try:
+                        import mongomock
+                    except ImportError:
+                        raise RuntimeError(
+                            "MONGO_URI=mongomock:// requer o pacote mongomock: pip install -r requirements-dev.txt"
+                        ) from None
+                    _client = mongomock.MongoClient()
+                else:
+                    _client = MongoClient(uri, event_listeners=[MonitorComandos()])
+    return _client
+
+
+def get_db():
+    return get_client()[os.getenv("MONGO_DB", "restaurante_db")]
@@ -0,0 +1,68 @@
+import importlib
+import threading
+import time
+from services.metricas import registro
+
+metrica_construcao = registro.histograma(
+    "agente_construcao_segundos", "Tempo para importar, construir e compilar cada agente"
+)
+
+
+class RegistroAgentes:
+    """
+    Registro preguiçoso dos agentes do app.
+    Cada agente é declarado só pelo módulo e pela classe; o import do módulo
+    (que abre conexões, cria clientes etc.) e a compilação do grafo acontecem
+    no primeiro uso da rota ou no aquecimento em segundo plano.
+    """
+
+    def __init__(self):
+        self._definicoes = {}  # nome -> (modulo, classe, kwargs)
+        self._modelos = {}  # nome -> grafo compilado
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nome: str, modulo: str, classe: str, **kwargs):
+        """kwargs são repassados ao construtor da classe (ex.: llm, checkpointer)."""
+        with self._lock:
+            self._definicoes[nome] = (modulo, classe, kwargs)
+            self._modelos.pop(nome, None)
+            self._locks[nome] = threading.Lock()
+
+    def obter(self, nome: str):
+        """Retorna o grafo compilado do agente, construindo na primeira chamada."""
+        modelo = self._modelos.get(nome)
+        if modelo is not None:
+            return modelo
+        if nome not in self._definicoes:
+            raise KeyError(f"Agente não registrado: {nome}")
+
+        # Lock por agente: quem chegar durante a construção espera pelo mesmo resultado
+        with self._locks[nome]:
+            modelo = self._modelos.get(nome)
+            if modelo is None:
+                modulo, classe, kwargs = self._definicoes[nome]
+                inicio = time.time()
+                agente = getattr(importlib.import_module(modulo), classe)(**kwargs)
+                modelo = agente.memory_agent()
+                self._modelos[nome] = modelo
+                duracao = time.time() - inicio
+                metrica_construcao.observe(duracao, agente=nome)
+                print(f"[REGISTRO] Agente {nome} ({classe}) pronto em {duracao:.2f}s")
+            return modelo
+
+    def carregado(self, nome: str) -> bool:
+        return nome in self._modelos
+
+    def aquecer(self, nomes=None):
+        """Constrói os agentes em uma thread de fundo, sem atrasar a subida do app."""
+        nomes = list(nomes) if nomes is not None else list(self._definicoes)
+
+        def _aquecer():
+            for nome in nomes:
+                try:
+                    self.obter(nome)
+                except Exception as e:
+                    print(f"[REGISTRO] Erro ao aquecer agente {nome}: {e}")
+
+        threading.Thread(target=_aquecer, name="aquecimento-agentes", daemon=True).start()
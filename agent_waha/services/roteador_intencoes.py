@@ -0,0 +1,218 @@
+import ast
+import json
+import os
+import re
+import unicodedata
+import uuid
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from services.metricas import registro
+
+ROTEADOR_RAPIDO = os.getenv("ROTEADOR_RAPIDO", "1") == "1"
+
+# Tool calls criadas pelo roteador (e não pelo LLM) começam com este prefixo
+PREFIXO_ID = "rapido_"
+
+metrica_roteador = registro.contador(
+    "roteador_intencoes_total", "Turnos decididos pelo roteador rápido (ou repassados ao LLM) por intenção"
+)
+
+# Pergunta da última mensagem do bot -> etapa do atendimento
+PERGUNTAS = [
+    ("mais_itens", re.compile(r"mais alguma coisa|adicionar mais|mais algum item|algo mais")),
+    ("entrega", re.compile(r"retirada ou entrega|entrega ou retirada")),
+    ("troco", re.compile(r"quanto (voce )?(vai|ira) (pagar|entregar)|troco para quanto|calcular o troco")),
+    ("pagamento", re.compile(r"como deseja pagar|forma de pagamento|cartao.*pix.*dinheiro")),
+]
+
+# Status do pedido gravado -> etapa, quando a pergunta do bot não diz nada
+ETAPA_POR_STATUS = {
+    "Confirmado - Preparando": "entrega",
+    "Aguardando forma de pagamento": "pagamento",
+}
+
+# Respostas curtas do cliente, já normalizadas (minúsculas, sem acento e pontuação)
+RESPOSTAS = {
+    "mais_itens": [
+        ("fechar_pedido", re.compile(r"^(nao|n|so isso|e so isso|e so|so|nada|nada mais|pode fechar|fechar|fecha)"
+                                     r"( obrigad[oa]| valeu)?$")),
+    ],
+    "entrega": [
+        ("retirada", re.compile(r"^(retirada|retirar|retiro|vou retirar|balcao|no balcao|buscar|vou buscar)$")),
+        ("entrega", re.compile(r"^(entrega|entregar|delivery|pra entregar|para entrega|quero entrega)$")),
+    ],
+    "pagamento": [
+        ("cartao", re.compile(r"^(1|cartao|credito|debito|cartao de credito|cartao de debito)$")),
+        ("pix", re.compile(r"^(2|pix)$")),
+        ("dinheiro", re.compile(r"^(3|dinheiro|em dinheiro|especie)$")),
+    ],
+    "troco": [
+        ("valor_dinheiro", re.compile(r"^(r )?(\d{1,4}([.,]\d{1,2})?)( reais)?$")),
+    ],
+}
+
+RESPOSTA_ENTREGA = (
+    "Beleza! 🚚 Me informe seu *endereço completo* (rua, número e bairro) "
+    "para eu calcular a taxa e o tempo de entrega 📍"
+)
+RESPOSTA_DINHEIRO = (
+    "Certo, pagamento em *dinheiro*! 💵\n"
+    "Quanto você vai pagar? Assim já calculo o troco 😉"
+)
+PERGUNTA_ENTREGA = "\n\nÉ para *RETIRADA* ou *ENTREGA*? 🚗"
+
+
+def _normalizar(texto: str) -> str:
+    texto = "".join(
+        c for c in unicodedata.normalize("NFD", str(texto).lower())
+        if unicodedata.category(c) != "Mn"
+    )
+    texto = re.sub(r"[^\w\s.,]", " ", texto)
+    texto = re.sub(r"(?<!\d)[.,]|[.,](?!\d)", " ", texto)
+    return re.sub(r"\s+", " ", texto).strip()
+
+
+class RoteadorIntencoes:
+    """
+    Caminho rápido antes do LLM para as respostas óbvias às perguntas do próprio
+    bot ("retirada", "pix", "2", "não" depois de "deseja mais alguma coisa?").
+    A etapa vem da última pergunta do bot (ou do status do pedido); a intenção,
+    de regras sobre a resposta curta do cliente. Na dúvida retorna None e o turno
+    segue para o LLM.
+
+    Todas as intenções mexem no pedido do cliente, então o caminho rápido só vale
+    com um pedido aberto gravado para o telefone do chat: `buscar_pedido(telefone)`
+    retorna {"id_pedido", "status"} ou None, e as tools recebem esse id_pedido.
+    """
+
+    def __init__(self, max_caracteres: int = 40, buscar_pedido=None):
+        self.max_caracteres = max_caracteres
+        self.buscar_pedido = buscar_pedido
+
+    def _etapa(self, mensagens: list, status_pedido: str):
+        for mensagem in reversed(mensagens[:-1]):
+            if isinstance(mensagem, HumanMessage):
+                break
+            if isinstance(mensagem, AIMessage) and isinstance(mensagem.content, str) and mensagem.content.strip():
+                pergunta = _normalizar(mensagem.content)
+                for etapa, padrao in PERGUNTAS:
+                    if padrao.search(pergunta):
+                        return etapa
+                break
+        return ETAPA_POR_STATUS.get(status_pedido)
+
+    def decidir(self, state: dict):
+        """Retorna {"intencao", "ferramenta", "argumentos", "resposta"} ou None (vai para o LLM)."""
+        mensagens = state.get("messages", [])
+        if not mensagens or not isinstance(mensagens[-1], HumanMessage):
+            return None
+        texto = mensagens[-1].content
+        if not isinstance(texto, str) or len(texto) > self.max_caracteres:
+            return None
+
+        telefone = (state.get("user_info") or {}).get("telefone")
+        try:
+            pedido = self.buscar_pedido(telefone) if self.buscar_pedido and telefone else None
+        except Exception as e:
+            print(f"[ROTEADOR] Erro ao buscar o pedido aberto de {telefone}: {e}")
+            return None
+        if not pedido or not pedido.get("id_pedido"):
+            return None
+
+        etapa = self._etapa(mensagens, pedido.get("status"))
+        if etapa is None:
+            return None
+
+        resposta = _normalizar(texto)
+        for intencao, padrao in RESPOSTAS.get(etapa, []):
+            match = padrao.match(resposta)
+            if match:
+                decisao = self._decisao(intencao, match)
+                if decisao["ferramenta"]:
+                    decisao["argumentos"]["id_pedido"] = pedido["id_pedido"]
+                metrica_roteador.inc(intencao=intencao)
+                print(f"[ROTEADOR] etapa={etapa} intencao={intencao} -> "
+                      f"{decisao['ferramenta'] or 'resposta pronta'}")
+                return decisao
+
+        metrica_roteador.inc(intencao="llm")
+        return None
+
+    def _decisao(self, intencao: str, match) -> dict:
+        decisao = {"intencao": intencao, "ferramenta": None, "argumentos": {}, "resposta": None}
+        if intencao == "fechar_pedido":
+            decisao["ferramenta"] = "confirmar_pedido"
+        elif intencao == "retirada":
+            decisao["ferramenta"] = "processar_retirada"
+        elif intencao == "entrega":
+            decisao["resposta"] = RESPOSTA_ENTREGA
+        elif intencao == "cartao":
+            decisao.update(ferramenta="criar_cobranca_asaas", argumentos={"tipo": "CREDIT_CARD"})
+        elif intencao == "pix":
+            decisao.update(ferramenta="criar_cobranca_asaas", argumentos={"tipo": "PIX"})
+        elif intencao == "dinheiro":
+            decisao["resposta"] = RESPOSTA_DINHEIRO
+        elif intencao == "valor_dinheiro":
+            valor = float(match.group(2).replace(",", "."))
+            decisao.update(ferramenta="processar_pagamento_dinheiro", argumentos={"valor_cliente": valor})
+        return decisao
+
+    def mensagem(self, decisao: dict) -> AIMessage:
+        """AIMessage equivalente à que o LLM daria: chamada de tool ou resposta pronta."""
+        if decisao["ferramenta"]:
+            tool_call = {
+                "name": decisao["ferramenta"],
+                "args": dict(decisao["argumentos"]),
+                "id": f"{PREFIXO_ID}{uuid.uuid4().hex[:12]}",
+                "type": "tool_call",
+            }
+            return AIMessage(content="", tool_calls=[tool_call])
+        return AIMessage(content=decisao["resposta"])
+
+    def _resultados(self, mensagens: list):
+        """Chamada de tool do roteador no fim do histórico e os resultados dela (ou None)."""
+        resultados = []
+        for mensagem in reversed(mensagens):
+            if isinstance(mensagem, ToolMessage):
+                resultados.append(mensagem)
+                continue
+            if isinstance(mensagem, AIMessage) and mensagem.tool_calls:
+                if all(call["id"].startswith(PREFIXO_ID) for call in mensagem.tool_calls):
+                    return list(reversed(resultados))
+            return None
+        return None
+
+    def _texto_resultado(self, conteudo: str):
+        """Texto para o cliente a partir do resultado da tool, ou None se ela falhou."""
+        texto = str(conteudo).strip()
+        if texto.startswith("{"):
+            # Tools que retornam {"success", "message"} viram JSON compacto na ToolMessage
+            # (projetar_resultado); conversas antigas ainda têm str(dict)
+            try:
+                dados = json.loads(texto)
+            except ValueError:
+                try:
+                    dados = ast.literal_eval(texto)
+                except (ValueError, SyntaxError):
+                    return None
+            if not dados.get("success"):
+                return None
+            texto = str(dados.get("message", "")).strip()
+        if not texto or texto.startswith("❌ Erro") or texto.startswith("Erro"):
+            return None
+        return texto
+
+    def resposta_pronta(self, mensagens: list):
+        """Resposta montada a partir do resultado das tools do roteador, ou None (vai para o LLM)."""
+        resultados = self._resultados(mensagens)
+        if not resultados:
+            return None
+        textos = []
+        for resultado in resultados:
+            texto = self._texto_resultado(resultado.content)
+            if texto is None:
+                print(f"[ROTEADOR] {resultado.name} falhou; o LLM assume o turno")
+                return None
+            if resultado.name == "confirmar_pedido":
+                texto += PERGUNTA_ENTREGA
+            textos.append(texto)
+        return "\n\n".join(textos)
@@ -0,0 +1,110 @@
+import hashlib
+import math
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from services.temporizacao import medir
+
+# Trechos do material de apoio usados pela busca vetorial falsa
+MATERIAL_FAKE = [
+    "Horário de funcionamento: de terça a domingo, das 18h às 23h30. Segunda-feira fechado.",
+    "Entregamos em Ribeirão Preto num raio de até 8 km do restaurante (Av. Paris, 707). "
+    "A taxa vai de R$ 3,00 a R$ 15,00 conforme a distância.",
+    "Formas de pagamento: PIX, cartão de crédito ou débito (link de pagamento) e dinheiro, com troco.",
+    "Os hambúrgueres são feitos com blend de 160 g de carne bovina, pão brioche e molho da casa. "
+    "Temos opção de pão sem glúten sob consulta.",
+    "O tempo médio de preparo é de 25 a 40 minutos; na retirada o pedido fica pronto no balcão.",
+]
+
+
+def _palavras(texto: str) -> set:
+    return set(re.findall(r"\w{3,}", str(texto).lower()))
+
+
+def _numero(texto: str, minimo: float, maximo: float) -> float:
+    """Número determinístico em [minimo, maximo] a partir do texto."""
+    fracao = int(hashlib.md5(str(texto).encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return minimo + fracao * (maximo - minimo)
+
+
+class ServicosExternosFake:
+    """
+    Substitui as chamadas externas das tools do restaurante (Google Maps,
+    Asaas e a busca vetorial do material de apoio) por respostas
+    determinísticas, sem rede. `latencia` (s) simula o tempo de cada chamada;
+    `chamadas` conta quantas vezes cada serviço foi usado.
+    """
+
+    def __init__(self, latencia: float = 0.0, material=None):
+        self.latencia = latencia
+        self.material = list(material or MATERIAL_FAKE)
+        self.chamadas = Counter()
+        self._lock = threading.Lock()
+
+    def _chamar(self, nome: str):
+        with self._lock:
+            self.chamadas[nome] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def distancia(self, origem: str, destino: str) -> dict:
+        """Resposta no formato da Distance Matrix API (distância de 1 a 12 km, pelo destino)."""
+        with medir("http", "maps.distancematrix"):
+            self._chamar("maps")
+            metros = int(_numero(destino, 1000, 12000))
+            minutos = max(5, metros // 400)
+        return {
+            "status": "OK",
+            "origin_addresses": [origem],
+            "destination_addresses": [destino],
+            "rows": [{"elements": [{
+                "status": "OK",
+                "distance": {"value": metros, "text": f"{metros / 1000:.1f} km"},
+                "duration": {"value": minutos * 60, "text": f"{minutos} minutos"},
+            }]}],
+        }
+
+    def criar_cobranca(self, payload: dict):
+        """Mesmo retorno de ServicosExternos.criar_cobranca: (status HTTP, corpo)."""
+        with medir("http", "asaas.payments"):
+            self._chamar("asaas")
+            cobranca_id = f"pay_fake_{uuid.uuid4().hex[:12]}"
+        return 200, {
+            "id": cobranca_id,
+            "status": "PENDING",
+            "billingType": payload.get("billingType"),
+            "value": payload.get("value"),
+            "invoiceUrl": f"https://sandbox.asaas.com/i/{cobranca_id}",
+            "pixQrCode": f"00020126580014br.gov.bcb.pix0136{cobranca_id}" if payload.get("billingType") == "PIX" else None,
+        }
+
+    def buscar_material(self, pergunta: str, k: int = 4) -> list:
+        """Trechos do material com mais palavras em comum com a pergunta."""
+        with medir("http", "busca_vetorial"):
+            self._chamar("busca_vetorial")
+            palavras = _palavras(pergunta)
+            pontuados = [(len(palavras & _palavras(trecho)), trecho) for trecho in self.material]
+        return [trecho for pontos, trecho in sorted(pontuados, key=lambda item: -item[0])[:k] if pontos]
+
+
+class EmbeddingsFake:
+    """
+    Embeddings determinísticos (hash das palavras em `dimensoes` posições) com a
+    mesma interface do OpenAIEmbeddings, para o cache semântico rodar sem a OpenAI.
+    Perguntas com as mesmas palavras dão o mesmo vetor.
+    """
+
+    def __init__(self, dimensoes: int = 64):
+        self.dimensoes = dimensoes
+
+    def embed_query(self, texto: str) -> list:
+        vetor = [0.0] * self.dimensoes
+        for palavra in _palavras(texto):
+            vetor[int(hashlib.md5(palavra.encode("utf-8")).hexdigest(), 16) % self.dimensoes] += 1.0
+        norma = math.sqrt(sum(valor * valor for valor in vetor)) or 1.0
+        return [valor / norma for valor in vetor]
+
+    def embed_documents(self, textos: list) -> list:
+        return [self.embed_query(texto) for texto in textos]
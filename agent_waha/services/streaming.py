@@ -0,0 +1,52 @@
+import re
+
+# Fim de frase: pontuação (ou emoji/asterisco logo depois) seguida de espaço ou quebra de linha
+_FIM_DE_FRASE = re.compile(r'[.!?…][*_~)\]"\'»]*\s')
+
+
+class DivisorMensagens:
+    """
+    Acumula o texto que chega do LLM em pedaços e devolve trechos prontos para
+    virar mensagens no WhatsApp: cada parágrafo completo sai assim que termina;
+    se um parágrafo passa de `max_caracteres`, ele é quebrado na última frase
+    completa para o cliente não ficar esperando.
+    """
+
+    def __init__(self, max_caracteres: int = 300):
+        self.max_caracteres = max_caracteres
+        self._buffer = ""
+
+    def adicionar(self, texto: str) -> list:
+        if not texto:
+            return []
+        self._buffer += texto
+        prontos = []
+
+        while True:
+            # Parágrafo completo
+            idx = self._buffer.find("\n\n")
+            if idx != -1:
+                trecho, self._buffer = self._buffer[:idx], self._buffer[idx + 2:]
+                if trecho.strip():
+                    prontos.append(trecho.strip())
+                continue
+
+            # Parágrafo longo demais: corta na última frase completa
+            if len(self._buffer) > self.max_caracteres:
+                fins = list(_FIM_DE_FRASE.finditer(self._buffer))
+                if fins:
+                    corte = fins[-1].end()
+                    trecho, self._buffer = self._buffer[:corte], self._buffer[corte:]
+                    if trecho.strip():
+                        prontos.append(trecho.strip())
+            break
+
+        return prontos
+
+    def finalizar(self):
+        """Devolve o que sobrou no buffer (ou None) e limpa o divisor."""
+        resto, self._buffer = self._buffer.strip(), ""
+        return resto or None
+
+    def descartar(self):
+        self._buffer = ""
@@ -0,0 +1,141 @@
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from services.metricas import registro
+
+metrica_etapa = registro.histograma(
+    "etapa_segundos", "Duração de cada etapa do turno por tipo (no, tool, llm, http, mongo) e nome"
+)
+metrica_turno = registro.histograma("turno_segundos", "Duração total do turno do agente")
+metrica_tokens = registro.contador("llm_tokens_total", "Tokens das chamadas ao LLM (entrada/cache/saida)")
+
+# Turno em andamento na thread/task atual; o LangGraph copia o contexto para os nós
+_turno_atual = contextvars.ContextVar("turno_atual", default=None)
+
+
+class Turno:
+    """Tempos acumulados de um turno do agente, para a linha de log [TURNO]."""
+
+    def __init__(self, **campos):
+        self.campos = campos
+        self.inicio = time.perf_counter()
+        self.etapas = {}  # "tipo:nome" -> [quantidade, segundos]
+        self.tokens = {"entrada": 0, "cache": 0, "saida": 0}
+        self._lock = threading.Lock()
+
+    def adicionar(self, tipo: str, nome: str, duracao: float):
+        chave = f"{tipo}:{nome}"
+        with self._lock:
+            etapa = self.etapas.setdefault(chave, [0, 0.0])
+            etapa[0] += 1
+            etapa[1] += duracao
+
+    def adicionar_tokens(self, entrada: int, saida: int, cache: int = 0):
+        with self._lock:
+            self.tokens["entrada"] += entrada
+            self.tokens["cache"] += cache
+            self.tokens["saida"] += saida
+
+    def resumo(self) -> dict:
+        with self._lock:
+            etapas = {chave: {"n": n, "s": round(segundos, 4)} for chave, (n, segundos) in self.etapas.items()}
+            tokens = dict(self.tokens)
+        return {
+            **self.campos,
+            "total_s": round(time.perf_counter() - self.inicio, 4),
+            "etapas": etapas,
+            "tokens": tokens,
+        }
+
+
+def registrar_etapa(tipo: str, nome: str, duracao: float):
+    """Registra uma duração já medida (ex.: vinda do monitor de comandos do Mongo)."""
+    metrica_etapa.observe(duracao, tipo=tipo, nome=nome)
+    turno = _turno_atual.get()
+    if turno is not None:
+        turno.adicionar(tipo, nome, duracao)
+
+
+@contextmanager
+def medir(tipo: str, nome: str):
+    """Mede o bloco e registra no histograma e no turno atual (se houver)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_etapa(tipo, nome, time.perf_counter() - inicio)
+
+
+def registrar_tokens(mensagem, modelo: str):
+    """
+    Soma e registra em log os tokens de uma resposta do LLM (usage_metadata), quando
+    o modelo informa. `cache` é a parte da entrada que veio do cache de prefixo do provedor.
+    """
+    uso = getattr(mensagem, "usage_metadata", None)
+    if not uso:
+        print(f"[LLM] {modelo}: resposta sem usage_metadata")
+        return
+    entrada = uso.get("input_tokens", 0)
+    saida = uso.get("output_tokens", 0)
+    cache = (uso.get("input_token_details") or {}).get("cache_read") or 0
+    metrica_tokens.inc(entrada, tipo="entrada", modelo=modelo)
+    metrica_tokens.inc(cache, tipo="cache", modelo=modelo)
+    metrica_tokens.inc(saida, tipo="saida", modelo=modelo)
+    print(f"[LLM] {modelo}: prompt={entrada} cache={cache} ({cache / entrada:.0%}) saida={saida}"
+          if entrada else f"[LLM] {modelo}: prompt=0 cache=0 saida={saida}")
+    turno = _turno_atual.get()
+    if turno is not None:
+        turno.adicionar_tokens(entrada, saida, cache)
+
+
+def anotar_turno(**campos):
+    """Acrescenta campos à linha [TURNO] do turno atual (se houver)."""
+    turno = _turno_atual.get()
+    if turno is not None:
+        turno.campos.update(campos)
+
+
+def no_cronometrado(nome: str, funcao):
+    """
+    Envolve a função de um nó do grafo para medir cada execução.
+    Mantém a assinatura original (o LangGraph olha se ela recebe `config`).
+    """
+    if inspect.iscoroutinefunction(funcao):
+        @functools.wraps(funcao)
+        async def _no_async(*args, **kwargs):
+            with medir("no", nome):
+                return await funcao(*args, **kwargs)
+        return _no_async
+
+    @functools.wraps(funcao)
+    def _no(*args, **kwargs):
+        with medir("no", nome):
+            return funcao(*args, **kwargs)
+    return _no
+
+
+@contextmanager
+def iniciar_turno(**campos):
+    """
+    Abre o turno do agente: tudo que for medido dentro do bloco entra no resumo,
+    impresso ao final como uma linha JSON `[TURNO] {...}`.
+    """
+    turno = Turno(**campos)
+    token = _turno_atual.set(turno)
+    erro = None
+    try:
+        yield turno
+    except Exception as e:
+        erro = e
+        raise
+    finally:
+        _turno_atual.reset(token)
+        resumo = turno.resumo()
+        if erro is not None:
+            resumo["erro"] = str(erro)
+        metrica_turno.observe(resumo["total_s"], agente=campos.get("agente", ""))
+        print(f"[TURNO] {json.dumps(resumo, ensure_ascii=False, default=str)}")
@@ -0,0 +1,198 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Só usa a biblioteca padrão e o requests: também é importado pelo Django
+# (menu/services.py) como agent_waha.services.transporte_http
+
+# Respostas que indicam sobrecarga/indisponibilidade momentânea do servidor
+STATUS_RETENTAVEIS = {429, 502, 503, 504}
+
+
+class CircuitoAberto(requests.RequestException):
+    """O disjuntor está aberto: a chamada falha na hora, sem ir à rede."""
+
+
+def falhou_antes_do_envio(erro: Exception) -> bool:
+    """
+    True se a requisição com certeza não chegou ao servidor (disjuntor aberto,
+    conexão recusada, DNS, timeout de conexão): dá para repetir até um POST.
+    Timeout de leitura ou conexão caída no meio deixam o resultado desconhecido.
+    """
+    if isinstance(erro, (CircuitoAberto, requests.ConnectTimeout)):
+        return True
+    if isinstance(erro, requests.ConnectionError) and erro.args:
+        return isinstance(getattr(erro.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+class Disjuntor:
+    """
+    Circuit breaker simples. Depois de `limite_falhas` chamadas seguidas com falha
+    abre por `tempo_aberto` segundos; passado esse tempo deixa uma chamada de teste
+    passar (meio aberto) e fecha de novo se ela der certo.
+    """
+
+    def __init__(self, limite_falhas: int = 5, tempo_aberto: float = 30.0):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self._falhas = 0
+        self._aberto_ate = 0.0
+        self._testando = False
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            if self._falhas < self.limite_falhas:
+                return "fechado"
+            return "aberto" if time.monotonic() < self._aberto_ate else "meio_aberto"
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self._falhas < self.limite_falhas:
+                return True
+            if time.monotonic() < self._aberto_ate or self._testando:
+                return False
+            # Meio aberto: só uma chamada de teste por vez
+            self._testando = True
+            return True
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._testando = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self._falhas += 1
+            self._testando = False
+            if self._falhas >= self.limite_falhas:
+                self._aberto_ate = time.monotonic() + self.tempo_aberto
+
+    def liberar_teste(self):
+        """A chamada terminou sem sucesso nem falha registrados (erro inesperado): libera o próximo teste."""
+        with self._lock:
+            self._testando = False
+
+
+class TransporteHTTP:
+    """
+    Cliente HTTP compartilhado para um servidor (ex.: o Waha):
+    - requests.Session com pool de conexões keep-alive;
+    - timeout em toda chamada (conexão, leitura);
+    - retentativas limitadas com backoff exponencial e jitter;
+    - disjuntor para falhar rápido quando o servidor trava.
+
+    `observador(nome, duracao, erro)` é chamado ao fim de cada chamada (métricas).
+    """
+
+    def __init__(self, base_url: str, timeout=(3.05, 10.0), tentativas: int = 3,
+                 backoff: float = 0.3, backoff_maximo: float = 5.0, tamanho_pool: int = 20,
+                 disjuntor: Disjuntor = None, observador=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.tentativas = max(1, tentativas)
+        self.backoff = backoff
+        self.backoff_maximo = backoff_maximo
+        self.disjuntor = disjuntor or Disjuntor()
+        self.observador = observador
+
+        self._sessao = requests.Session()
+        # As retentativas ficam a cargo do transporte (urllib3 não retenta)
+        adaptador = HTTPAdapter(pool_connections=tamanho_pool, pool_maxsize=tamanho_pool, max_retries=0)
+        self._sessao.mount("http://", adaptador)
+        self._sessao.mount("https://", adaptador)
+
+    def _espera(self, tentativa: int) -> float:
+        # Full jitter: espalha as retentativas de vários workers no tempo
+        return random.uniform(0, min(self.backoff_maximo, self.backoff * (2 ** tentativa)))
+
+    def _observar(self, nome, inicio, erro=None):
+        if self.observador is None:
+            return
+        try:
+            self.observador(nome, time.perf_counter() - inicio, erro)
+        except Exception as e:
+            print(f"[HTTP] Erro no observador de {nome}: {e}")
+
+    def requisitar(self, metodo: str, caminho: str, nome: str = None, timeout=None,
+                   tentativas: int = None, **kwargs) -> requests.Response:
+        """
+        Faz a chamada e devolve a Response (inclusive 4xx/5xx não retentáveis).
+        Levanta CircuitoAberto sem ir à rede se o disjuntor estiver aberto, ou a
+        exceção do requests se todas as tentativas falharem.
+        """
+        nome = nome or caminho
+        url = caminho if caminho.startswith("http") else f"{self.base_url}{caminho}"
+        timeout = timeout if timeout is not None else self.timeout
+        tentativas = tentativas or self.tentativas
+        # POST não é idempotente: timeout de leitura ou conexão caída podem significar que o servidor já recebeu
+        idempotente = metodo.upper() in ("GET", "HEAD", "OPTIONS")
+
+        inicio = time.perf_counter()
+        if not self.disjuntor.permitir():
+            erro = CircuitoAberto(f"Circuito aberto para {self.base_url}")
+            self._observar(nome, inicio, erro)
+            raise erro
+
+        registrado = False
+        try:
+            for tentativa in range(tentativas):
+                ultima = tentativa == tentativas - 1
+                try:
+                    resposta = self._sessao.request(metodo, url, timeout=timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    # POST só repete se com certeza não chegou ao servidor (conexão caída no meio pode ter chegado)
+                    retentavel = idempotente or falhou_antes_do_envio(e)
+                    if ultima or not retentavel:
+                        registrado = True
+                        self.disjuntor.registrar_falha()
+                        self._observar(nome, inicio, e)
+                        raise
+                    time.sleep(self._espera(tentativa))
+                    continue
+
+                if resposta.status_code in STATUS_RETENTAVEIS and not ultima:
+                    resposta.close()
+                    time.sleep(self._espera(tentativa))
+                    continue
+
+                registrado = True
+                if resposta.status_code >= 500:
+                    self.disjuntor.registrar_falha()
+                else:
+                    self.disjuntor.registrar_sucesso()
+                self._observar(nome, inicio)
+                return resposta
+        finally:
+            if not registrado:
+                # Exceção fora do requests: o disjuntor não pode ficar preso em "testando"
+                self.disjuntor.liberar_teste()
+
+    def get(self, caminho: str, **kwargs) -> requests.Response:
+        return self.requisitar("GET", caminho, **kwargs)
+
+    def post(self, caminho: str, **kwargs) -> requests.Response:
+        return self.requisitar("POST", caminho, **kwargs)
+
+
+_transportes = {}
+_lock = threading.Lock()
+
+
+def obter_transporte(base_url: str, **opcoes) -> TransporteHTTP:
+    """
+    Transporte único por servidor no processo, para todos os clientes
+    compartilharem o mesmo pool e o mesmo disjuntor. As opções valem só na criação.
+    """
+    chave = base_url.rstrip("/")
+    with _lock:
+        transporte = _transportes.get(chave)
+        if transporte is None:
+            transporte = TransporteHTTP(chave, **opcoes)
+            _transportes[chave] = transporte
+        return transporte
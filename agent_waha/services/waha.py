@@ -1,9 +1,52 @@
-import requests
+import os
+import threading
+import time
+from services.agendador import agendador
+from services.metricas import registro
+from services.temporizacao import registrar_etapa
+from services.transporte_http import obter_transporte, falhou_antes_do_envio
+from services.fila_envio import obter_fila_envio, total_pendentes, PRIORIDADE_RESPOSTA
+from services.cache_contatos import CacheContatos
+from services.mongo import get_db
+
+# Timeout (s) de leitura das chamadas ao Waha; a conexão tem 3 s para abrir
+WAHA_TIMEOUT = float(os.getenv('WAHA_TIMEOUT', '10'))
+# Limite de envios por sessão do Waha: mensagens por segundo e rajada máxima
+ENVIO_TAXA = float(os.getenv('ENVIO_TAXA', '2'))
+ENVIO_RAJADA = int(os.getenv('ENVIO_RAJADA', '5'))
+
+
+metrica_erros = registro.contador(
+    "waha_http_erros_total", "Chamadas ao Waha que falharam (rede, timeout ou circuito aberto)"
+)
+registro.medidor("fila_envio_pendentes", "Mensagens aguardando na fila de saída do Waha", funcao=total_pendentes)
+metrica_cache_contatos = registro.contador(
+    "cache_contatos_total", "Consultas de número no WhatsApp por resultado do cache (acerto/erro)"
+)
+
+# telefone -> chatId do check-exists; CACHE_CONTATOS_MONGO=0 deixa só o nível em memória
+cache_contatos = CacheContatos(
+    obter_colecao=(lambda: get_db().contatos_whatsapp) if os.getenv("CACHE_CONTATOS_MONGO", "1") == "1" else None,
+)
+
+
+def _observar_http(nome, duracao, erro):
+    registrar_etapa("http", nome, duracao)
+    if erro is not None:
+        metrica_erros.inc(chamada=nome, erro=type(erro).__name__)
+
 
 class Waha:
 
-    def __init__(self):
-        self.__api_url = 'http://waha:3000'
+    # Horário (monotonic) do último envio agendado por chat, para manter a ordem das respostas
+    _ultimo_envio = {}
+    _lock_envio = threading.Lock()
+
+    def __init__(self, api_url: str = None):
+        self.__api_url = api_url or os.getenv('WAHA_API_URL', 'http://waha:3000')
+        # Mesmo pool de conexões, timeouts, retentativas e disjuntor para todas as instâncias
+        self._transporte = obter_transporte(self.__api_url, timeout=(3.05, WAHA_TIMEOUT),
+                                            observador=_observar_http)
     
     def verify_wid(self, phone_number,session):
         # Debug: imprime o número formatado
@@ -12,11 +55,29 @@ class Waha:
         # Certifique-se de que o número é uma string e remova espaços extras
         phone_number = str(phone_number).strip()
 
-        # Nova URL correta para verificar se o número existe
-        url = f"{self.__api_url}/api/contacts/check-exists?phone={phone_number}&session={session}"
+        encontrado, chat_id = cache_contatos.obter(phone_number)
+        metrica_cache_contatos.inc(resultado="acerto" if encontrado else "erro")
+        if encontrado:
+            return chat_id
+
+        try:
+            chat_id = self._check_exists(phone_number, session)
+        except RuntimeError as e:
+            # Falha na consulta não entra no cache
+            print(f"⚠️ Erro na requisição: {e}")
+            return None
+
+        cache_contatos.guardar(phone_number, chat_id)
+        return chat_id
 
+    def _check_exists(self, phone_number, session):
+        """Consulta o Waha; retorna o chatId ou None (número sem WhatsApp). Levanta RuntimeError se a API falhar."""
         # Fazendo a requisição GET
-        response = requests.get(url)
+        response = self._transporte.get(
+            "/api/contacts/check-exists",
+            params={"phone": phone_number, "session": session},
+            nome="waha.checkExists",
+        )
 
         # Depuração: Verifique a resposta da API
         print(f"DEBUG - Resposta da API: {response.text}")
@@ -30,53 +91,65 @@ class Waha:
                 return chat_id
             else:
                 print("❌ Erro: Número não registrado no WhatsApp.")
-        else:
-            print(f"⚠️ Erro na requisição: {response.status_code} - {response.text}")
-
-        return None  # Retorna None caso não encontre o número
+                return None
+        raise RuntimeError(f"{response.status_code} - {response.text}")
 
     def send_message(self, chat_id, message,session):
-        url = f'{self.__api_url}/api/sendText'
-        headers = {
-            'Content-Type': 'application/json',
-        }
         payload = {
             'session': session,
             'chatId': chat_id,
             'text': message,
         }
-        requests.post(
-            url=url,
-            json=payload,
-            headers=headers,
+        return self._transporte.post("/api/sendText", json=payload, nome="waha.sendText")
+
+    def enqueue_message(self, chat_id, message, session, prioridade=PRIORIDADE_RESPOSTA, ao_concluir=None):
+        """
+        Envia pela fila de saída da sessão (token bucket + prioridade), em vez de
+        chamar o /api/sendText direto. Retorna False se a fila recusar a mensagem.
+        """
+        fila = obter_fila_envio(
+            session,
+            lambda chat_id, texto: self.send_message(chat_id, texto, session).status_code,
+            taxa=ENVIO_TAXA,
+            rajada=ENVIO_RAJADA,
+            retentavel=falhou_antes_do_envio,
         )
+        return fila.enfileirar(chat_id, message, prioridade, ao_concluir)
 
     def start_typing(self, chat_id,session):
-        url = f'{self.__api_url}/api/startTyping'
-        headers = {
-            'Content-Type': 'application/json',
-        }
         payload = {
             'session': session,
             'chatId': chat_id,
         }
-        requests.post(
-            url=url,
-            json=payload,
-            headers=headers,
-        )
+        self._transporte.post("/api/startTyping", json=payload, nome="waha.startTyping")
 
     def stop_typing(self, chat_id,session):
-        url = f'{self.__api_url}/api/stopTyping'
-        headers = {
-            'Content-Type': 'application/json',
-        }
         payload = {
             'session': session,
             'chatId': chat_id,
         }
-        requests.post(
-            url=url,
-            json=payload,
-            headers=headers,
-        )
\ No newline at end of file
+        self._transporte.post("/api/stopTyping", json=payload, nome="waha.stopTyping")
+
+    def send_message_with_typing(self, chat_id, message, session, delay, prioridade=PRIORIDADE_RESPOSTA):
+        """
+        Mostra "digitando..." agora e agenda o envio da mensagem e o stop typing
+        para daqui a `delay` segundos, sem segurar a thread de quem chamou.
+        Mensagens do mesmo chat nunca são enviadas fora de ordem.
+        """
+        self.start_typing(chat_id=chat_id, session=session)
+        with Waha._lock_envio:
+            agora = time.monotonic()
+            envio = max(agora + delay, Waha._ultimo_envio.get(chat_id, 0) + 0.5)
+            Waha._ultimo_envio[chat_id] = envio
+            # Remove entradas antigas para o dicionário não crescer sem limite
+            for chave in [c for c, t in Waha._ultimo_envio.items() if t < agora - 60]:
+                del Waha._ultimo_envio[chave]
+        agendador.agendar(envio - agora, self._send_and_stop_typing, chat_id, message, session, prioridade)
+
+    def _send_and_stop_typing(self, chat_id, message, session, prioridade=PRIORIDADE_RESPOSTA):
+        # O "digitando..." só para quando a fila de saída realmente enviar (ou desistir)
+        def _parar_digitacao(enviado):
+            self.stop_typing(chat_id=chat_id, session=session)
+
+        if not self.enqueue_message(chat_id, message, session, prioridade, ao_concluir=_parar_digitacao):
+            self.stop_typing(chat_id=chat_id, session=session)
@@ -0,0 +1,61 @@
+import asyncio
+from services.waha import Waha
+from services.fila_envio import PRIORIDADE_RESPOSTA
+
+
+class WahaAsync:
+    """
+    Versão assíncrona do cliente Waha (services/waha.py) para o app ASGI.
+    Delega ao Waha síncrono, então usa o mesmo transporte (pool, retentativas e
+    disjuntor), a mesma fila de saída por sessão e o mesmo cache de contatos do
+    app Flask. As chamadas HTTP rodam em asyncio.to_thread; o envio em si é feito
+    pela thread da fila de saída, e o event loop só aguarda o resultado.
+    """
+
+    def __init__(self, api_url: str = None):
+        self._waha = Waha(api_url)
+
+    async def verify_wid(self, phone_number, session):
+        return await asyncio.to_thread(self._waha.verify_wid, phone_number, session)
+
+    async def send_message(self, chat_id, message, session):
+        """Envio direto, sem a fila de saída. Levanta RuntimeError se o Waha não aceitar a mensagem."""
+        response = await asyncio.to_thread(self._waha.send_message, chat_id, message, session)
+        if response.status_code >= 400:
+            raise RuntimeError(f"Waha recusou a mensagem para {chat_id}: {response.status_code} - {response.text}")
+        return response
+
+    async def start_typing(self, chat_id, session):
+        await asyncio.to_thread(self._waha.start_typing, chat_id, session)
+
+    async def stop_typing(self, chat_id, session):
+        await asyncio.to_thread(self._waha.stop_typing, chat_id, session)
+
+    async def send_message_with_typing(self, chat_id, message, session, delay, prioridade=PRIORIDADE_RESPOSTA):
+        """
+        Mostra "digitando..." e, depois de `delay` segundos (asyncio.sleep, sem
+        ocupar thread), entrega a mensagem à fila de saída da sessão. Aguarda a fila
+        concluir e retorna o resultado do envio: True (enviada), False (recusada ou
+        desistência) ou None (resultado desconhecido, o Waha pode ter recebido).
+        """
+        try:
+            await self.start_typing(chat_id=chat_id, session=session)
+        except Exception as e:
+            # "digitando..." é só visual: não impede o envio
+            print(f"⚠️ Erro ao iniciar digitação de {chat_id}: {e}")
+        await asyncio.sleep(delay)
+
+        loop = asyncio.get_running_loop()
+        concluido = loop.create_future()
+
+        def _ao_concluir(enviado):
+            # Roda na thread da fila de saída: para a digitação e acorda o event loop
+            try:
+                self._waha.stop_typing(chat_id=chat_id, session=session)
+            finally:
+                loop.call_soon_threadsafe(lambda: concluido.done() or concluido.set_result(enviado))
+
+        if not self._waha.enqueue_message(chat_id, message, session, prioridade, ao_concluir=_ao_concluir):
+            await self.stop_typing(chat_id=chat_id, session=session)
+            return False
+        return await concluido
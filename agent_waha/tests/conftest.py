@@ -0,0 +1,41 @@
+import os
+import sys
+import pytest
+
+# O módulo do agente conecta no Mongo e cria os clientes da OpenAI no import:
+# os testes rodam com mongomock (requirements-dev.txt), tools falsas e sem rede
+os.environ["MONGO_URI"] = "mongomock://"
+os.environ["MONGO_DB"] = "restaurante_testes"
+os.environ["SERVICOS_EXTERNOS"] = "fake"
+os.environ.setdefault("OPENAI_API_KEY", "sk-testes")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# chat_id -> nome dos clientes já cadastrados
+CLIENTES = {
+    "5516990000001@c.us": "Ana",
+    "5516990000002@c.us": "Bruno",
+}
+
+
+@pytest.fixture(autouse=True)
+def banco():
+    from services import agent_restaurante
+
+    db = agent_restaurante.db
+    for colecao in ("user", "pedidos", "produtos", "cache_faq"):
+        db[colecao].delete_many({})
+    for chat_id, nome in CLIENTES.items():
+        telefone = chat_id.replace("@c.us", "")[2:]
+        db.user.insert_one({"telefone": telefone, "nome": nome})
+        agent_restaurante.cache_usuarios.invalidar(telefone)
+    db.produtos.insert_one({"nome": "Smash Burger", "categoria": "Hambúrgueres", "preco": 25.0,
+                            "disponivel": True, "adicionais": [{"nome": "Bacon", "preco": 4.0}]})
+    return db
+
+
+def responder(grafo, chat_id, texto):
+    """Um turno do cliente no grafo; retorna o texto da última mensagem."""
+    config = {"configurable": {"thread_id": chat_id}}
+    resultado = grafo.invoke({"messages": [{"role": "user", "content": texto}]}, config)
+    return resultado["messages"][-1].content
@@ -0,0 +1,73 @@
+import time
+from services.agrupador import AgrupadorMensagens
+
+
+class Entregas:
+    def __init__(self):
+        self.itens = []
+
+    def __call__(self, chave, itens):
+        self.itens.append((chave, itens))
+
+    def esperar(self, quantidade, timeout=5.0):
+        limite = time.monotonic() + timeout
+        while len(self.itens) < quantidade:
+            assert time.monotonic() < limite, "tempo esgotado"
+            time.sleep(0.01)
+        return self.itens
+
+
+def test_mensagens_seguidas_viram_um_turno_em_ordem():
+    entregas = Entregas()
+    agrupador = AgrupadorMensagens(0.1, entregas)
+    for texto in ("oi", "quero um smash", "sem cebola"):
+        agrupador.adicionar("chat-a", texto)
+    assert entregas.esperar(1) == [("chat-a", ["oi", "quero um smash", "sem cebola"])]
+    time.sleep(0.2)
+    assert len(entregas.itens) == 1
+
+
+def test_chats_diferentes_sao_entregues_separados():
+    entregas = Entregas()
+    agrupador = AgrupadorMensagens(0.05, entregas)
+    agrupador.adicionar("chat-a", "oi")
+    agrupador.adicionar("chat-b", "olá")
+    assert sorted(entregas.esperar(2)) == [("chat-a", ["oi"]), ("chat-b", ["olá"])]
+
+
+def test_nova_mensagem_reinicia_a_janela():
+    entregas = Entregas()
+    agrupador = AgrupadorMensagens(0.15, entregas, espera_maxima=5)
+    agrupador.adicionar("chat-a", "1")
+    time.sleep(0.1)
+    agrupador.adicionar("chat-a", "2")
+    time.sleep(0.1)
+    # 0.2s depois da primeira, mas só 0.1s depois da segunda: ainda aguardando
+    assert entregas.itens == []
+    assert entregas.esperar(1) == [("chat-a", ["1", "2"])]
+
+
+def test_espera_maxima_entrega_mesmo_com_mensagens_chegando():
+    entregas = Entregas()
+    agrupador = AgrupadorMensagens(0.1, entregas, espera_maxima=0.25)
+    inicio = time.monotonic()
+    while not entregas.itens and time.monotonic() - inicio < 2:
+        agrupador.adicionar("chat-a", "x")
+        time.sleep(0.05)
+    assert entregas.itens, "o grupo nunca foi entregue"
+    assert time.monotonic() - inicio < 1
+
+
+def test_erro_na_entrega_nao_para_o_agrupador():
+    entregas = Entregas()
+
+    def entregar(chave, itens):
+        if chave == "chat-ruim":
+            raise RuntimeError("falhou")
+        entregas(chave, itens)
+
+    agrupador = AgrupadorMensagens(0.05, entregar)
+    agrupador.adicionar("chat-ruim", "x")
+    time.sleep(0.1)
+    agrupador.adicionar("chat-a", "oi")
+    assert entregas.esperar(1) == [("chat-a", ["oi"])]
@@ -0,0 +1,79 @@
+from datetime import datetime
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+from services import agent_restaurante
+from services.cache_semantico import CacheSemantico
+from services.modelo_fake import ModeloRoteirizado, Regra, REGRAS_RESTAURANTE
+from services.servicos_fake import EmbeddingsFake
+from conftest import responder
+
+RESPOSTA_PEDIDO = "O total do seu pedido ficou em R$ 58,00 🍔"
+RESPOSTA_PADRAO = "Não tenho essa informação agora."
+
+
+@pytest.fixture
+def cache():
+    return CacheSemantico(EmbeddingsFake(), lambda: "v1")
+
+
+def agente(cache, regras):
+    modelo = ModeloRoteirizado(regras=regras, resposta_padrao=RESPOSTA_PADRAO)
+    return agent_restaurante.AgentRestaurante(
+        checkpointer=MemorySaver(), llm=modelo, registrar_webhook=False, roteador=False, cache_faq=cache
+    ).memory_agent()
+
+
+def test_resposta_do_pedido_nao_vai_para_outra_conversa(cache):
+    # Ana faz um pedido e pergunta o total: a resposta depende do pedido dela
+    grafo_ana = agente(cache, [Regra(r"valor total", resposta=RESPOSTA_PEDIDO)] + REGRAS_RESTAURANTE)
+    responder(grafo_ana, "5516990000001@c.us", "Quero dois smash burger com bacon")
+    assert responder(grafo_ana, "5516990000001@c.us", "Qual o valor total?") == RESPOSTA_PEDIDO
+
+    # Mesma pergunta de Bruno, num agente cujo LLM não sabe nada do pedido da Ana
+    grafo_bruno = agente(cache, [])
+    assert responder(grafo_bruno, "5516990000002@c.us", "Qual o valor total?") == RESPOSTA_PADRAO
+
+
+def test_pedido_aberto_no_mongo_tambem_tira_do_cache(cache, banco):
+    # Pedido aberto gravado por outra conversa (ou antes do resumo da janela): nada no state
+    banco.pedidos.insert_one({
+        "id_pedido": "abc123",
+        "cliente": {"nome": "Ana", "telefone": "16990000001"},
+        "status": "Aguardando forma de pagamento",
+        "data_criacao": datetime.utcnow().isoformat(),
+    })
+    grafo_ana = agente(cache, [Regra(r"valor total", resposta=RESPOSTA_PEDIDO)])
+    assert responder(grafo_ana, "5516990000001@c.us", "Qual o valor total?") == RESPOSTA_PEDIDO
+
+    grafo_bruno = agente(cache, [])
+    assert responder(grafo_bruno, "5516990000002@c.us", "Qual o valor total?") == RESPOSTA_PADRAO
+
+
+def test_pergunta_frequente_e_reaproveitada(cache):
+    grafo_ana = agente(cache, REGRAS_RESTAURANTE)
+    resposta = responder(grafo_ana, "5516990000001@c.us", "Qual o horário de funcionamento?")
+    assert resposta != RESPOSTA_PADRAO
+
+    # Bruno recebe a resposta guardada sem passar pelo LLM
+    grafo_bruno = agente(cache, [])
+    assert responder(grafo_bruno, "5516990000002@c.us", "Qual o horário de funcionamento?") == resposta
+
+
+@pytest.mark.parametrize("pergunta", [
+    "E o de frango?",
+    "Meu pedido já saiu?",
+    "Quanto ficou isso?",
+    "Vocês entregam ele hoje?",
+    "Pode ser?",
+])
+def test_pergunta_que_depende_da_conversa_nao_entra_no_cache(cache, pergunta):
+    assert not cache.elegivel(pergunta)
+
+
+@pytest.mark.parametrize("pergunta", [
+    "Qual o horário de funcionamento?",
+    "Vocês entregam no centro?",
+    "O hambúrguer tem opção sem glúten?",
+])
+def test_pergunta_de_faq_entra_no_cache(cache, pergunta):
+    assert cache.elegivel(pergunta)
@@ -0,0 +1,68 @@
+import pytest
+from langgraph.checkpoint.memory import MemorySaver
+from services import agent_restaurante
+from services.modelo_fake import ModeloRoteirizado
+from conftest import responder
+
+CHAT_ID = "5516990000001@c.us"
+TURNOS = ["Oi, boa noite!", "Quero dois smash burger com bacon", "Só isso", "Retirada"]
+
+
+class MemorySaverContado(MemorySaver):
+    """Conta os checkpoints e as escritas pendentes que chegam ao checkpointer de verdade."""
+
+    def __init__(self):
+        super().__init__()
+        self.checkpoints = 0
+        self.escritas = 0
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        self.checkpoints += 1
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        self.escritas += len(writes)
+        return super().put_writes(config, writes, task_id, task_path)
+
+
+def agente(salvo, adiar):
+    return agent_restaurante.AgentRestaurante(
+        checkpointer=salvo, llm=ModeloRoteirizado(), registrar_webhook=False, cache_faq=False, adiar_checkpoint=adiar
+    ).memory_agent()
+
+
+@pytest.mark.parametrize("texto", TURNOS)
+def test_um_turno_grava_um_checkpoint(texto):
+    salvo = MemorySaverContado()
+    grafo = agente(salvo, adiar=True)
+
+    responder(grafo, CHAT_ID, texto)
+
+    assert salvo.checkpoints == 1
+    assert salvo.escritas == 0
+
+
+def test_turnos_ficam_encadeados_no_checkpointer():
+    salvo = MemorySaverContado()
+    grafo = agente(salvo, adiar=True)
+    config = {"configurable": {"thread_id": CHAT_ID}}
+
+    for numero, texto in enumerate(TURNOS, start=1):
+        resposta = responder(grafo, CHAT_ID, texto)
+        assert salvo.checkpoints == numero
+        # O que foi gravado é o estado do fim do turno
+        assert salvo.get_tuple(config).checkpoint["channel_values"]["messages"][-1].content == resposta
+
+    historico = list(salvo.list(config))
+    assert len(historico) == len(TURNOS)
+    for checkpoint, anterior in zip(historico, historico[1:]):
+        assert checkpoint.parent_config["configurable"]["checkpoint_id"] == anterior.config["configurable"]["checkpoint_id"]
+
+
+def test_sem_adiar_cada_super_step_grava():
+    salvo = MemorySaverContado()
+    grafo = agente(salvo, adiar=False)
+
+    responder(grafo, CHAT_ID, "Quero dois smash burger com bacon")
+
+    assert salvo.checkpoints > 1
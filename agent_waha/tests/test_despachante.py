@@ -0,0 +1,72 @@
+import threading
+import time
+from services.despachante import DespachanteConversas
+
+
+def esperar(condicao, timeout=5.0):
+    limite = time.monotonic() + timeout
+    while not condicao():
+        if time.monotonic() > limite:
+            raise AssertionError("tempo esgotado")
+        time.sleep(0.01)
+
+
+def test_turnos_do_mesmo_chat_rodam_em_ordem_e_um_por_vez():
+    despachante = DespachanteConversas(max_workers=4)
+    executados, rodando, sobreposicoes = [], [0], []
+    lock = threading.Lock()
+
+    def turno(n):
+        with lock:
+            rodando[0] += 1
+            sobreposicoes.append(rodando[0])
+        time.sleep(0.01)
+        with lock:
+            executados.append(n)
+            rodando[0] -= 1
+
+    for n in range(10):
+        despachante.submeter("chat-a", turno, n)
+    esperar(lambda: len(executados) == 10)
+    assert executados == list(range(10))
+    assert max(sobreposicoes) == 1
+    esperar(lambda: despachante.conversas_ativas() == 0)
+
+
+def test_chats_diferentes_rodam_em_paralelo():
+    despachante = DespachanteConversas(max_workers=2)
+    dentro = threading.Barrier(2, timeout=5)
+
+    # Se os dois chats rodassem em série, a barreira nunca abriria
+    resultados = []
+    for chave in ("chat-a", "chat-b"):
+        despachante.submeter(chave, lambda c=chave: resultados.append((c, dentro.wait())))
+    esperar(lambda: len(resultados) == 2)
+
+
+def test_erro_em_um_turno_nao_trava_os_seguintes():
+    despachante = DespachanteConversas(max_workers=2)
+    executados = []
+
+    def falhar():
+        raise RuntimeError("LLM caiu")
+
+    despachante.submeter("chat-a", falhar)
+    despachante.submeter("chat-a", executados.append, "depois")
+    esperar(lambda: executados == ["depois"])
+    esperar(lambda: despachante.conversas_ativas() == 0)
+
+
+def test_submeter_bloqueia_quando_atinge_max_pendentes():
+    despachante = DespachanteConversas(max_workers=1, max_pendentes=1)
+    liberar = threading.Event()
+    despachante.submeter("chat-a", liberar.wait, 5)
+
+    segundo = threading.Thread(target=despachante.submeter, args=("chat-b", lambda: None))
+    segundo.start()
+    segundo.join(0.1)
+    assert segundo.is_alive()
+
+    liberar.set()
+    segundo.join(5)
+    assert not segundo.is_alive()
@@ -0,0 +1,164 @@
+import threading
+import time
+import requests
+from services.fila_envio import (
+    FilaEnvio, PRIORIDADE_RESPOSTA, PRIORIDADE_PAGAMENTO, PRIORIDADE_STATUS,
+)
+from services.transporte_http import falhou_antes_do_envio
+
+
+class WahaFalso:
+    """`enviar` da fila: registra os envios e responde o próximo status (ou exceção) do roteiro."""
+
+    def __init__(self, roteiro=None):
+        self.enviados = []
+        self.roteiro = list(roteiro or [])
+        self.liberar = threading.Event()
+        self.liberar.set()
+
+    def __call__(self, chat_id, texto):
+        self.liberar.wait(5)
+        self.enviados.append((chat_id, texto))
+        resposta = self.roteiro.pop(0) if self.roteiro else 201
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+
+class Conclusoes:
+    def __init__(self):
+        self.resultados = []
+        self._lock = threading.Lock()
+
+    def callback(self, nome):
+        def _ao_concluir(enviado):
+            with self._lock:
+                self.resultados.append((nome, enviado))
+        return _ao_concluir
+
+    def esperar(self, quantidade, timeout=5.0):
+        limite = time.monotonic() + timeout
+        while len(self.resultados) < quantidade:
+            assert time.monotonic() < limite, "tempo esgotado"
+            time.sleep(0.01)
+        return dict(self.resultados)
+
+
+def fila(waha, **opcoes):
+    opcoes = {"taxa": 1000, "rajada": 100, "retentavel": falhou_antes_do_envio, **opcoes}
+    return FilaEnvio("testes", waha, **opcoes)
+
+
+def segurar(fila_envio, waha, conclusoes):
+    """Ocupa a thread de envio com uma mensagem, para as próximas acumularem na fila."""
+    waha.liberar.clear()
+    fila_envio.enfileirar("bloqueio@c.us", "bloqueio", ao_concluir=conclusoes.callback("bloqueio"))
+    limite = time.monotonic() + 5
+    while fila_envio.pendentes():
+        assert time.monotonic() < limite
+        time.sleep(0.01)
+
+
+def test_prioridade_e_ordem_de_chegada():
+    waha, conclusoes = WahaFalso(), Conclusoes()
+    envio = fila(waha)
+    segurar(envio, waha, conclusoes)
+    envio.enfileirar("a@c.us", "status", PRIORIDADE_STATUS, conclusoes.callback("status"))
+    envio.enfileirar("b@c.us", "pagamento", PRIORIDADE_PAGAMENTO, conclusoes.callback("pagamento"))
+    envio.enfileirar("c@c.us", "resposta 1", PRIORIDADE_RESPOSTA, conclusoes.callback("r1"))
+    envio.enfileirar("d@c.us", "resposta 2", PRIORIDADE_RESPOSTA, conclusoes.callback("r2"))
+    waha.liberar.set()
+
+    conclusoes.esperar(5)
+    assert [texto for _, texto in waha.enviados] == ["bloqueio", "resposta 1", "resposta 2", "pagamento", "status"]
+
+
+def test_mensagens_acumuladas_do_mesmo_chat_saem_em_um_envio():
+    waha, conclusoes = WahaFalso(), Conclusoes()
+    envio = fila(waha)
+    segurar(envio, waha, conclusoes)
+    for n in range(3):
+        envio.enfileirar("a@c.us", f"parte {n}", ao_concluir=conclusoes.callback(n))
+    envio.enfileirar("b@c.us", "outro chat", ao_concluir=conclusoes.callback("b"))
+    waha.liberar.set()
+
+    resultados = conclusoes.esperar(5)
+    assert waha.enviados[1:] == [("a@c.us", "parte 0\n\nparte 1\n\nparte 2"), ("b@c.us", "outro chat")]
+    assert all(resultados.values())
+
+
+def test_fila_cheia_descarta_a_menos_prioritaria():
+    waha, conclusoes = WahaFalso(), Conclusoes()
+    envio = fila(waha, max_pendentes=2)
+    segurar(envio, waha, conclusoes)
+    assert envio.enfileirar("a@c.us", "status 1", PRIORIDADE_STATUS, conclusoes.callback("status 1"))
+    assert envio.enfileirar("b@c.us", "status 2", PRIORIDADE_STATUS, conclusoes.callback("status 2"))
+
+    # Cheia só de mensagens tão prioritárias quanto: recusa a nova
+    assert not envio.enfileirar("c@c.us", "status 3", PRIORIDADE_STATUS)
+    # Resposta tem prioridade: entra no lugar da notificação mais nova
+    assert envio.enfileirar("d@c.us", "resposta", PRIORIDADE_RESPOSTA, conclusoes.callback("resposta"))
+    assert conclusoes.esperar(1) == {"status 2": False}
+    waha.liberar.set()
+
+    resultados = conclusoes.esperar(4)
+    assert resultados == {"status 2": False, "bloqueio": True, "resposta": True, "status 1": True}
+    assert [texto for _, texto in waha.enviados] == ["bloqueio", "resposta", "status 1"]
+
+
+def test_429_e_5xx_voltam_para_a_fila():
+    waha, conclusoes = WahaFalso([429, 503]), Conclusoes()
+    envio = fila(waha)
+    envio.enfileirar("a@c.us", "oi", ao_concluir=conclusoes.callback("oi"))
+    assert conclusoes.esperar(1, timeout=10) == {"oi": True}
+    assert len(waha.enviados) == 3
+    assert envio.balde.taxa < envio.balde.taxa_maxima
+
+
+def test_erro_do_pedido_nao_e_reenviado():
+    waha, conclusoes = WahaFalso([400]), Conclusoes()
+    envio = fila(waha)
+    envio.enfileirar("a@c.us", "oi", ao_concluir=conclusoes.callback("oi"))
+    assert conclusoes.esperar(1) == {"oi": False}
+    assert len(waha.enviados) == 1
+
+
+def test_resultado_desconhecido_nao_e_reenviado():
+    waha, conclusoes = WahaFalso([requests.ReadTimeout("sem resposta")]), Conclusoes()
+    envio = fila(waha)
+    envio.enfileirar("a@c.us", "oi", ao_concluir=conclusoes.callback("oi"))
+    assert conclusoes.esperar(1) == {"oi": None}
+    time.sleep(0.1)
+    assert len(waha.enviados) == 1
+
+
+def test_falha_antes_do_envio_e_reenviada():
+    waha, conclusoes = WahaFalso([requests.ConnectTimeout("recusada")]), Conclusoes()
+    envio = fila(waha)
+    envio.enfileirar("a@c.us", "oi", ao_concluir=conclusoes.callback("oi"))
+    assert conclusoes.esperar(1, timeout=10) == {"oi": True}
+    assert len(waha.enviados) == 2
+
+
+def test_desiste_depois_de_max_tentativas():
+    waha, conclusoes = WahaFalso([503, 503]), Conclusoes()
+    envio = fila(waha, max_tentativas=2)
+    envio.enfileirar("a@c.us", "oi", ao_concluir=conclusoes.callback("oi"))
+    assert conclusoes.esperar(1, timeout=10) == {"oi": False}
+    assert len(waha.enviados) == 2
+
+
+def test_cancelar_tira_da_fila_so_enquanto_espera():
+    waha, conclusoes = WahaFalso(), Conclusoes()
+    envio = fila(waha)
+    segurar(envio, waha, conclusoes)
+    callback = conclusoes.callback("cancelada")
+    envio.enfileirar("a@c.us", "cancelada", ao_concluir=callback)
+    assert envio.cancelar(callback)
+    assert not envio.cancelar(callback)
+    waha.liberar.set()
+
+    conclusoes.esperar(1)
+    time.sleep(0.1)
+    assert [texto for _, texto in waha.enviados] == ["bloqueio"]
+    assert "cancelada" not in dict(conclusoes.resultados)
@@ -0,0 +1,125 @@
+import threading
+import time
+import pytest
+from services.fila_mensagens import FilaMensagens, TurnoJaIniciado
+
+
+@pytest.fixture
+def caminho(tmp_path):
+    return str(tmp_path / "fila.db")
+
+
+@pytest.fixture
+def fila(caminho):
+    return FilaMensagens(caminho, max_tentativas=3, tempo_reserva=60)
+
+
+def status(fila, item_id):
+    linha = fila._conn.execute("SELECT status, tentativas FROM eventos WHERE id = ?", (item_id,)).fetchone()
+    return tuple(linha) if linha else None
+
+
+def test_reserva_em_ordem_de_chegada(fila):
+    ids = [fila.enfileirar({"n": n}) for n in range(3)]
+    assert [fila.reservar(timeout=0)["id"] for _ in ids] == ids
+    assert fila.reservar(timeout=0) is None
+
+
+def test_falha_antes_do_turno_volta_para_a_fila(fila):
+    item_id = fila.enfileirar({"n": 1})
+    item = fila.reservar(timeout=0)
+
+    def processar(eventos):
+        raise RuntimeError("agente não carregou")
+
+    fila._executar([item], processar)
+    assert status(fila, item_id) == ("pendente", 1)
+
+
+def test_falha_depois_do_turno_iniciado_nao_repete(fila):
+    item_id = fila.enfileirar({"n": 1})
+    pedidos = []
+
+    def processar(eventos):
+        pedidos.append(eventos)  # efeito colateral do grafo (ex.: pedido gravado)
+        raise TurnoJaIniciado("LLM caiu no meio") from RuntimeError("timeout")
+
+    fila._executar([fila.reservar(timeout=0)], processar)
+    assert status(fila, item_id) == ("falhou", 0)
+    assert fila.reservar(timeout=0) is None
+    assert len(pedidos) == 1
+
+
+def test_descarta_depois_de_max_tentativas(fila):
+    item_id = fila.enfileirar({"n": 1})
+    for tentativa in range(3):
+        fila._conn.execute("UPDATE eventos SET disponivel_em = 0 WHERE id = ?", (item_id,))
+        item = fila.reservar(timeout=0)
+        assert item["tentativas"] == tentativa
+        fila.devolver(item["id"], item["tentativas"], atraso=0)
+    assert status(fila, item_id)[0] == "falhou"
+
+
+def test_falha_no_envio_repete_so_o_envio(fila):
+    item_id = fila.enfileirar({"n": 1})
+    turnos, envios = [], []
+    enviado = threading.Event()
+
+    def enviar():
+        envios.append(time.time())
+        if len(envios) == 1:
+            raise ConnectionError("Waha fora")
+        enviado.set()
+
+    def processar(eventos):
+        turnos.append(eventos)
+        return enviar
+
+    fila._executar([fila.reservar(timeout=0)], processar)
+    assert status(fila, item_id) is None  # confirmado antes do envio
+    assert enviado.wait(10)
+    assert len(turnos) == 1 and len(envios) == 2
+
+
+def test_outra_instancia_nao_pega_reserva_valida(fila, caminho):
+    fila.enfileirar({"n": 1})
+    assert fila.reservar(timeout=0) is not None
+    assert FilaMensagens(caminho).reservar(timeout=0) is None
+
+
+def test_reserva_vencida_de_outra_instancia_e_recuperada(caminho):
+    morta = FilaMensagens(caminho, tempo_reserva=0.05)
+    item_id = morta.enfileirar({"n": 1})
+    assert morta.reservar(timeout=0)["id"] == item_id
+    time.sleep(0.1)
+
+    # A própria instância não pega de novo o que está processando; outra pega depois que vence
+    assert morta.reservar(timeout=0) is None
+    assert FilaMensagens(caminho).reservar(timeout=0)["id"] == item_id
+
+
+def test_renovar_estende_a_reserva(caminho):
+    viva = FilaMensagens(caminho, tempo_reserva=0.2)
+    viva.enfileirar({"n": 1})
+    viva.reservar(timeout=0)
+    time.sleep(0.1)
+    assert viva.renovar_reservas() == 1
+    time.sleep(0.15)
+    assert FilaMensagens(caminho).reservar(timeout=0) is None
+
+
+def test_migra_fila_sem_dono(caminho):
+    import sqlite3
+    conn = sqlite3.connect(caminho)
+    conn.execute(
+        "CREATE TABLE eventos (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, "
+        "status TEXT NOT NULL DEFAULT 'pendente', tentativas INTEGER NOT NULL DEFAULT 0, "
+        "enfileirado_em REAL NOT NULL, disponivel_em REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO eventos (payload, status, enfileirado_em, disponivel_em) "
+                 "VALUES ('{\"n\": 1}', 'processando', 0, 0)")
+    conn.commit()
+    conn.close()
+
+    # Evento em processamento de antes da migração: a reserva já nasce vencida
+    assert FilaMensagens(caminho).reservar(timeout=0)["evento"] == {"n": 1}
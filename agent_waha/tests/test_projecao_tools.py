@@ -0,0 +1,39 @@
+import json
+from services import agent_restaurante
+from services.agent_restaurante import PROJECAO_TOOLS, projetar_resultado
+
+
+def test_toda_tool_que_retorna_dict_tem_projecao():
+    for ferramenta in agent_restaurante.tools:
+        if ferramenta.func.__annotations__.get("return") is dict:
+            assert ferramenta.name in PROJECAO_TOOLS, ferramenta.name
+
+
+def test_projecao_do_pedido_mantem_a_confirmacao_e_descarta_as_estruturas():
+    resultado = {
+        "success": True,
+        "need_confirmation": False,
+        "message": "Pedido anotado",
+        "order": {"id_pedido": "abc123", "valor_total": 29.0, "total_itens": 1, "itens": [{"nome": "Smash Burger"}]},
+        "estrutura_cozinha": [{"item": "Smash Burger"}],
+    }
+    projetado = json.loads(projetar_resultado("processar_pedido_full", resultado))
+    assert projetado == {"success": True, "need_confirmation": False, "message": "Pedido anotado",
+                         "id_pedido": "abc123", "valor_total": 29.0, "total_itens": 1}
+
+
+def test_projecao_da_sugestao_de_produto():
+    resultado = {
+        "success": False,
+        "need_confirmation": True,
+        "message": "Confirma?",
+        "produto_sugerido": {"nome_original": "smesh", "nome_sugerido": "Smash Burger", "score": 70,
+                             "alternativas": ["Pirão Burger"]},
+    }
+    projetado = json.loads(projetar_resultado("processar_pedido_full", resultado))
+    assert projetado["nome_sugerido"] == "Smash Burger"
+    assert projetado["alternativas"] == ["Pirão Burger"]
+
+
+def test_tools_de_texto_vao_inteiras():
+    assert projetar_resultado("consultar_material_de_apoio", "Abrimos às 18h") == "Abrimos às 18h"
@@ -0,0 +1,114 @@
+import json
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from services.roteador_intencoes import PREFIXO_ID, RoteadorIntencoes
+
+TELEFONE = "16990000001"
+
+
+def roteador(pedido):
+    consultas = []
+
+    def buscar_pedido(telefone):
+        consultas.append(telefone)
+        return pedido
+
+    instancia = RoteadorIntencoes(buscar_pedido=buscar_pedido)
+    instancia.consultas = consultas
+    return instancia
+
+
+def state(pergunta_bot, resposta_cliente, telefone=TELEFONE):
+    mensagens = [HumanMessage(content="oi")]
+    if pergunta_bot:
+        mensagens.append(AIMessage(content=pergunta_bot))
+    mensagens.append(HumanMessage(content=resposta_cliente))
+    return {"messages": mensagens, "user_info": {"nome": "Ana", "telefone": telefone}}
+
+
+PEDIDO = {"id_pedido": "abc123", "status": "Aguardando definição de entrega"}
+
+
+@pytest.mark.parametrize("pergunta, resposta, ferramenta, argumentos", [
+    ("Deseja mais alguma coisa?", "só isso", "confirmar_pedido", {}),
+    ("É para retirada ou entrega?", "retirada", "processar_retirada", {}),
+    ("Como deseja pagar? Cartão, PIX ou dinheiro", "2", "criar_cobranca_asaas", {"tipo": "PIX"}),
+    ("Como deseja pagar? Cartão, PIX ou dinheiro", "cartão", "criar_cobranca_asaas", {"tipo": "CREDIT_CARD"}),
+    ("Quanto você vai pagar?", "R$ 100", "processar_pagamento_dinheiro", {"valor_cliente": 100.0}),
+])
+def test_tools_recebem_o_pedido_aberto_do_chat(pergunta, resposta, ferramenta, argumentos):
+    decisao = roteador(PEDIDO).decidir(state(pergunta, resposta))
+    assert decisao["ferramenta"] == ferramenta
+    assert decisao["argumentos"] == {**argumentos, "id_pedido": "abc123"}
+
+
+def test_sem_pedido_aberto_do_telefone_vai_para_o_llm():
+    instancia = roteador(None)
+    assert instancia.decidir(state("Como deseja pagar? Cartão, PIX ou dinheiro", "2")) is None
+    assert instancia.consultas == [TELEFONE]
+
+
+def test_sem_telefone_nao_decide():
+    instancia = roteador(PEDIDO)
+    assert instancia.decidir(state("Como deseja pagar? Cartão, PIX ou dinheiro", "pix", telefone=None)) is None
+    assert instancia.consultas == []
+
+
+def test_erro_na_busca_do_pedido_vai_para_o_llm():
+    def buscar_pedido(telefone):
+        raise RuntimeError("Mongo fora")
+
+    instancia = RoteadorIntencoes(buscar_pedido=buscar_pedido)
+    assert instancia.decidir(state("Como deseja pagar? Cartão, PIX ou dinheiro", "pix")) is None
+
+
+@pytest.mark.parametrize("status, resposta, ferramenta", [
+    ("Confirmado - Preparando", "retirada", "processar_retirada"),
+    ("Aguardando forma de pagamento", "pix", "criar_cobranca_asaas"),
+])
+def test_etapa_pelo_status_do_pedido_gravado(status, resposta, ferramenta):
+    # A última mensagem do bot não é uma pergunta conhecida
+    decisao = roteador({"id_pedido": "abc123", "status": status}).decidir(state("Anotado! 👍", resposta))
+    assert decisao["ferramenta"] == ferramenta
+
+
+def test_resposta_fora_das_regras_vai_para_o_llm():
+    assert roteador(PEDIDO).decidir(state("Como deseja pagar? Cartão, PIX ou dinheiro", "quanto fica?")) is None
+
+
+def test_mensagem_longa_nao_consulta_o_pedido():
+    instancia = roteador(PEDIDO)
+    assert instancia.decidir(state("Deseja mais alguma coisa?", "não, " + "obrigado " * 10)) is None
+    assert instancia.consultas == []
+
+
+def test_resposta_pronta_a_partir_da_tool():
+    instancia = roteador(PEDIDO)
+    chamada = instancia.mensagem(instancia.decidir(state("Deseja mais alguma coisa?", "não")))
+    assert chamada.tool_calls[0]["id"].startswith(PREFIXO_ID)
+    mensagens = [chamada, ToolMessage(content="✅ Pedido confirmado", tool_call_id=chamada.tool_calls[0]["id"],
+                                      name="confirmar_pedido")]
+    assert instancia.resposta_pronta(mensagens).startswith("✅ Pedido confirmado")
+
+    falhou = ToolMessage(content=json.dumps({"success": False, "message": "x"}),
+                         tool_call_id=chamada.tool_calls[0]["id"], name="confirmar_pedido")
+    assert instancia.resposta_pronta([chamada, falhou]) is None
+
+
+def test_pedido_aberto_e_tool_usam_o_pedido_gravado_do_telefone(banco):
+    from datetime import datetime
+    from services import agent_restaurante
+
+    banco.pedidos.insert_many([
+        {"id_pedido": "ana1", "status": "Aguardando definição de entrega", "valor_total": 25.0,
+         "cliente": {"telefone": TELEFONE}, "data_criacao": datetime.utcnow().isoformat()},
+        {"id_pedido": "bruno1", "status": "Aguardando definição de entrega", "valor_total": 50.0,
+         "cliente": {"telefone": "16990000002"}, "data_criacao": datetime.utcnow().isoformat()},
+    ])
+    assert agent_restaurante.pedido_aberto(TELEFONE)["id_pedido"] == "ana1"
+
+    resposta = agent_restaurante.confirmar_pedido.func(id_pedido="ana1", state={})
+    assert "ana1" in resposta
+    assert banco.pedidos.find_one({"id_pedido": "ana1"})["status"] == "Confirmado - Preparando"
+    assert banco.pedidos.find_one({"id_pedido": "bruno1"})["status"] == "Aguardando definição de entrega"
+    assert agent_restaurante.pedido_aberto("16990000003") is None
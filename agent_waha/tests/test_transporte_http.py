@@ -0,0 +1,105 @@
+import http.client
+import io
+import pytest
+import requests
+import urllib3
+from services.transporte_http import CircuitoAberto, Disjuntor, TransporteHTTP, falhou_antes_do_envio
+
+
+def conexao_recusada():
+    motivo = urllib3.exceptions.NewConnectionError(None, "Connection refused")
+    return requests.ConnectionError(urllib3.exceptions.MaxRetryError(None, "/api/sendText", motivo))
+
+
+def conexao_caida():
+    # O servidor fechou a conexão depois de receber o corpo do POST
+    return requests.ConnectionError(urllib3.exceptions.ProtocolError(
+        "Connection aborted.", http.client.RemoteDisconnected("Remote end closed connection without response")
+    ))
+
+
+def resposta(status):
+    resposta = requests.Response()
+    resposta.status_code = status
+    resposta.raw = io.BytesIO()
+    return resposta
+
+
+class SessaoFake:
+    """Devolve (ou levanta) os itens de `roteiro` em ordem, um por request."""
+
+    def __init__(self, *roteiro):
+        self.roteiro = list(roteiro)
+        self.chamadas = 0
+
+    def request(self, metodo, url, **kwargs):
+        self.chamadas += 1
+        item = self.roteiro.pop(0)
+        if isinstance(item, BaseException):
+            raise item
+        return resposta(item)
+
+
+def transporte(*roteiro, **opcoes):
+    cliente = TransporteHTTP("http://waha", backoff=0, **opcoes)
+    cliente._sessao = SessaoFake(*roteiro)
+    return cliente
+
+
+def test_classifica_falhas_antes_do_envio():
+    assert falhou_antes_do_envio(conexao_recusada())
+    assert falhou_antes_do_envio(requests.ConnectTimeout())
+    assert falhou_antes_do_envio(CircuitoAberto())
+    assert not falhou_antes_do_envio(conexao_caida())
+    assert not falhou_antes_do_envio(requests.ReadTimeout())
+
+
+@pytest.mark.parametrize("erro", [conexao_caida(), requests.ReadTimeout()])
+def test_post_nao_repete_quando_pode_ter_chegado(erro):
+    cliente = transporte(erro, 201)
+    with pytest.raises(type(erro)):
+        cliente.post("/api/sendText", json={})
+    assert cliente._sessao.chamadas == 1
+
+
+def test_post_repete_conexao_recusada():
+    cliente = transporte(conexao_recusada(), 201)
+    assert cliente.post("/api/sendText", json={}).status_code == 201
+    assert cliente._sessao.chamadas == 2
+
+
+def test_get_repete_conexao_caida_e_503():
+    cliente = transporte(conexao_caida(), 503, 200)
+    assert cliente.get("/api/sessions").status_code == 200
+    assert cliente._sessao.chamadas == 3
+
+
+def test_disjuntor_abre_e_falha_sem_ir_a_rede():
+    cliente = transporte(*[conexao_recusada()] * 2, tentativas=1, disjuntor=Disjuntor(limite_falhas=2))
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            cliente.get("/api/sessions")
+    with pytest.raises(CircuitoAberto):
+        cliente.get("/api/sessions")
+    assert cliente._sessao.chamadas == 2
+
+
+def test_disjuntor_fecha_depois_do_teste_com_sucesso():
+    disjuntor = Disjuntor(limite_falhas=1, tempo_aberto=0)
+    cliente = transporte(conexao_recusada(), 200, 200, tentativas=1, disjuntor=disjuntor)
+    with pytest.raises(requests.ConnectionError):
+        cliente.get("/api/sessions")
+    assert disjuntor.estado == "meio_aberto"
+    assert cliente.get("/api/sessions").status_code == 200
+    assert disjuntor.estado == "fechado"
+
+
+def test_erro_inesperado_no_teste_nao_prende_o_disjuntor():
+    disjuntor = Disjuntor(limite_falhas=1, tempo_aberto=0)
+    cliente = transporte(conexao_recusada(), ValueError("bug"), 200, tentativas=1, disjuntor=disjuntor)
+    with pytest.raises(requests.ConnectionError):
+        cliente.get("/api/sessions")
+    with pytest.raises(ValueError):
+        cliente.get("/api/sessions")
+    # A chamada de teste seguinte passa (antes o disjuntor ficava "testando" para sempre)
+    assert cliente.get("/api/sessions").status_code == 200
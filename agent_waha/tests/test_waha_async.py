@@ -0,0 +1,42 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+import pytest
+from services.waha_async import WahaAsync
+
+
+def waha(status=201):
+    """WahaAsync com as chamadas HTTP do Waha síncrono trocadas por registros."""
+    cliente = WahaAsync("http://waha-testes")
+    chamadas = []
+    cliente._waha.start_typing = lambda chat_id, session: chamadas.append(("start", chat_id))
+    cliente._waha.stop_typing = lambda chat_id, session: chamadas.append(("stop", chat_id))
+
+    def send_message(chat_id, message, session):
+        chamadas.append(("send", chat_id, message))
+        return SimpleNamespace(status_code=status, text="")
+
+    cliente._waha.send_message = send_message
+    return cliente, chamadas
+
+
+def test_envio_passa_pela_fila_de_saida_e_para_a_digitacao_depois():
+    cliente, chamadas = waha()
+    sessao = f"testes-{uuid.uuid4().hex}"
+    enviado = asyncio.run(cliente.send_message_with_typing("5516990000001@c.us", "oi", sessao, 0))
+    assert enviado is True
+    assert [c[0] for c in chamadas] == ["start", "send", "stop"]
+
+
+def test_envio_recusado_pelo_waha_retorna_false():
+    cliente, chamadas = waha(status=400)
+    sessao = f"testes-{uuid.uuid4().hex}"
+    enviado = asyncio.run(cliente.send_message_with_typing("5516990000001@c.us", "oi", sessao, 0))
+    assert enviado is False
+    assert chamadas[-1][0] == "stop"
+
+
+def test_send_message_direto_verifica_o_status():
+    cliente, _ = waha(status=500)
+    with pytest.raises(RuntimeError):
+        asyncio.run(cliente.send_message("5516990000001@c.us", "oi", "testes"))
@@ -11,7 +11,7 @@ from django.http import Http404
 from django.http import JsonResponse
 from .models import Pedido, PedidoReal
 from datetime import datetime, timedelta
-from .services import whatsapp_service
+from .outbox import gravar_status_com_notificacao, criar_notificacao_status
 
 def atualizar_status_pedido_global(pedido_id: str, novo_status: str, enviar_notificacao: bool = True) -> bool:
     """
@@ -21,7 +21,8 @@ def atualizar_status_pedido_global(pedido_id: str, novo_status: str, enviar_noti
     Args:
         pedido_id: ID do pedido (string)
         novo_status: Novo status do pedido
-        enviar_notificacao: Se deve enviar notificação WhatsApp
+        enviar_notificacao: Se deve enviar notificação WhatsApp (gravada no outbox
+            junto com o status e entregue pelo comando despachar_notificacoes)
     
     Returns:
         bool: True se atualização foi bem-sucedida
@@ -57,37 +58,17 @@ def atualizar_status_pedido_global(pedido_id: str, novo_status: str, enviar_noti
             'descricao': f'Status alterado para: {novo_status}'
         }
         
-        if not pedido.historico_status:
-            pedido.historico_status = []
-        pedido.historico_status.append(historico_entry)
+        # Notificação WhatsApp vai para o outbox: a requisição não espera o Waha
+        notificacao = None
+        if enviar_notificacao and pedido.cliente_telefone:
+            notificacao = criar_notificacao_status(pedido, status_anterior, novo_status)
         
-        # Atualizar status
-        pedido.status = novo_status
-        pedido.data_atualizacao = datetime.now().isoformat()
-        pedido.save()
+        # Atualizar status e gravar a notificação na mesma transação
+        gravar_status_com_notificacao(pedido, novo_status, historico_entry, notificacao)
         
         print(f"✅ Status do pedido {pedido_id} atualizado para: {novo_status}")
-        
-        # Enviar notificação WhatsApp se solicitado
-        if enviar_notificacao and pedido.cliente_telefone:
-            try:
-                sucesso_notificacao = whatsapp_service.enviar_notificacao_status_pedido(
-                    pedido_id=pedido.id_pedido,
-                    cliente_nome=pedido.cliente_nome,
-                    cliente_telefone=pedido.cliente_telefone,
-                    status_anterior=status_anterior,
-                    novo_status=novo_status,
-                    valor_total=pedido.valor_total_final,
-                    tipo_entrega=pedido.tipo_entrega
-                )
-                
-                if sucesso_notificacao:
-                    print(f"✅ Notificação WhatsApp enviada para {pedido.cliente_nome}")
-                else:
-                    print(f"❌ Falha ao enviar notificação WhatsApp")
-                    
-            except Exception as e:
-                print(f"❌ Erro ao enviar notificação WhatsApp: {str(e)}")
+        if notificacao:
+            print(f"📨 Notificação WhatsApp para {pedido.cliente_nome} colocada no outbox")
         
         return True
         
@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+from menu.models import NotificacaoOutbox
+from menu.outbox import DespachanteOutbox
+
+class Command(BaseCommand):
+    help = 'Entrega as notificações de pedido gravadas no outbox (processo em segundo plano)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=2.0,
+                            help='Segundos de espera quando não há notificações pendentes')
+        parser.add_argument('--lote', type=int, default=50)
+        parser.add_argument('--max-tentativas', type=int, default=8,
+                            help='Tentativas antes de a notificação ir para dead letter')
+        parser.add_argument('--uma-vez', action='store_true',
+                            help='Processa um lote e sai (útil em cron)')
+
+    def handle(self, *args, **options):
+        NotificacaoOutbox.ensure_indexes()
+        despachante = DespachanteOutbox(lote=options['lote'], max_tentativas=options['max_tentativas'])
+        self.stdout.write(self.style.SUCCESS('📨 Despachante de notificações iniciado'))
+
+        while True:
+            try:
+                despachante.recuperar_reservas_expiradas()
+                processados = despachante.processar_lote()
+            except Exception as e:
+                self.stderr.write(f'❌ Erro no despachante: {e}')
+                processados = 0
+
+            if options['uma_vez']:
+                break
+            if not processados:
+                time.sleep(options['intervalo'])
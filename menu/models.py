@@ -337,4 +337,39 @@ class PedidoReal(Document):
         """Verifica se precisa de troco"""
         return (self.forma_pagamento == 'dinheiro' and 
                 self.valor_recebido and 
-                self.valor_recebido > self.valor_total_final)
\ No newline at end of file
+                self.valor_recebido > self.valor_total_final)
+
+class NotificacaoOutbox(Document):
+    """
+    Outbox das notificações de pedido: gravado na mesma transação da mudança
+    de status e entregue depois pelo comando despachar_notificacoes
+    """
+    pedido_id = fields.StringField(max_length=50, required=True)
+    tipo = fields.StringField(default='status_pedido')
+    telefone = fields.StringField(max_length=20)
+    # Mensagem já renderizada no momento da mudança de status
+    mensagem = fields.StringField()
+    
+    # pendente -> processando -> enviada; "falhou" = dead letter (esgotou as tentativas)
+    status = fields.StringField(default='pendente')
+    tentativas = fields.IntField(default=0)
+    ultimo_erro = fields.StringField()
+    
+    # Datas
+    criado_em = fields.DateTimeField(default=datetime.utcnow)
+    proxima_tentativa = fields.DateTimeField(default=datetime.utcnow)
+    reservado_em = fields.DateTimeField()
+    enviado_em = fields.DateTimeField()
+    
+    meta = {
+        'collection': 'outbox_notificacoes',
+        'indexes': [
+            ('status', 'criado_em'),
+            'pedido_id',
+            # Enviadas somem depois de 7 dias; as que falharam ficam para análise
+            {'fields': ['enviado_em'], 'expireAfterSeconds': 7 * 24 * 3600},
+        ]
+    }
+    
+    def __str__(self):
+        return f"Notificação {self.tipo} do pedido #{self.pedido_id} ({self.status})"
@@ -0,0 +1,190 @@
+# menu/outbox.py
+
+import random
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+from agent_waha.services.fila_envio import PRIORIDADE_STATUS
+from .models import PedidoReal, NotificacaoOutbox
+from .services import whatsapp_service
+
+logger = logging.getLogger(__name__)
+
+# Código do Mongo standalone para "transações só em replica set/mongos"
+_SEM_SUPORTE_A_TRANSACAO = 20
+
+
+def gravar_status_com_notificacao(pedido: PedidoReal, novo_status: str, historico_entry: Dict[str, Any],
+                                  notificacao: Optional[Dict[str, Any]] = None):
+    """
+    Grava a mudança de status do pedido e o registro do outbox na mesma transação:
+    ou os dois ficam salvos ou nenhum. O envio em si fica com o DespachanteOutbox
+    """
+    pedidos = PedidoReal._get_collection()
+    outbox = NotificacaoOutbox._get_collection()
+
+    atualizacao = {
+        '$set': {'status': novo_status, 'data_atualizacao': datetime.now().isoformat()},
+        '$push': {'historico_status': historico_entry},
+    }
+    registro = NotificacaoOutbox(**notificacao).to_mongo().to_dict() if notificacao else None
+
+    def _gravar(sessao=None):
+        # $push falha se historico_status for null (pedidos antigos): garante uma lista antes
+        pedidos.update_one({'_id': pedido.pk, 'historico_status': {'$not': {'$type': 'array'}}},
+                           {'$set': {'historico_status': []}}, session=sessao)
+        pedidos.update_one({'_id': pedido.pk}, atualizacao, session=sessao)
+        if registro:
+            outbox.insert_one(registro, session=sessao)
+
+    try:
+        with pedidos.database.client.start_session() as sessao:
+            sessao.with_transaction(_gravar)
+    except OperationFailure as e:
+        if e.code != _SEM_SUPORTE_A_TRANSACAO:
+            raise
+        # Mongo standalone (desenvolvimento): grava em sequência, pedido primeiro
+        logger.warning("⚠️ Mongo sem suporte a transações; gravando pedido e outbox em sequência")
+        _gravar()
+
+
+def criar_notificacao_status(pedido: PedidoReal, status_anterior: str, novo_status: str) -> Dict[str, Any]:
+    """
+    Monta o registro do outbox com a mensagem já renderizada (o texto reflete
+    o pedido no momento da mudança, mesmo que seja entregue depois)
+    """
+    mensagem = whatsapp_service._criar_mensagem_status_pedido(
+        pedido.id_pedido, pedido.cliente_nome, status_anterior, novo_status,
+        pedido.valor_total_final, pedido.tipo_entrega
+    )
+    return {
+        'pedido_id': pedido.id_pedido or str(pedido.pk),
+        'tipo': 'status_pedido',
+        'telefone': pedido.cliente_telefone,
+        'mensagem': mensagem,
+    }
+
+
+class NumeroSemWhatsApp(Exception):
+    """O telefone do cliente não está no WhatsApp: retentar não adianta."""
+
+
+class EnvioIncerto(Exception):
+    """O Waha pode ter recebido a mensagem (ex.: timeout de leitura): retentar poderia duplicar."""
+
+
+class DespachanteOutbox:
+    """
+    Entrega as notificações do outbox:
+    - em ordem por pedido: só o registro mais antigo não finalizado de cada
+      pedido é elegível, os seguintes esperam ele ser enviado ou ir para dead letter;
+    - reserva atômica (pendente -> processando), então vários despachantes
+      podem rodar juntos sem enviar em dobro;
+    - falhas voltam para "pendente" com backoff exponencial; depois de
+      `max_tentativas` o registro fica como "falhou" (dead letter);
+    - reservas de um despachante que morreu no meio voltam a ficar pendentes
+      depois de `tempo_reserva` segundos.
+    """
+
+    def __init__(self, lote: int = 50, max_tentativas: int = 8, tempo_reserva: int = 300,
+                 timeout_envio: int = 120, backoff_maximo: int = 3600):
+        self.lote = lote
+        self.max_tentativas = max_tentativas
+        self.tempo_reserva = tempo_reserva
+        self.timeout_envio = timeout_envio
+        self.backoff_maximo = backoff_maximo
+        self.colecao = NotificacaoOutbox._get_collection()
+
+    def recuperar_reservas_expiradas(self) -> int:
+        limite = datetime.utcnow() - timedelta(seconds=self.tempo_reserva)
+        resultado = self.colecao.update_many(
+            {'status': 'processando', 'reservado_em': {'$lt': limite}},
+            {'$set': {'status': 'pendente'}}
+        )
+        if resultado.modified_count:
+            logger.warning(f"⚠️ {resultado.modified_count} notificações com reserva expirada voltaram para a fila")
+        return resultado.modified_count
+
+    def _candidatos(self) -> list:
+        """Primeiro registro não finalizado de cada pedido, se já estiver na hora de tentar"""
+        pipeline = [
+            {'$match': {'status': {'$in': ['pendente', 'processando']}}},
+            {'$sort': {'criado_em': 1, '_id': 1}},
+            {'$group': {'_id': '$pedido_id', 'registro': {'$first': '$$ROOT'}}},
+            {'$replaceRoot': {'newRoot': '$registro'}},
+            {'$match': {'status': 'pendente', 'proxima_tentativa': {'$lte': datetime.utcnow()}}},
+            {'$sort': {'criado_em': 1}},
+            {'$limit': self.lote},
+        ]
+        return list(self.colecao.aggregate(pipeline))
+
+    def _reservar(self, registro: dict) -> Optional[dict]:
+        return self.colecao.find_one_and_update(
+            {'_id': registro['_id'], 'status': 'pendente'},
+            {'$set': {'status': 'processando', 'reservado_em': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _entregar(self, registro: dict):
+        if not registro.get('telefone'):
+            raise NumeroSemWhatsApp("pedido sem telefone")
+        chat_id = whatsapp_service.resolver_chat_id(registro['telefone'])
+        if not chat_id:
+            raise NumeroSemWhatsApp(f"número {registro['telefone']} não está no WhatsApp")
+        enviado = whatsapp_service.entregar_mensagem(chat_id, registro['mensagem'], PRIORIDADE_STATUS,
+                                                     timeout=self.timeout_envio)
+        if enviado is None:
+            raise EnvioIncerto("o Waha não confirmou o envio a tempo; a mensagem pode ter chegado")
+        if not enviado:
+            raise RuntimeError("a fila de envio não confirmou a mensagem")
+
+    def _registrar_falha(self, registro: dict, erro: Exception, definitiva: bool = False):
+        tentativas = registro.get('tentativas', 0) + 1
+        if definitiva or tentativas >= self.max_tentativas:
+            self.colecao.update_one(
+                {'_id': registro['_id']},
+                {'$set': {'status': 'falhou', 'tentativas': tentativas, 'ultimo_erro': str(erro)}}
+            )
+            logger.error(f"❌ Notificação do pedido {registro['pedido_id']} foi para dead letter: {erro}")
+            return
+
+        atraso = min(self.backoff_maximo, 15 * (2 ** (tentativas - 1)))
+        atraso = random.uniform(atraso / 2, atraso)
+        self.colecao.update_one(
+            {'_id': registro['_id']},
+            {'$set': {
+                'status': 'pendente',
+                'tentativas': tentativas,
+                'ultimo_erro': str(erro),
+                'proxima_tentativa': datetime.utcnow() + timedelta(seconds=atraso),
+            }}
+        )
+        logger.warning(f"⚠️ Falha ao notificar pedido {registro['pedido_id']} "
+                       f"(tentativa {tentativas}): {erro}; nova tentativa em {atraso:.0f}s")
+
+    def processar_lote(self) -> int:
+        """Processa os registros elegíveis; retorna quantos foram reservados"""
+        processados = 0
+        for candidato in self._candidatos():
+            registro = self._reservar(candidato)
+            if registro is None:
+                # Outro despachante pegou antes
+                continue
+            processados += 1
+            try:
+                self._entregar(registro)
+            except (NumeroSemWhatsApp, EnvioIncerto) as e:
+                self._registrar_falha(registro, e, definitiva=True)
+                continue
+            except Exception as e:
+                self._registrar_falha(registro, e)
+                continue
+
+            self.colecao.update_one(
+                {'_id': registro['_id']},
+                {'$set': {'status': 'enviada', 'enviado_em': datetime.utcnow()}, '$unset': {'ultimo_erro': ''}}
+            )
+            logger.info(f"✅ Notificação do pedido {registro['pedido_id']} enviada")
+        return processados
@@ -1,14 +1,23 @@
 # menu/services.py
 
-import requests
-import time
-import random
+import threading
 import logging
 from django.conf import settings
+from mongoengine.connection import get_db
 from typing import Optional, Dict, Any
+from agent_waha.services.transporte_http import obter_transporte, falhou_antes_do_envio
+from agent_waha.services.fila_envio import obter_fila_envio, PRIORIDADE_PAGAMENTO, PRIORIDADE_STATUS
+from agent_waha.services.cache_contatos import CacheContatos
 
 logger = logging.getLogger(__name__)
 
+# telefone -> chatId, compartilhado com o bot pela coleção contatos_whatsapp (índice TTL)
+cache_contatos = CacheContatos(
+    ttl=getattr(settings, 'WAHA_CACHE_CONTATOS_TTL', 7 * 24 * 3600),
+    ttl_negativo=getattr(settings, 'WAHA_CACHE_CONTATOS_TTL_NEGATIVO', 3600),
+    obter_colecao=lambda: get_db().contatos_whatsapp,
+)
+
 class WhatsAppNotificationService:
     """
     Serviço para enviar notificações via WhatsApp usando a API Waha
@@ -18,6 +27,16 @@ class WhatsAppNotificationService:
         self.api_url = getattr(settings, 'WAHA_API_URL', 'http://waha:3000')
         self.session_name = getattr(settings, 'WAHA_SESSION_NAME', 'restaurante')
         self.timeout = getattr(settings, 'WAHA_TIMEOUT', 30)
+        # Pool keep-alive, retentativas e disjuntor compartilhados por todo o processo
+        self.transporte = obter_transporte(self.api_url, timeout=(3.05, self.timeout))
+        # Notificações saem pela fila da sessão: respeitam o limite de envio do WhatsApp
+        self.fila_envio = obter_fila_envio(
+            self.session_name,
+            self._enviar_texto,
+            taxa=getattr(settings, 'WAHA_ENVIO_TAXA', 2.0),
+            rajada=getattr(settings, 'WAHA_ENVIO_RAJADA', 5),
+            retentavel=falhou_antes_do_envio,
+        )
     
     def formatar_telefone(self, telefone: str) -> str:
         """
@@ -37,53 +56,60 @@ class WhatsAppNotificationService:
         Verifica se o número existe no WhatsApp e retorna o chat_id
         """
         try:
-            telefone_formatado = self.formatar_telefone(telefone)
-            url = f"{self.api_url}/api/contacts/check-exists"
-            params = {
-                'phone': telefone_formatado.replace('@c.us', ''),
-                'session': self.session_name
-            }
-            
-            response = requests.get(url, params=params, timeout=self.timeout)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("numberExists"):
-                    chat_id = data.get("chatId")
-                    logger.info(f"✅ Número {telefone} encontrado no WhatsApp: {chat_id}")
-                    return chat_id
-                else:
-                    logger.warning(f"❌ Número {telefone} não registrado no WhatsApp")
-                    return None
-            else:
-                logger.error(f"⚠️ Erro na verificação do número {telefone}: {response.status_code}")
-                return None
+            return self.resolver_chat_id(telefone)
                 
         except Exception as e:
             logger.error(f"❌ Erro ao verificar número {telefone}: {str(e)}")
             return None
     
+    def resolver_chat_id(self, telefone: str) -> Optional[str]:
+        """
+        Como verificar_numero_existe, mas levanta exceção se o Waha falhar
+        (o despachante do outbox precisa diferenciar erro de número sem WhatsApp)
+        """
+        telefone_formatado = self.formatar_telefone(telefone)
+        # Mesmo número em vários status do pedido: só a primeira consulta vai ao Waha
+        return cache_contatos.resolver(telefone_formatado.replace('@c.us', ''), self._consultar_numero)
+    
+    def _consultar_numero(self, numero: str) -> Optional[str]:
+        """
+        Consulta o Waha; retorna o chat_id ou None se o número não tiver WhatsApp.
+        Levanta exceção se a API falhar, para o erro não entrar no cache
+        """
+        params = {
+            'phone': numero,
+            'session': self.session_name
+        }
+        
+        response = self.transporte.get("/api/contacts/check-exists", params=params)
+        
+        if response.ok:
+            data = response.json()
+            if data.get("numberExists"):
+                chat_id = data.get("chatId")
+                logger.info(f"✅ Número {numero} encontrado no WhatsApp: {chat_id}")
+                return chat_id
+            else:
+                logger.warning(f"❌ Número {numero} não registrado no WhatsApp")
+                return None
+        
+        raise RuntimeError(f"Erro na verificação do número {numero}: {response.status_code}")
+    
     def enviar_mensagem(self, chat_id: str, mensagem: str) -> bool:
         """
         Envia uma mensagem para o WhatsApp
         """
         try:
-            url = f"{self.api_url}/api/sendText"
-            headers = {'Content-Type': 'application/json'}
             payload = {
                 'session': self.session_name,
                 'chatId': chat_id,
                 'text': mensagem
             }
             
-            response = requests.post(
-                url=url,
-                json=payload,
-                headers=headers,
-                timeout=self.timeout
-            )
+            response = self.transporte.post("/api/sendText", json=payload)
             
-            if response.status_code == 200:
+            # sendText responde 201 Created
+            if response.ok:
                 logger.info(f"✅ Mensagem enviada com sucesso para {chat_id}")
                 return True
             else:
@@ -94,37 +120,87 @@ class WhatsAppNotificationService:
             logger.error(f"❌ Erro ao enviar mensagem para {chat_id}: {str(e)}")
             return False
     
-    def simular_digitacao(self, chat_id: str, duracao: int = 3) -> bool:
+    def _enviar_texto(self, chat_id: str, mensagem: str) -> int:
+        """Chamada usada pela fila de envio; retorna o status HTTP do Waha"""
+        payload = {
+            'session': self.session_name,
+            'chatId': chat_id,
+            'text': mensagem
+        }
+        return self.transporte.post("/api/sendText", json=payload).status_code
+    
+    def enfileirar_mensagem(self, chat_id: str, mensagem: str, prioridade: int = PRIORIDADE_STATUS) -> bool:
         """
-        Simula digitação no WhatsApp
+        Coloca a mensagem na fila de saída da sessão (token bucket + prioridade)
+        """
+        return self.fila_envio.enfileirar(chat_id, mensagem, prioridade)
+    
+    def entregar_mensagem(self, chat_id: str, mensagem: str, prioridade: int = PRIORIDADE_STATUS,
+                          timeout: float = 120) -> Optional[bool]:
+        """
+        Enfileira a mensagem e espera a fila confirmar o envio.
+        Usado pelo despachante do outbox, que precisa do resultado para retentar.
+        Retorna None se o envio teve resultado desconhecido (pode ter chegado)
+        """
+        concluido = threading.Event()
+        resultado = {'enviado': False}
+        
+        def _ao_concluir(enviado: Optional[bool]):
+            resultado['enviado'] = enviado
+            concluido.set()
+        
+        if not self.fila_envio.enfileirar(chat_id, mensagem, prioridade, ao_concluir=_ao_concluir):
+            return False
+        if concluido.wait(timeout):
+            return resultado['enviado']
+        # Não saiu a tempo: tira da fila, senão o outbox retenta e ela sai duas vezes.
+        # Se já estiver sendo enviada, espera o resultado desse envio
+        while not self.fila_envio.cancelar(_ao_concluir):
+            if concluido.wait(5):
+                return resultado['enviado']
+        logger.warning(f"⚠️ Mensagem para {chat_id} retirada da fila de envio após {timeout:.0f}s sem envio")
+        return False
+    
+    def simular_digitacao(self, chat_id: str, mensagem: str, prioridade: int = PRIORIDADE_STATUS) -> bool:
+        """
+        Inicia a digitação e coloca a mensagem na fila de saída; a digitação só
+        para quando a fila concluir o envio (ou desistir). Retorna o resultado do
+        enfileiramento: False se a fila de saída recusar a mensagem
         """
         try:
             # Iniciar digitação
-            start_url = f"{self.api_url}/api/startTyping"
             start_payload = {
                 'session': self.session_name,
                 'chatId': chat_id
             }
             
-            requests.post(start_url, json=start_payload, timeout=self.timeout)
-            
-            # Aguardar um tempo aleatório
-            time.sleep(random.randint(2, duracao))
+            self.transporte.post("/api/startTyping", json=start_payload)
             
-            # Parar digitação
-            stop_url = f"{self.api_url}/api/stopTyping"
+        except Exception as e:
+            # Falha na digitação não impede o envio da mensagem
+            logger.error(f"❌ Erro ao simular digitação para {chat_id}: {str(e)}")
+        
+        enfileirada = self.fila_envio.enfileirar(
+            chat_id, mensagem, prioridade, ao_concluir=lambda enviado: self._parar_digitacao(chat_id)
+        )
+        if not enfileirada:
+            logger.warning(f"❌ Fila de envio recusou a mensagem para {chat_id}")
+            self._parar_digitacao(chat_id)
+        return enfileirada
+    
+    def _parar_digitacao(self, chat_id: str):
+        """
+        Para a digitação (chamado pela fila de saída depois do envio)
+        """
+        try:
             stop_payload = {
                 'session': self.session_name,
                 'chatId': chat_id
             }
             
-            requests.post(stop_url, json=stop_payload, timeout=self.timeout)
-            
-            return True
-            
+            self.transporte.post("/api/stopTyping", json=stop_payload)
         except Exception as e:
-            logger.error(f"❌ Erro ao simular digitação para {chat_id}: {str(e)}")
-            return False
+            logger.error(f"❌ Erro ao parar digitação para {chat_id}: {str(e)}")
     
     def enviar_notificacao_status_pedido(self, pedido_id: str, cliente_nome: str, 
                                         cliente_telefone: str, status_anterior: str, 
@@ -145,11 +221,8 @@ class WhatsAppNotificationService:
                 pedido_id, cliente_nome, status_anterior, novo_status, valor_total, tipo_entrega
             )
             
-            # Simular digitação
-            self.simular_digitacao(chat_id)
-            
-            # Enviar mensagem
-            return self.enviar_mensagem(chat_id, mensagem)
+            # Digitação até a fila de saída enviar a mensagem (prioridade de status)
+            return self.simular_digitacao(chat_id, mensagem, PRIORIDADE_STATUS)
             
         except Exception as e:
             logger.error(f"❌ Erro ao enviar notificação de status: {str(e)}")
@@ -246,8 +319,7 @@ class WhatsAppNotificationService:
                 f"📱 WhatsApp: (11) 99999-9999"
             )
             
-            self.simular_digitacao(chat_id)
-            return self.enviar_mensagem(chat_id, mensagem)
+            return self.simular_digitacao(chat_id, mensagem, PRIORIDADE_PAGAMENTO)
             
         except Exception as e:
             logger.error(f"❌ Erro ao enviar notificação de pagamento: {str(e)}")
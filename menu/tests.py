@@ -1,3 +1,117 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import mongomock
+from django.test import SimpleTestCase
+
+from .models import NotificacaoOutbox
+from . import outbox
+from .outbox import DespachanteOutbox
+
+
+class DespachanteOutboxTests(SimpleTestCase):
+    """Ordem por pedido e dead letter do outbox, com o Mongo em memória (mongomock) e o Waha simulado"""
+
+    def setUp(self):
+        self.colecao = mongomock.MongoClient().restaurante_testes.outbox_notificacoes
+        patcher = mock.patch.object(NotificacaoOutbox, '_get_collection', return_value=self.colecao)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.enviadas = []
+        self.resultado_envio = True
+        servico = mock.patch.object(outbox, 'whatsapp_service')
+        self.whatsapp = servico.start()
+        self.addCleanup(servico.stop)
+        self.whatsapp.resolver_chat_id.side_effect = lambda telefone: f"55{telefone}@c.us"
+        self.whatsapp.entregar_mensagem.side_effect = self._entregar
+
+        self.despachante = DespachanteOutbox(max_tentativas=2)
+        self.agora = datetime.utcnow() - timedelta(minutes=1)
+
+    def _entregar(self, chat_id, mensagem, prioridade, timeout=None):
+        self.enviadas.append(mensagem)
+        return self.resultado_envio
+
+    def _registrar(self, pedido_id, mensagem, segundos=0, **extra):
+        registro = {
+            'pedido_id': pedido_id,
+            'tipo': 'status_pedido',
+            'telefone': '16990000001',
+            'mensagem': mensagem,
+            'status': 'pendente',
+            'tentativas': 0,
+            'criado_em': self.agora + timedelta(seconds=segundos),
+            'proxima_tentativa': self.agora,
+            **extra,
+        }
+        return self.colecao.insert_one(registro).inserted_id
+
+    def _status(self, registro_id):
+        return self.colecao.find_one({'_id': registro_id})['status']
+
+    def test_envia_um_registro_por_pedido_na_ordem(self):
+        primeiro = self._registrar('p1', 'Em preparo', 0)
+        segundo = self._registrar('p1', 'Pronto', 1)
+        outro = self._registrar('p2', 'Em preparo', 2)
+
+        self.assertEqual(self.despachante.processar_lote(), 2)
+        self.assertEqual(self.enviadas, ['Em preparo', 'Em preparo'])
+        self.assertEqual(self._status(primeiro), 'enviada')
+        self.assertEqual(self._status(segundo), 'pendente')
+        self.assertEqual(self._status(outro), 'enviada')
+
+        self.assertEqual(self.despachante.processar_lote(), 1)
+        self.assertEqual(self.enviadas[-1], 'Pronto')
+
+    def test_registro_com_falha_segura_os_seguintes_do_pedido(self):
+        primeiro = self._registrar('p1', 'Em preparo', 0)
+        segundo = self._registrar('p1', 'Pronto', 1)
+        self.resultado_envio = False
+
+        self.despachante.processar_lote()
+        registro = self.colecao.find_one({'_id': primeiro})
+        self.assertEqual((registro['status'], registro['tentativas']), ('pendente', 1))
+        self.assertGreater(registro['proxima_tentativa'], datetime.utcnow())
+
+        # Em backoff: o seguinte do mesmo pedido não passa na frente
+        self.assertEqual(self.despachante.processar_lote(), 0)
+        self.assertEqual(self._status(segundo), 'pendente')
+
+    def test_dead_letter_depois_de_max_tentativas_libera_o_proximo(self):
+        primeiro = self._registrar('p1', 'Em preparo', 0, tentativas=1)
+        self._registrar('p1', 'Pronto', 1)
+        self.resultado_envio = False
+
+        self.despachante.processar_lote()
+        registro = self.colecao.find_one({'_id': primeiro})
+        self.assertEqual((registro['status'], registro['tentativas']), ('falhou', 2))
+
+        self.resultado_envio = True
+        self.despachante.processar_lote()
+        self.assertEqual(self.enviadas[-1], 'Pronto')
+
+    def test_envio_incerto_vai_direto_para_dead_letter(self):
+        registro_id = self._registrar('p1', 'Em preparo')
+        self.resultado_envio = None
+
+        self.despachante.processar_lote()
+        self.assertEqual(self._status(registro_id), 'falhou')
+        self.assertEqual(len(self.enviadas), 1)
+
+    def test_numero_sem_whatsapp_vai_direto_para_dead_letter(self):
+        registro_id = self._registrar('p1', 'Em preparo')
+        self.whatsapp.resolver_chat_id.side_effect = lambda telefone: None
+
+        self.despachante.processar_lote()
+        self.assertEqual(self._status(registro_id), 'falhou')
+        self.assertEqual(self.enviadas, [])
+
+    def test_reserva_expirada_volta_a_ficar_pendente(self):
+        registro_id = self._registrar('p1', 'Em preparo', status='processando',
+                                      reservado_em=datetime.utcnow() - timedelta(hours=1))
+        self.assertEqual(self.despachante.processar_lote(), 0)
+
+        self.assertEqual(self.despachante.recuperar_reservas_expiradas(), 1)
+        self.assertEqual(self.despachante.processar_lote(), 1)
+        self.assertEqual(self._status(registro_id), 'enviada')